@@ -0,0 +1,88 @@
+"""Seeded synthetic data for benchmarks"""
+
+import random
+import sqlite3
+from datetime import datetime, timedelta
+from calc_seduc.connection import connect
+from calc_seduc.schema import create_schema
+
+
+# Hour loads most contracts have
+HOURS = [2, 4, 5, 6, 10, 12, 14, 17, 20, 40]
+
+# Payment tables cover these years, six months each
+FIRST_YEAR = 2020
+LAST_YEAR = 2023
+
+
+def generate(
+    contracts: int, seed: int = 42, path: str = ":memory:", conn=None
+) -> sqlite3.Connection:
+    """Fill a database with schools, contracts, payment tables and earnings.
+
+    The same seed and size always give the same rows. There is one school
+    for every 100 contracts and one earning for every contract"""
+    rng = random.Random(seed)
+    if conn is None:
+        conn = connect(path)
+    create_schema(conn)
+    cur = conn.cursor()
+
+    schools = max(contracts // 100, 1)
+    cur.executemany(
+        "insert into tb_school (name, inep) values (?, ?)",
+        ((f"EEFM {i:06d}", 23000000 + i) for i in range(schools)),
+    )
+
+    tables = []
+    for year in range(FIRST_YEAR, LAST_YEAR + 1):
+        # In thousandths of real
+        hour_value = 14000 + (year - FIRST_YEAR) * 1600
+        tables.append((datetime(year, 1, 1), datetime(year, 6, 30), hour_value))
+        tables.append((datetime(year, 7, 1), datetime(year, 12, 31), hour_value))
+    cur.executemany(
+        """
+        insert into tb_paymenttable (starts, ends, hour_value, prv, eoy_bonus)
+        values (?, ?, ?, 0, 0)
+        """,
+        tables,
+    )
+
+    first_day = datetime(FIRST_YEAR, 1, 1)
+    days = (datetime(LAST_YEAR, 12, 31) - first_day).days
+
+    def contract_rows():
+        for i in range(contracts):
+            starts = first_day + timedelta(days=rng.randrange(days - 30))
+            ends = min(
+                starts + timedelta(days=rng.randrange(30, 400)),
+                datetime(LAST_YEAR, 12, 31),
+            )
+            yield (
+                rng.randrange(schools) + 1,
+                f"222{i:011d}",
+                starts,
+                ends,
+                rng.choice(HOURS),
+            )
+
+    cur.executemany(
+        """
+        insert into tb_contract (school_id, contract_id, starts, ends, hours)
+        values (?, ?, ?, ?, ?)
+        """,
+        contract_rows(),
+    )
+
+    cur.executemany(
+        'insert into tb_earning ("date", value) values (?, ?)',
+        (
+            (
+                first_day + timedelta(days=rng.randrange(days)),
+                rng.randrange(3000, 250000),
+            )
+            for _ in range(contracts)
+        ),
+    )
+    conn.commit()
+    return conn
@@ -0,0 +1,226 @@
+"""Benchmark of every calc_seduc pipeline stage, alone and end to end.
+
+Usage: python -m benchmarks.pipeline --sizes 1000 100000 --output run.json
+       [--baseline previous.json --tolerance 0.25]
+
+Every size gets its own generated database (benchmarks.data, seeded). Each
+stage reports wall time, rows, rows per second and the peak memory traced
+by tracemalloc while it ran (timings include tracemalloc overhead). With a
+baseline, stages slower than baseline by more than tolerance are listed and
+the exit code is 1"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+from benchmarks.data import generate
+from calc_seduc.async_controller import AsyncController
+from calc_seduc.calendar import CalendarIndex, Month
+from calc_seduc.connection import connect
+from calc_seduc.controller import Controller
+from calc_seduc.export import CsvExporter
+from calc_seduc.importer import SpreadsheetImporter
+from calc_seduc.models import ContractFactory, PaymentTableFactory, PerHourPayment
+from calc_seduc.processors import FormulaProcessor, PerHourProcessor
+from calc_seduc.reconciliation import reconcile
+from calc_seduc.schema import create_schema
+
+
+# Reference period processed by the benchmark
+YEAR, MONTH = 2022, 2
+
+
+def measure(func: Callable[[], int]) -> Dict[str, float]:
+    """Run func, which returns how many rows it handled, and time it"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = func()
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": round(seconds, 6),
+        "rows": rows,
+        "rows_per_second": round(rows / seconds, 1) if seconds else 0.0,
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def run_size(size: int, seed: int) -> Dict[str, Dict[str, float]]:
+    """Benchmark every stage over a database with size contracts"""
+    conn = generate(size, seed=seed)
+    results = {}
+    state: Dict[str, List] = {}
+
+    def load_contracts():
+        state["contracts"] = ContractFactory().get_all(conn)
+        return len(state["contracts"])
+
+    def load_batch():
+        state["batch"] = ContractFactory().get_batch(conn)
+        return len(state["batch"])
+
+    def unprocessed():
+        return len(list(ContractFactory().get_unprocessed(YEAR, MONTH, conn)))
+
+    def calendar_month():
+        months = [(y, m) for y in range(2020, 2024) for m in range(1, 13)]
+        for year, month in months * 10:
+            Month(year, month)
+        return len(months) * 10
+
+    def calendar_index():
+        months = [(y, m) for y in range(2020, 2024) for m in range(1, 13)]
+        index = CalendarIndex()
+        for year, month in months * 10:
+            index.month_weeks(year, month)
+        return len(months) * 10
+
+    processor = PerHourProcessor(PaymentTableFactory().get_all(conn), conn)
+
+    def process_per_call():
+        for contract in state["contracts"]:
+            processor.process(contract, YEAR, MONTH)
+        return len(state["contracts"])
+
+    def process_many():
+        state["payments"] = processor.process_many(state["contracts"], [(YEAR, MONTH)])
+        return len(state["payments"])
+
+    def process_batch():
+        return len(processor.process_many(state["batch"], [(YEAR, MONTH)]))
+
+    formula_processor = FormulaProcessor(PaymentTableFactory().get_all(conn), conn)
+
+    def process_formula():
+        payments = formula_processor.process_many(state["contracts"], [(YEAR, MONTH)])
+        return len(payments)
+
+    def save():
+        PerHourPayment.save_many(state["payments"], conn=conn)
+        return len(state["payments"])
+
+    def export():
+        with tempfile.TemporaryDirectory() as directory:
+            stats = CsvExporter(conn).export(os.path.join(directory, "p.csv"))
+        return stats.rows
+
+    def reconciliation():
+        return len(reconcile(conn).periods)
+
+    def import_contracts():
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "contracts.csv")
+            with open(path, "w", encoding="utf-8", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(
+                    ["contract_id", "inep", "school", "starts", "ends", "hours"]
+                )
+                writer.writerows(
+                    conn.execute(
+                        """
+                        select c.contract_id, s.inep, s.name, date(c.starts),
+                               date(c.ends), c.hours
+                        from tb_contract c join tb_school s on s.id = c.school_id
+                        """
+                    )
+                )
+            target = connect(":memory:")
+            create_schema(target)
+            stats = SpreadsheetImporter(target).import_contracts(path)
+            target.close()
+        return stats.rows
+
+    stages: List[Tuple[str, Callable[[], int]]] = [
+        ("load_contracts", load_contracts),
+        ("load_batch", load_batch),
+        ("unprocessed", unprocessed),
+        ("calendar_month", calendar_month),
+        ("calendar_index", calendar_index),
+        ("process_per_call", process_per_call),
+        ("process_many", process_many),
+        ("process_batch", process_batch),
+        ("process_formula", process_formula),
+        ("save", save),
+        ("export", export),
+        ("reconcile", reconciliation),
+        ("import_contracts", import_contracts),
+    ]
+    for name, stage in stages:
+        results[name] = measure(stage)
+    conn.close()
+
+    def end_to_end(controller_class=Controller):
+        conn = connect(":memory:", check_same_thread=False)
+        generate(size, seed=seed, conn=conn)
+        with tempfile.TemporaryDirectory() as directory:
+            controller = controller_class(
+                contract_factory=ContractFactory(),
+                ptable_factory=PaymentTableFactory,
+                processor=PerHourProcessor,
+                conn=conn,
+                export_path=os.path.join(directory, "payments.csv"),
+                ref_year=YEAR,
+                ref_month=MONTH,
+            )
+            controller()
+        conn.close()
+        return len(controller.payments)
+
+    results["end_to_end"] = measure(end_to_end)
+    results["end_to_end_async"] = measure(lambda: end_to_end(AsyncController))
+    return results
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """List stages slower than baseline by more than tolerance"""
+    regressions = []
+    for size, stages in current["results"].items():
+        for stage, result in stages.items():
+            before = baseline["results"].get(size, {}).get(stage)
+            if before and result["seconds"] > before["seconds"] * (1 + tolerance):
+                regressions.append(
+                    f"{size} {stage}: {before['seconds']}s -> {result['seconds']}s"
+                )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write results to this json file")
+    parser.add_argument("--baseline", help="compare with this json file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    current = {
+        "meta": {
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "results": {str(size): run_size(size, args.seed) for size in args.sizes},
+    }
+    print(json.dumps(current, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(current, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(current, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        return int(bool(regressions))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""Startup budget of calc_seduc entry points.
+
+Imports every module in a fresh interpreter with `python -X importtime`,
+keeps the median cumulative import time of a few runs and compares it with
+its budget. Run it with `python -m benchmarks.startup`; it exits with 1 when
+a module goes over budget"""
+
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict
+
+
+# Module -> import time budget, in microseconds
+BUDGETS = {
+    "calc_seduc.models": 40_000,
+    "calc_seduc.processors": 100_000,
+    "calc_seduc.controller": 120_000,
+}
+
+
+def import_time(module: str, runs: int = 5) -> int:
+    """Median cumulative import time of a module, in microseconds"""
+    times = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            _, cumulative, name = line.rsplit("|", 2)
+            if name.strip() == module:
+                times.append(int(cumulative))
+    return int(statistics.median(times))
+
+
+def main() -> int:
+    results: Dict[str, Dict[str, int]] = {
+        module: {"us": import_time(module), "budget_us": budget}
+        for module, budget in BUDGETS.items()
+    }
+    print(json.dumps(results, indent=2))
+    return int(any(r["us"] > r["budget_us"] for r in results.values()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""Module with a Controller whose stages run concurrently"""
+
+import asyncio
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Tuple,
+    Type,
+    cast,
+)
+from calc_seduc.connection import connect, provider
+from calc_seduc.controller import Controller
+from calc_seduc.models import (
+    AbstractContract,
+    ContractFactory,
+    PaymentTableFactory,
+)
+from calc_seduc.processors import AbstractProcessor
+from calc_seduc.utils import chunked
+
+if TYPE_CHECKING:
+    from calc_seduc.export import CsvExporter
+    from calc_seduc.reconciliation import Reconciliation
+
+
+class AsyncController(Controller):
+    """Controller that overlaps fetching, processing and saving.
+
+    Contracts are fetched chunk_size at a time and handed to the process
+    stage, whose payments are handed to the save stage, through queues of
+    at most queue_size chunks: a stage that runs ahead waits for the next
+    one, so memory is bounded. Every sqlite call runs on a single database
+    thread, processing on another thread (or on a pool of workers
+    processes, when workers > 1). Payments, saved rows and the csv are
+    the same a Controller gives.
+
+    The connection is used from the database thread, so it must be opened
+    with check_same_thread=False (see connection.connect). Without one, a
+    connection to the provider database is opened that way"""
+
+    def __init__(
+        self,
+        contract_factory: ContractFactory,
+        ptable_factory: Type[PaymentTableFactory],
+        processor: Type[AbstractProcessor],
+        conn=None,
+        queue_size: int = 4,
+        **kwargs,
+    ):
+        if conn is None:
+            conn = connect(
+                provider.database, check_same_thread=False, profile=provider.profile
+            )
+        super().__init__(contract_factory, ptable_factory, processor, conn, **kwargs)
+        self.queue_size = queue_size
+        # Seconds spent on the blocking work of every stage
+        self.busy: Dict[str, float] = defaultdict(float)
+
+    def __call__(self):
+        """Executes the pipeline on a new event loop"""
+        asyncio.run(self.run())
+
+    async def run(self) -> None:
+        """Executes fetch, process and save concurrently, then export and,
+        with reconcile, compare earnings with the saved payments"""
+        instrumentation = self.instrumentation
+        contracts: asyncio.Queue = asyncio.Queue(self.queue_size)
+        payments: asyncio.Queue = asyncio.Queue(self.queue_size)
+        db = ThreadPoolExecutor(1, thread_name_prefix="calc_seduc-db")
+        with db, self.compute_executor() as compute:
+            with instrumentation.stage("pipeline", self.conn) as stage:
+                await self.gather(
+                    self.fetch(db, contracts),
+                    self.process(compute, contracts, payments),
+                    self.save(db, payments),
+                )
+                stage.rows = len(self.payments)
+                stage.extra["failed_chunks"] = len(self.failures)
+                stage.extra.update(
+                    {f"{name}_seconds": busy for name, busy in self.busy.items()}
+                )
+            with instrumentation.stage("export", self.conn) as stage:
+                await self.blocking(db, "export", self.export_csv)
+                # Set by export_csv, as reconciliation by reconcile_earnings
+                stage.rows = cast("CsvExporter", self.exporter).stats.rows
+            if self.reconcile:
+                with instrumentation.stage("reconcile", self.conn) as stage:
+                    await self.blocking(db, "reconcile", self.reconcile_earnings)
+                    reconciliation = cast("Reconciliation", self.reconciliation)
+                    stage.rows = len(reconciliation.periods)
+                    stage.extra.update(reconciliation.summary())
+        instrumentation.finish()
+
+    def compute_executor(self) -> Executor:
+        """Return the executor contracts are processed on"""
+        if self.workers > 1:
+            from calc_seduc.parallel import _init_worker
+
+            return ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.processor,),
+            )
+        return ThreadPoolExecutor(1, thread_name_prefix="calc_seduc-process")
+
+    @staticmethod
+    async def gather(*stages: Awaitable) -> None:
+        """Run stages concurrently, cancelling the others if one fails"""
+        tasks = [asyncio.ensure_future(stage) for stage in stages]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def blocking(
+        self, executor: Executor, stage: str, func: Callable, *args
+    ) -> Any:
+        """Run func on an executor, adding its time to the stage busy time"""
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, func, *args
+            )
+        finally:
+            self.busy[stage] += time.perf_counter() - started
+
+    async def fetch(self, db: Executor, queue: asyncio.Queue) -> None:
+        """Put chunks of non processed contracts on queue, then None"""
+        if self.incremental:
+            await self.blocking(db, "fetch", self.get_non_processed_contracts)
+            chunks = chunked(self.unprocessed, self.chunk_size)
+        else:
+            contracts = self.contract_factory.get_unprocessed(
+                self.ref_year,
+                self.ref_month,
+                conn=self.conn,
+                chunk_size=self.batch_size,
+                payment_table=self.payment_type.table,
+            )
+            chunks = chunked(contracts, self.chunk_size)
+        while True:
+            chunk = await self.blocking(db, "fetch", next, chunks, None)
+            if chunk is None:
+                break
+            if not self.incremental:
+                self.unprocessed.extend(chunk)
+            await queue.put(chunk)
+        await queue.put(None)
+
+    async def process(
+        self,
+        compute: Executor,
+        contracts: asyncio.Queue,
+        payments: asyncio.Queue,
+    ) -> None:
+        """Process chunks from contracts, putting their payments on payments
+        in the same order, then None. Up to workers chunks are processed at
+        the same time"""
+        if self.workers > 1:
+            from calc_seduc.parallel import ChunkFailure, _process_chunk
+
+            process_chunk = _process_chunk
+        else:
+            process_chunk = self.processor.process_many
+        periods = [(self.ref_year, self.ref_month)]
+        process_date = datetime.now()
+        pending: Deque[Tuple[int, List[AbstractContract], asyncio.Future]] = deque()
+
+        async def forward_oldest() -> None:
+            index, chunk, future = pending.popleft()
+            try:
+                result = await future
+            except Exception as error:
+                if self.workers == 1:
+                    raise
+                self.failures.append(
+                    ChunkFailure(
+                        chunk=index,
+                        contract_ids=[cast(int, contract.id) for contract in chunk],
+                        error=repr(error),
+                    )
+                )
+                return
+            await payments.put(result)
+
+        index = 0
+        while (chunk := await contracts.get()) is not None:
+            future = asyncio.ensure_future(
+                self.blocking(
+                    compute, "process", process_chunk, chunk, periods, process_date
+                )
+            )
+            pending.append((index, chunk, future))
+            index += 1
+            if len(pending) >= self.workers:
+                await forward_oldest()
+        while pending:
+            await forward_oldest()
+        await payments.put(None)
+
+    async def save(self, db: Executor, queue: asyncio.Queue) -> None:
+        """Save chunks of payments from queue as they arrive. Payments of
+        replaced contracts are deleted in the transaction of the first one"""
+        deleted = False
+        while (chunk := await queue.get()) is not None:
+            self.payments.extend(chunk)
+            if not deleted:
+                await self.blocking(db, "save", self.delete_replaced)
+                deleted = True
+            await self.blocking(db, "save", self.save_payments, chunk)
+        if not deleted:
+            await self.blocking(db, "save", self.delete_replaced)
+        await self.blocking(db, "save", self.finish_save)
@@ -0,0 +1,181 @@
+"""Caches shared by the model factories and the processors"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+# Marks configure arguments that were not given, since ttl=None is valid
+_UNSET = object()
+
+
+@dataclass(slots=True)
+class CacheStats:
+    """Counters used to size an IdentityMap"""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Return the share of lookups answered by the cache"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class IdentityMap:
+    """Bounded cache of model objects by (connection, table, id).
+
+    Entries are evicted least recently used first when max_size is reached,
+    and expire ttl seconds after being stored (ttl=None never expires).
+    sqlite3 connections can't be weak referenced, so entries are keyed by the
+    connection id: call forget(conn) when closing a connection, so a new one
+    reusing its id doesn't see stale objects. Model saves call invalidate"""
+
+    def __init__(self, max_size: int = 10_000, ttl: Optional[float] = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[Tuple[int, str, Hashable], Tuple[Any, float]]"
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def configure(self, max_size: Optional[int] = None, ttl: Any = _UNSET) -> None:
+        """Change size and ttl limits, evicting entries above the new size"""
+        if max_size is not None:
+            self.max_size = max_size
+        if ttl is not _UNSET:
+            self.ttl = ttl
+        self._shrink()
+
+    def get(self, conn, table: str, id: Hashable) -> Optional[Any]:
+        """Return the cached object, or None if it's missing or expired"""
+        key = (_conn_key(conn), table, id)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+
+        obj, stored = entry
+        if self.ttl is not None and time.monotonic() - stored > self.ttl:
+            del self._entries[key]
+            self.stats.evictions += 1
+            self.stats.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return obj
+
+    def put(self, conn, table: str, id: Hashable, obj: Any) -> None:
+        """Store an object, evicting the least recently used ones if needed"""
+        key = (_conn_key(conn), table, id)
+        self._entries[key] = (obj, time.monotonic())
+        self._entries.move_to_end(key)
+        self._shrink()
+
+    def invalidate(self, conn, table: str, id: Optional[Hashable] = None) -> None:
+        """Drop one object, or every object of a table if id is None"""
+        if id is not None:
+            if self._entries.pop((_conn_key(conn), table, id), None) is not None:
+                self.stats.invalidations += 1
+            return
+
+        conn_key = _conn_key(conn)
+        for key in [k for k in self._entries if k[:2] == (conn_key, table)]:
+            del self._entries[key]
+            self.stats.invalidations += 1
+
+    def forget(self, conn) -> None:
+        """Drop every object read through a connection"""
+        conn_key = _conn_key(conn)
+        for key in [k for k in self._entries if k[0] == conn_key]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        """Drop every object and reset statistics"""
+        self._entries.clear()
+        self.stats = CacheStats()
+
+    def _shrink(self) -> None:
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+
+def _conn_key(conn) -> int:
+    return id(conn)
+
+
+# Identity map used by every model factory
+identity_map = IdentityMap()
+
+
+@dataclass(slots=True)
+class MonthRate:
+    """Memoized values of a payment table in a month.
+
+    source is whatever the values were computed from (e.g. hour value times
+    workdays), values maps a contract load (e.g. total hours) to its value"""
+
+    source: Any
+    values: Dict[Any, Any]
+
+
+class RateCache:
+    """Bounded cache of MonthRate by (payment table id, year, month, kind).
+
+    kind tells apart the values of different processors for the same table
+    and month. An entry is only returned when its source equals the one
+    asked for, so a stale entry (a table changed in memory, or another
+    database reusing the id) is replaced instead of used. Payment table
+    saves call invalidate"""
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[Tuple[int, int, int, Hashable], MonthRate]"
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def rate(
+        self, table_id: int, year: int, month: int, kind: Hashable, source: Hashable
+    ) -> MonthRate:
+        """Return the rate of a table in a month, empty if none was cached
+        from the same source"""
+        key = (table_id, year, month, kind)
+        rate = self._entries.get(key)
+        if rate is not None and rate.source == source:
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return rate
+
+        self.stats.misses += 1
+        rate = self._entries[key] = MonthRate(source, {})
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+        return rate
+
+    def invalidate(self, table_id: Optional[int] = None) -> None:
+        """Drop the rates of one payment table, or of every one if None"""
+        for key in [k for k in self._entries if table_id is None or k[0] == table_id]:
+            del self._entries[key]
+            self.stats.invalidations += 1
+
+    def clear(self) -> None:
+        """Drop every rate and reset statistics"""
+        self._entries.clear()
+        self.stats = CacheStats()
+
+
+# Rate cache used by every processor
+rate_cache = RateCache()
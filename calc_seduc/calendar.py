@@ -1,8 +1,9 @@
 """Module that deals with weeks, dates and stuff"""
 
 import calendar
-from datetime import datetime, timedelta
-from typing import List, Optional
+from array import array
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 
 class InvalidWeek(Exception):
@@ -30,7 +31,7 @@ class Month:
     def __init__(self, year: int, month: int):
         self.year = year
         self.month = month
-        self.weeks = []
+        self.weeks: List[Week] = []
         self.generate_weeks()
 
     def generate_weeks(self) -> None:
@@ -69,3 +70,175 @@ class Month:
 
         def __repr__(self):
             return f"Month(year={self.year}, month={self.month}, weeks={self.weeks}))"
+
+
+def month_range(year: int, month: int) -> Tuple[datetime, datetime]:
+    """Return the first moment of a month and of the month after it"""
+    if month == 12:
+        return datetime(year, 12, 1), datetime(year + 1, 1, 1)
+    return datetime(year, month, 1), datetime(year, month + 1, 1)
+
+
+# A holiday set is a callable that returns the holidays of a given year
+HolidaySet = Callable[[int], Iterable[date]]
+
+
+def easter(year: int) -> date:
+    """Return Easter Sunday of a given year (anonymous gregorian algorithm)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7  # noqa: E741
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def national_holidays(year: int) -> List[date]:
+    """Brazilian national holidays of a given year"""
+    holidays = [
+        date(year, 1, 1),
+        easter(year) - timedelta(days=2),  # Good Friday
+        date(year, 4, 21),
+        date(year, 5, 1),
+        date(year, 9, 7),
+        date(year, 10, 12),
+        date(year, 11, 2),
+        date(year, 11, 15),
+        date(year, 12, 25),
+    ]
+    if year >= 2024:
+        holidays.append(date(year, 11, 20))
+    return holidays
+
+
+def ceara_holidays(year: int) -> List[date]:
+    """Ceará state holidays of a given year"""
+    return [date(year, 3, 19), date(year, 3, 25)]
+
+
+class YearIndex:
+    """Workdays of a single year, stored as one flag per day plus the
+    cumulative count of workdays, so ranges are answered in O(1)"""
+
+    __slots__ = ("year", "first_ordinal", "flags", "cumulative")
+
+    def __init__(self, year: int, holidays: Iterable[date] = ()):
+        self.year = year
+        self.first_ordinal = date(year, 1, 1).toordinal()
+        days = 366 if calendar.isleap(year) else 365
+        off = {day.toordinal() - self.first_ordinal for day in holidays}
+
+        # ordinal % 7 is 6 on saturdays and 0 on sundays
+        self.flags = bytearray(
+            (self.first_ordinal + i) % 7 not in (0, 6) and i not in off
+            for i in range(days)
+        )
+        self.cumulative = array("H", [0])
+        for flag in self.flags:
+            self.cumulative.append(self.cumulative[-1] + flag)
+
+    def workdays(self, first: int, last: int) -> int:
+        """Workdays between two day-of-year offsets (0 based, both included)"""
+        return self.cumulative[last + 1] - self.cumulative[first]
+
+
+class CalendarIndex:
+    """Precomputed, holiday-aware workday calendar.
+
+    Every year is computed once, on first use, from the given holiday sets
+    (e.g. `CalendarIndex(holidays=(national_holidays, ceara_holidays))`).
+    Without holiday sets only weekends are days off, matching Month"""
+
+    def __init__(
+        self,
+        holidays: Iterable[HolidaySet] = (),
+        extra: Iterable[date] = (),
+    ):
+        self.holidays = tuple(holidays)
+        self.extra = frozenset(extra)
+        self._years: Dict[int, YearIndex] = {}
+        self._weeks: Dict[Tuple[int, int], Tuple[int, ...]] = {}
+        self._bounds: Dict[Tuple[int, int], Tuple[int, int]] = {}
+
+    def year(self, year: int) -> YearIndex:
+        """Return the YearIndex of a given year, computing it if needed"""
+        index = self._years.get(year)
+        if index is None:
+            days = {day for day in self.extra if day.year == year}
+            for holiday_set in self.holidays:
+                days.update(holiday_set(year))
+            index = self._years[year] = YearIndex(year, days)
+        return index
+
+    def is_workday(self, day: date) -> bool:
+        """Check if a given day is a workday"""
+        index = self.year(day.year)
+        return bool(index.flags[day.toordinal() - index.first_ordinal])
+
+    def workdays_between(self, starts: date, ends: date) -> int:
+        """Workdays between two dates, both included"""
+        if ends < starts:
+            return 0
+
+        total = 0
+        for year in range(starts.year, ends.year + 1):
+            index = self.year(year)
+            first = 0
+            last = len(index.flags) - 1
+            if year == starts.year:
+                first = starts.toordinal() - index.first_ordinal
+            if year == ends.year:
+                last = ends.toordinal() - index.first_ordinal
+            total += index.workdays(first, last)
+        return total
+
+    def month_weeks(self, year: int, month: int) -> Tuple[int, ...]:
+        """Workdays of every week in a month.
+
+        Weeks are split on sundays the same way Month.generate_weeks does it,
+        including the empty weekend weeks Month keeps"""
+        weeks = self._weeks.get((year, month))
+        if weeks is not None:
+            return weeks
+
+        index = self.year(year)
+        first = date(year, month, 1).toordinal() - index.first_ordinal
+        last = first + calendar.monthrange(year, month)[1] - 1
+        result = []
+        starts = first
+        while starts <= last:
+            # Offset of the sunday that closes this week
+            ends = min(starts + 6 - (index.first_ordinal + starts - 1) % 7, last)
+            # A month starting on sunday has no first week in Month
+            if ends != starts or index.flags[starts]:
+                result.append(index.workdays(starts, ends))
+            starts = ends + 1
+
+        weeks = self._weeks[(year, month)] = tuple(result)
+        return weeks
+
+    def month_bounds(self, year: int, month: int) -> Tuple[int, int]:
+        """Ordinals of the first and last days of a month"""
+        bounds = self._bounds.get((year, month))
+        if bounds is None:
+            first = date(year, month, 1).toordinal()
+            last = first + calendar.monthrange(year, month)[1] - 1
+            bounds = self._bounds[(year, month)] = (first, last)
+        return bounds
+
+    def month_workdays(self, year: int, month: int, starts: int, ends: int) -> int:
+        """Workdays of a month between two day ordinals, both included.
+
+        Answered from the cumulative workday counts of the year, so its
+        cost doesn't depend on how many days the range has"""
+        first, last = self.month_bounds(year, month)
+        starts, ends = max(starts, first), min(ends, last)
+        if ends < starts:
+            return 0
+        index = self.year(year)
+        return index.workdays(starts - index.first_ordinal, ends - index.first_ordinal)
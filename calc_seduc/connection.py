@@ -1,10 +1,235 @@
-"""Default connection for database"""
+"""Connections for database.
 
+Nothing is opened on import: ConnectionProvider opens connections lazily,
+one per thread for reads and writes made through models, plus a small pool
+of extra connections for readers that must not wait for the writer (e.g.
+exports). The database path comes from the CALC_SEDUC_DB environment
+variable, "db.sqlite" by default, and can be changed with configure.
+
+Every connection is tuned by a Profile. The default one uses write ahead
+logging, so readers never block the writer nor the writer them"""
+
+import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional, Union
+from calc_seduc.cache import identity_map
+
+
+# Default database path
+DATABASE = "db.sqlite"
+
+
+@dataclass(frozen=True)
+class Profile:
+    """SQLite settings applied to a connection with PRAGMA statements"""
+
+    name: str
+    journal_mode: str = "wal"
+    synchronous: str = "normal"
+    cache_size: int = -64_000  # negative is KiB, so 64 MiB
+    mmap_size: int = 256 * 2**20
+    temp_store: str = "memory"
+    busy_timeout: int = 5_000  # milliseconds
+
+
+PROFILES: Dict[str, Profile] = {
+    # Durable across crashes (synchronous=normal is safe with wal), readers
+    # and the writer don't block each other
+    "default": Profile("default"),
+    # For backfills and imports: larger cache and mmap, longer busy timeout.
+    # synchronous stays normal, which keeps the database safe with wal;
+    # with off an OS crash or power loss may corrupt it
+    "bulk_load": Profile(
+        "bulk_load",
+        cache_size=-512_000,
+        mmap_size=2**30,
+        busy_timeout=30_000,
+    ),
+}
+
+# Names SQLite reads synchronous and temp_store back as
+SYNCHRONOUS = {0: "off", 1: "normal", 2: "full", 3: "extra"}
+TEMP_STORE = {0: "default", 1: "file", 2: "memory"}
+
+
+def get_profile(profile: Union[str, Profile]) -> Profile:
+    """Return a Profile given itself or its name in PROFILES"""
+    if isinstance(profile, Profile):
+        return profile
+    try:
+        return PROFILES[profile]
+    except KeyError:
+        raise KeyError(f"Unknown connection profile: {profile}") from None
+
+
+def settings(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """Return the profile settings a connection is using, as SQLite reports
+    them (e.g. in memory databases always use the memory journal)"""
+    values: Dict[str, Any] = {}
+    for name in ("journal_mode", "synchronous", "cache_size", "mmap_size"):
+        row = conn.execute(f"pragma {name}").fetchone()
+        # mmap is not available for in memory databases
+        values[name] = row[0] if row else None
+    values["temp_store"] = conn.execute("pragma temp_store").fetchone()[0]
+    values["busy_timeout"] = conn.execute("pragma busy_timeout").fetchone()[0]
+    values["synchronous"] = SYNCHRONOUS[values["synchronous"]]
+    values["temp_store"] = TEMP_STORE[values["temp_store"]]
+    return values
+
+
+def apply_profile(
+    conn: sqlite3.Connection, profile: Union[str, Profile]
+) -> Dict[str, Any]:
+    """Apply a profile to a connection and return its resulting settings.
+
+    The journal mode can't change inside a transaction, so pending changes
+    are committed first"""
+    profile = get_profile(profile)
+    conn.commit()
+    for name, value in asdict(profile).items():
+        if name != "name":
+            conn.execute(f"pragma {name} = {value}")
+    return {"profile": profile.name, **settings(conn)}
+
+
+@contextmanager
+def use_profile(
+    conn: sqlite3.Connection, profile: Union[str, Profile]
+) -> Iterator[Dict[str, Any]]:
+    """Apply a profile inside the with block, restoring previous settings
+    after it. Yields the settings applied"""
+    previous = settings(conn)
+    try:
+        yield apply_profile(conn, profile)
+    finally:
+        conn.commit()
+        for name, value in previous.items():
+            if value is not None:
+                conn.execute(f"pragma {name} = {value}")
+
+
+def connect(
+    path: str,
+    check_same_thread: bool = True,
+    profile: Union[str, Profile, None] = "default",
+) -> sqlite3.Connection:
+    """Open a connection that parses declared dates as datetime objects,
+    tuned by profile (None keeps SQLite defaults)"""
+    conn = sqlite3.connect(
+        path,
+        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+        check_same_thread=check_same_thread,
+    )
+    if profile is not None:
+        apply_profile(conn, profile)
+    return conn
+
+
+class ConnectionProvider:
+    """Lazily opens and hands out database connections"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        pool_size: int = 4,
+        profile: Union[str, Profile] = "default",
+    ):
+        self.path = path
+        self.pool_size = pool_size
+        self.profile = get_profile(profile)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened: List[sqlite3.Connection] = []
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._readers_count = 0
+
+    @property
+    def database(self) -> str:
+        """Return the database path connections are opened with"""
+        return self.path or os.environ.get("CALC_SEDUC_DB") or DATABASE
+
+    def configure(
+        self,
+        path: Optional[str] = None,
+        pool_size: int = 4,
+        profile: Union[str, Profile] = "default",
+    ) -> None:
+        """Close every connection and use a new database path and profile"""
+        self.close()
+        self.path = path
+        self.pool_size = pool_size
+        self.profile = get_profile(profile)
+
+    def get(self) -> sqlite3.Connection:
+        """Return the connection of the current thread, opening it if needed"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.database, profile=self.profile)
+            with self._lock:
+                self._opened.append(conn)
+        return conn
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a pooled connection for reading, waiting if all are in use.
+
+        An in memory database can't be shared by two connections, so the
+        thread connection is used instead"""
+        if self.database == ":memory:":
+            yield self.get()
+            return
+
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._readers_count < self.pool_size
+                if create:
+                    self._readers_count += 1
+            if create:
+                conn = connect(
+                    self.database, check_same_thread=False, profile=self.profile
+                )
+                with self._lock:
+                    self._opened.append(conn)
+            else:
+                conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def close(self) -> None:
+        """Close every connection opened by this provider"""
+        with self._lock:
+            opened, self._opened = self._opened, []
+            self._readers = queue.LifoQueue()
+            self._readers_count = 0
+            self._local = threading.local()
+        for conn in opened:
+            identity_map.forget(conn)
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # Connections of other threads can only be closed by them
+                pass
+
+
+# Provider used when no connection is given to models and controllers
+provider = ConnectionProvider()
+
+
+def get_connection() -> sqlite3.Connection:
+    """Return the current thread connection of the default provider"""
+    return provider.get()
 
 
-# Default connection
-defconn = sqlite3.connect(
-    "db.sqlite",
-    detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
-)
+def __getattr__(name: str):
+    # Former module level connection, now opened on first use
+    if name == "defconn":
+        return provider.get()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
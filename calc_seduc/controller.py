@@ -1,5 +1,9 @@
-from typing import Protocol, Type, List
-from calc_seduc.connection import defconn
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from itertools import chain
+from typing import TYPE_CHECKING, Optional, Protocol, Type, List, cast
+from calc_seduc.connection import get_connection, settings, use_profile
+from calc_seduc.instrumentation import Instrumentation
 from calc_seduc.models import (
     AbstractContract,
     AbstractPayment,
@@ -7,7 +11,16 @@ from calc_seduc.models import (
     PaymentTableFactory,
 )
 from calc_seduc.processors import AbstractProcessor
-from calc_seduc.utils import get_processed_contracts_ids
+from calc_seduc.schema import check_schema
+from calc_seduc.cache import identity_map
+from calc_seduc.calendar import month_range
+from calc_seduc.tracking import RunLog, months_between
+from calc_seduc.utils import BATCH_SIZE, chunked
+
+if TYPE_CHECKING:
+    from calc_seduc.export import CsvExporter
+    from calc_seduc.parallel import ChunkFailure
+    from calc_seduc.reconciliation import Reconciliation
 
 
 class AbstractController(Protocol):
@@ -44,48 +57,265 @@ class Controller:
         ptable_factory: Type[PaymentTableFactory],
         processor: Type[AbstractProcessor],
         conn=None,
+        batch_size: int = BATCH_SIZE,
+        export_path: str = "payments.csv",
+        exporter: Optional["CsvExporter"] = None,
+        ref_year: int = 2022,
+        ref_month: int = 2,
+        workers: int = 1,
+        chunk_size: int = BATCH_SIZE,
+        instrumentation: Optional[Instrumentation] = None,
+        incremental: bool = False,
+        reconcile: bool = False,
     ):  # noqa
-        self.conn = defconn if not conn else conn
+        self.conn = conn if conn else get_connection()
+        # Older databases hold float money and lack the unique payment indexes
+        check_schema(self.conn)
+        self.batch_size = batch_size
+        self.ref_year = ref_year
+        self.ref_month = ref_month
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.export_path = export_path
+        self.exporter = exporter
+        self.instrumentation = instrumentation or Instrumentation()
+        self.instrumentation.info["sqlite"] = settings(self.conn)
         ptables = ptable_factory().get_all(self.conn)
         self.contract_factory = contract_factory
         self.processor = processor(ptables)
+        # Payments are saved to, replaced in and looked up from its table
+        self.payment_type = self.processor.payment_type
         self.unprocessed: List[AbstractContract] = []
         self.payments: List[AbstractPayment] = []
+        self.incremental = incremental
+        self.run_log = RunLog(self.conn)
+        self.run_id: Optional[int] = None
+        self.watermark: Optional[int] = None
+        # Contracts whose payments for the reference period are replaced
+        self.replaced: List[int] = []
+        self.failures: List["ChunkFailure"] = []
+        self.reconcile = reconcile
+        self.reconciliation: Optional["Reconciliation"] = None
 
     def __call__(self):
-        """Executes MainController process"""
+        """Executes MainController process, measuring every stage"""
+        instrumentation = self.instrumentation
         # 1. Check for non processed contracts
-        self.get_non_processed_contracts()
+        with instrumentation.stage("fetch", self.conn) as stage:
+            self.get_non_processed_contracts()
+            stage.rows = len(self.unprocessed)
         # 2. Process per hour payments for every non processed contract
-        self.process_contracts()
+        with instrumentation.stage("process", self.conn) as stage:
+            self.process_contracts()
+            stage.rows = len(self.payments)
+            stage.extra["failed_chunks"] = len(self.failures)
         # 3. Save this processed information in database
-        self.save_data()
+        with instrumentation.stage("save", self.conn) as stage:
+            self.save_data()
+            stage.rows = len(self.payments)
         # 4. Creates a .csv with detailed information
-        self.export_csv()
+        with instrumentation.stage("export", self.conn) as stage:
+            self.export_csv()
+            stage.rows = self.exporter.stats.rows
+        # 5. Compare what SEDUC paid with the saved payments
+        if self.reconcile:
+            with instrumentation.stage("reconcile", self.conn) as stage:
+                self.reconcile_earnings()
+                stage.rows = len(self.reconciliation.periods)
+                stage.extra.update(self.reconciliation.summary())
+        instrumentation.finish()
 
     def get_non_processed_contracts(self) -> None:
-        """Method that gets all non processed contracts on database"""
-        contracts = self.contract_factory.get_all(conn=self.conn)
-        processed_ids = get_processed_contracts_ids(conn=self.conn)
-        self.unprocessed = [
-            contract for contract in contracts if contract.id not in processed_ids
-        ]
+        """Method that gets all contracts on database not processed yet for the
+        reference year/month.
+
+        In incremental mode, once a run of the reference period has finished,
+        only contracts changed since its watermark are fetched (or every
+        contract, when a payment table covering the period changed) and their
+        payments for the period are replaced. Until then contracts without a
+        payment for the period are fetched, as outside incremental mode.
+        Contracts and tables are tracked by the triggers in
+        schema.CHANGE_TRACKING"""
+        since = None
+        if self.incremental:
+            since = self.run_log.last_watermark(self.ref_year, self.ref_month)
+            self.watermark = self.run_log.current_watermark()
+            self.run_id = self.run_log.start(
+                self.watermark, self.ref_year, self.ref_month
+            )
+
+        if since is None:
+            self.unprocessed = list(
+                self.contract_factory.get_unprocessed(
+                    self.ref_year,
+                    self.ref_month,
+                    conn=self.conn,
+                    chunk_size=self.batch_size,
+                    payment_table=self.payment_type.table,
+                )
+            )
+            return
+
+        # since is only found in incremental mode, where watermark is set
+        watermark = cast(int, self.watermark)
+        period = (self.ref_year, self.ref_month)
+        if period in self.run_log.changed_periods(since, watermark):
+            contracts = self.contract_factory.get_many(self.conn)
+        else:
+            changed = self.run_log.changed_contracts(since, watermark)
+            # A few hundred ids per query, below any sqlite variable limit
+            contracts = chain.from_iterable(
+                self.contract_factory.get_many(self.conn, id__in=ids)
+                for ids in chunked(sorted(changed), 500)
+            )
+        first_day, next_month = month_range(self.ref_year, self.ref_month)
+        self.unprocessed = []
+        for contract in contracts:
+            self.replaced.append(cast(int, contract.id))
+            if contract.starts < next_month and contract.ends >= first_day:
+                self.unprocessed.append(contract)
 
     def process_contracts(self) -> None:
         """Method that process every contract in self.unprocessed using the
-        provided processor"""
-        for contract in self.unprocessed:
-            self.payments.append(
-                self.processor.process(contract=contract, year=2022, month=2)
+        provided processor. With more than one worker, contracts are processed
+        in chunks on a process pool and failed chunks are kept in
+        self.failures"""
+        periods = [(self.ref_year, self.ref_month)]
+        if self.workers > 1:
+            # Imported here, multiprocessing is costly to import
+            from calc_seduc.parallel import process_parallel
+
+            payments, failures = process_parallel(
+                self.processor,
+                self.unprocessed,
+                periods,
+                workers=self.workers,
+                chunk_size=self.chunk_size,
+            )
+            self.payments.extend(payments)
+            self.failures.extend(failures)
+        else:
+            self.payments.extend(
+                self.processor.process_many(self.unprocessed, periods=periods)
             )
 
     def save_data(self) -> None:
-        """Method that saves payments in self.payments on database"""
-        for payment in self.payments:
-            payment.save()
+        """Method that saves payments in self.payments on database, in a single
+        transaction for every payment type. Payments of replaced contracts
+        are deleted in the same transaction as the first payment type"""
+        self.delete_replaced()
+        self.save_payments(self.payments)
+        self.finish_save()
+
+    def delete_replaced(self) -> None:
+        """Method that deletes the reference period payments of replaced
+        contracts, without committing"""
+        table = self.payment_type.table
+        cur = self.conn.cursor()
+        for ids in chunked(self.replaced, 500):
+            cur.execute(
+                f"""
+                delete from {table}
+                where ref_year = ? and ref_month = ?
+                and contract_id in ({", ".join("?" * len(ids))})
+            """,
+                (self.ref_year, self.ref_month, *ids),
+            )
+        if self.replaced:
+            identity_map.invalidate(self.conn, table)
+
+    def save_payments(self, payments: List[AbstractPayment]) -> None:
+        """Method that saves payments in a single transaction for every
+        payment type"""
+        payments_by_type = defaultdict(list)
+        for payment in payments:
+            payments_by_type[type(payment)].append(payment)
+        for payment_type, same_type in payments_by_type.items():
+            payment_type.save_many(
+                same_type, conn=self.conn, batch_size=self.batch_size
+            )
+
+    def finish_save(self) -> None:
+        """Method that commits what is left and records the run as finished.
+        A run with failed chunks is left unfinished, so the next one starts
+        from the same watermark and processes their contracts again"""
+        self.conn.commit()
+        if self.run_id is not None and not self.failures:
+            self.run_log.finish(self.run_id, len(self.payments))
+
+    def backfill(self, starts: date, ends: date, profile: str = "bulk_load") -> int:
+        """Process and save payments of every month from starts to ends.
+
+        Contracts overlapping the range are streamed by a single date range
+        query and paired only with the months they were active in. Pairs that
+        already have a payment are skipped, so running the same range twice
+        saves nothing the second time. Every batch of contracts is processed
+        and saved before the next one is read. Raises NoPaymentTable before
+        saving anything if a month of the range has no payment table. The
+        connection uses the given profile (see connection.PROFILES) while
+        saving, its previous settings are restored afterwards. Returns how
+        many payments were saved"""
+        first_day = month_range(starts.year, starts.month)[0]
+        next_month = month_range(ends.year, ends.month)[1]
+        contracts = self.contract_factory.get_many(
+            self.conn, starts__lt=next_month, ends__gte=first_day
+        )
+        # Fail before saving anything if a month has no payment table
+        for year, month in months_between(first_day, ends):
+            self.processor.define_payment_table(year, month)
+
+        process_date = datetime.now()
+        saved = 0
+        cur = self.conn.cursor()
+        with use_profile(self.conn, profile) as applied:
+            with self.instrumentation.stage("backfill", self.conn) as stage:
+                stage.extra["sqlite"] = applied
+                for batch in chunked(contracts, self.batch_size):
+                    cur.execute(
+                        f"""
+                        select contract_id, ref_year, ref_month
+                        from {self.payment_type.table}
+                        where ref_year between ? and ?
+                        and contract_id in ({", ".join("?" * len(batch))})
+                    """,
+                        (starts.year, ends.year, *(contract.id for contract in batch)),
+                    )
+                    existing = set(cur.fetchall())
+                    pairs = [
+                        (contract, year, month)
+                        for contract in batch
+                        for year, month in sorted(
+                            months_between(
+                                max(contract.starts, first_day),
+                                min(contract.ends, next_month - timedelta(days=1)),
+                            )
+                        )
+                        if (contract.id, year, month) not in existing
+                    ]
+                    payments = self.processor.process_pairs(pairs, process_date)
+                    self.payment_type.save_many(
+                        payments, conn=self.conn, batch_size=self.batch_size
+                    )
+                    saved += len(payments)
+                stage.rows = saved
+        return saved
+
+    def reconcile_earnings(self) -> None:
+        """Method that compares earnings with saved payments by reference
+        period, keeping the result in self.reconciliation"""
+        from calc_seduc.reconciliation import reconcile
+
+        self.reconciliation = reconcile(
+            self.conn, payment_table=self.payment_type.table
+        )
 
     def export_csv(self) -> None:
         """Method that creates a csv spreadsheet with all payment and earnings
         analysis"""
-        print("csv created")
-        # TODO: create export_csv logic
+        if not self.exporter:
+            from calc_seduc.export import CsvExporter
+
+            self.exporter = CsvExporter(
+                self.conn, payment_table=self.payment_type.table
+            )
+        self.exporter.export(self.export_path, self.payments)
@@ -0,0 +1,189 @@
+"""Module that exports payments and earnings analysis as csv spreadsheets"""
+
+import csv
+import gzip
+import io
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import (
+    IO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    cast,
+)
+from calc_seduc.connection import get_connection
+from calc_seduc.models import (
+    AbstractPayment,
+    Contract,
+    ContractFactory,
+    EarningFactory,
+    FormulaPayment,
+    PaymentFactory,
+    PerHourPayment,
+    School,
+    SchoolFactory,
+)
+from calc_seduc.money import Money
+from calc_seduc.utils import BATCH_SIZE, chunked
+
+
+@dataclass(slots=True)
+class PaymentRow:
+    """A payment joined with everything a csv line may show"""
+
+    payment: AbstractPayment
+    contract: Contract
+    school: School
+    earned: Money
+
+
+# PaymentFactory key of the payments stored in every payment table
+PAYMENT_FACTORIES = {PerHourPayment.table: "perhour", FormulaPayment.table: "formula"}
+
+# Every exportable column and how its value is formatted. Values are
+# formatted from the same data sqlite stores (dates without time, money in
+# centavos), so in memory payments and stored payments give the same bytes
+EXPORT_COLUMNS: Dict[str, Callable[[PaymentRow], str]] = {
+    "payment_id": lambda r: str(r.payment.id or ""),
+    "contract_id": lambda r: str(r.contract.contract_id),
+    "school_inep": lambda r: str(r.school.inep),
+    "school_name": lambda r: r.school.name,
+    "ref_year": lambda r: str(r.payment.ref_year),
+    "ref_month": lambda r: str(r.payment.ref_month),
+    "total_hours": lambda r: str(r.contract.total_hours),
+    "paymenttable_id": lambda r: str(r.payment.paymenttable_id),
+    "process_date": lambda r: r.payment.process_date.date().isoformat(),
+    "value": lambda r: str(r.payment.value),
+    "earned": lambda r: str(r.earned),
+}
+
+
+@dataclass(slots=True)
+class ExportStats:
+    """Counters of a csv export"""
+
+    rows: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        """Return how many rows were written per second"""
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+class CsvExporter:
+    """Streams payments to a csv file through a generator pipeline.
+
+    Payments come from a given iterable or straight from payment_table
+    (tb_perhourpayment by default), and are joined with contracts and
+    schools chunk by chunk, so memory does not grow with the number of
+    exported payments. Paths ending with .gz are written gzip compressed"""
+
+    def __init__(
+        self,
+        conn=None,
+        columns: Optional[Iterable[str]] = None,
+        periods: Optional[Iterable[Tuple[int, int]]] = None,
+        chunk_size: int = BATCH_SIZE,
+        payment_table: str = "tb_perhourpayment",
+    ):
+        if payment_table not in PAYMENT_FACTORIES:
+            raise ValueError(f"Not a payment table: {payment_table}")
+        self.conn = conn if conn else get_connection()
+        self.payment_table = payment_table
+        self.columns = list(columns) if columns else list(EXPORT_COLUMNS)
+        unknown = set(self.columns) - set(EXPORT_COLUMNS)
+        if unknown:
+            raise KeyError(f"Unknown export columns: {', '.join(sorted(unknown))}")
+        self.periods = set(periods) if periods else None
+        self.chunk_size = chunk_size
+        self.schools: Dict[Optional[int], School] = {}
+        self.stats = ExportStats()
+
+    def stored_payments(self) -> Iterator[AbstractPayment]:
+        """Stream payments saved on database, filtered by periods"""
+        filters = {}
+        if self.periods:
+            filters["ref_year__in"] = sorted({year for year, _ in self.periods})
+        factory = PaymentFactory()(PAYMENT_FACTORIES[self.payment_table])
+        return factory.get_many(self.conn, **filters)
+
+    def filter_periods(
+        self, payments: Iterable[AbstractPayment]
+    ) -> Iterator[AbstractPayment]:
+        """Keep only payments whose reference period was asked for"""
+        for payment in payments:
+            if (
+                self.periods is None
+                or (payment.ref_year, payment.ref_month) in self.periods
+            ):
+                yield payment
+
+    def earnings_by_period(self) -> Dict[Tuple[int, int], Money]:
+        """Sum earnings by (ref_year, ref_month) in a single pass"""
+        earned: Dict[Tuple[int, int], Money] = defaultdict(Money)
+        for earning in EarningFactory().get_many(self.conn):
+            earned[(earning.ref_year, earning.ref_month)] += earning.value
+        return earned
+
+    def join(
+        self,
+        payments: Iterable[AbstractPayment],
+        earned: Dict[Tuple[int, int], Money],
+    ) -> Iterator[PaymentRow]:
+        """Join payments with their contracts and schools, one chunk at a time.
+        Ids are looked up 500 at a time, below any sqlite variable limit"""
+        for chunk in chunked(payments, self.chunk_size):
+            contracts = {}
+            for ids in chunked({payment.contract_id for payment in chunk}, 500):
+                for contract in ContractFactory().get_many(self.conn, id__in=ids):
+                    contracts[contract.id] = contract
+            missing = {c.school_id for c in contracts.values()} - set(self.schools)
+            for ids in chunked(missing, 500):
+                for school in SchoolFactory().get_many(self.conn, id__in=ids):
+                    self.schools[school.id] = school
+            for payment in chunk:
+                contract = contracts[payment.contract_id]
+                yield PaymentRow(
+                    payment=payment,
+                    contract=contract,
+                    school=self.schools[contract.school_id],
+                    earned=earned.get((payment.ref_year, payment.ref_month), Money()),
+                )
+
+    def lines(self, rows: Iterable[PaymentRow]) -> Iterator[List[str]]:
+        """Format rows with the configured columns"""
+        formatters = [EXPORT_COLUMNS[column] for column in self.columns]
+        for row in rows:
+            yield [formatter(row) for formatter in formatters]
+
+    def export(
+        self, path: str, payments: Optional[Iterable[AbstractPayment]] = None
+    ) -> ExportStats:
+        """Write payments (stored payments if none are given) to path"""
+        if payments is None:
+            payments = self.stored_payments()
+        rows = self.join(self.filter_periods(payments), self.earnings_by_period())
+
+        self.stats = ExportStats()
+        started = time.perf_counter()
+        raw: IO[bytes]
+        if path.endswith(".gz"):
+            # mtime=0 keeps the compressed bytes the same between runs
+            raw = cast(IO[bytes], gzip.GzipFile(path, "wb", mtime=0))
+        else:
+            raw = open(path, "wb")
+        with io.TextIOWrapper(raw, encoding="utf-8", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(self.columns)
+            for line in self.lines(rows):
+                writer.writerow(line)
+                self.stats.rows += 1
+        self.stats.seconds = time.perf_counter() - started
+        return self.stats
@@ -0,0 +1,163 @@
+"""Safe arithmetic formulas compiled to python functions over batches.
+
+A formula is an arithmetic expression over the names in VARIABLES, made of
+numbers, + - * /, parentheses and min()/max(). It is parsed and checked
+once, turned into the source of a function computing a whole batch of
+contracts in a list comprehension, and compiled. Compiled formulas are
+cached by the sha256 of their source. Arithmetic is exact (fractions of
+integers) and every value is rounded half up to centavos once"""
+
+import ast
+import hashlib
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from calc_seduc.money import Money, round_half_up
+
+
+# Names a formula may use. Period variables are the same for every contract
+# of a batch, contract variables change from one contract to another
+PERIOD_VARIABLES = (
+    "hour_value",  # reais per hour of the payment table
+    "prv",  # reais, from the payment table
+    "eoy_bonus",  # reais, from the payment table
+    "month_workdays",  # workdays of the whole month
+    "weeks",  # weeks of the month
+    "year",
+    "month",
+    "december",  # 1 in december, 0 in any other month
+)
+# workdays counts the workdays of the month inside the contract dates
+CONTRACT_VARIABLES = ("hours", "total_hours", "workdays")
+VARIABLES = PERIOD_VARIABLES + CONTRACT_VARIABLES
+
+FUNCTIONS = ("min", "max")
+
+# Same value PerHourProcessor computes
+DEFAULT_FORMULA = "hour_value * total_hours / 5 * workdays"
+
+OPERATORS = {ast.Add: "+", ast.Sub: "-", ast.Mult: "*", ast.Div: "/"}
+
+
+class InvalidFormula(Exception):
+    """This error is raised when a formula is not a valid expression"""
+
+    pass
+
+
+def _to_money(value) -> Money:
+    value = Fraction(value)
+    return Money(round_half_up(value.numerator * 100, value.denominator))
+
+
+@dataclass(frozen=True)
+class CompiledFormula:
+    """A formula compiled to a function over batches of contracts"""
+
+    source: str
+    digest: str
+    code: str
+    function: Callable[..., List[Money]]
+
+    def evaluate(
+        self,
+        period: Dict[str, Any],
+        hours: Sequence[int],
+        total_hours: Sequence[int],
+        workdays: Optional[Sequence[int]] = None,
+    ) -> List[Money]:
+        """Return the value of every contract of a batch, in order.
+
+        period maps every name of PERIOD_VARIABLES to its value, money as
+        Fraction of reais. Without workdays, every contract works the whole
+        month"""
+        if workdays is None:
+            workdays = [period["month_workdays"]] * len(hours)
+        return self.function(hours, total_hours, workdays, **period)
+
+
+class _Emitter:
+    """Checks a parsed formula and writes it as python source"""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.constants: Dict[str, Fraction] = {}
+
+    def emit(self, node: ast.AST) -> str:
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            left, right = self.emit(node.left), self.emit(node.right)
+            if isinstance(node.op, ast.Div):
+                # Keeps division exact, int / int would give a float
+                return f"(_Fraction({left}) / {right})"
+            return f"({left} {OPERATORS[type(node.op)]} {right})"
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            sign = "-" if isinstance(node.op, ast.USub) else "+"
+            return f"({sign}{self.emit(node.operand)})"
+        if isinstance(node, ast.Name) and node.id in VARIABLES:
+            return node.id
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            name = f"_c{len(self.constants)}"
+            # Decimal literals are read as written, 0.1 is exactly 1/10
+            literal = ast.get_source_segment(self.source, node) or repr(node.value)
+            try:
+                self.constants[name] = Fraction(literal)
+            except ValueError:
+                # e.g. 0x10, only decimal literals are read
+                raise InvalidFormula(
+                    f"Invalid number in formula {self.source!r}: {literal}"
+                ) from None
+            return name
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id in FUNCTIONS
+            and node.args
+            and not node.keywords
+        ):
+            args = ", ".join(self.emit(arg) for arg in node.args)
+            return f"{node.func.id}({args})"
+        raise InvalidFormula(
+            f"Not allowed in formula {self.source!r}: {ast.dump(node)}"
+        )
+
+
+# Compiled formulas by sha256 of their source
+_cache: Dict[str, CompiledFormula] = {}
+
+
+def compile_formula(source: str) -> CompiledFormula:
+    """Parse, check and compile a formula, or return it from the cache.
+
+    Raises InvalidFormula if source is not a valid formula"""
+    digest = hashlib.sha256(source.encode()).hexdigest()
+    formula = _cache.get(digest)
+    if formula is not None:
+        return formula
+
+    try:
+        tree = ast.parse(source.strip(), mode="eval")
+    except SyntaxError as error:
+        raise InvalidFormula(f"Invalid formula {source!r}: {error.msg}") from None
+    emitter = _Emitter(source.strip())
+    expression = emitter.emit(tree.body)
+    code = (
+        f"def formula(hours, total_hours, workdays, {', '.join(PERIOD_VARIABLES)}):\n"
+        f"    return [\n"
+        f"        _to_money({expression})\n"
+        f"        for hours, total_hours, workdays\n"
+        f"        in zip(hours, total_hours, workdays)\n"
+        f"    ]\n"
+    )
+    namespace: Dict[str, Any] = {
+        "__builtins__": {},
+        "_Fraction": Fraction,
+        "_to_money": _to_money,
+        "zip": zip,
+        "min": min,
+        "max": max,
+        **emitter.constants,
+    }
+    exec(compile(code, f"<formula {digest[:12]}>", "exec"), namespace)
+    formula = CompiledFormula(source, digest, code, namespace["formula"])
+    _cache[digest] = formula
+    return formula
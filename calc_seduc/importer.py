@@ -0,0 +1,624 @@
+"""Module that imports schools, contracts and payment tables from spreadsheets.
+
+SEDUC exports are read one row at a time (csv, csv.gz or xlsx), every row is
+checked and normalized into a model, and models are upserted chunk_size at
+a time with executemany, each chunk in its own transaction: schools by
+inep, contracts by contract_id and start date, payment tables by start and
+end dates, refusing ones that overlap. Rows that can't be imported are
+collected with the reason instead of stopping the import, so they can be
+fixed and imported again"""
+
+import csv
+import gzip
+import io
+import re
+import time
+import zipfile
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    IO,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    cast,
+)
+from xml.etree import ElementTree
+from calc_seduc.cache import identity_map, rate_cache
+from calc_seduc.connection import get_connection
+from calc_seduc.formula import InvalidFormula, compile_formula
+from calc_seduc.models import Contract, PaymentTable, School
+from calc_seduc.money import HourRate, Money
+from calc_seduc.processors import month_key
+from calc_seduc.utils import BATCH_SIZE, chunked
+
+
+class InvalidRow(Exception):
+    """This error is raised when a spreadsheet row can't be imported"""
+
+    pass
+
+
+class InvalidSpreadsheet(Exception):
+    """This error is raised when a file can't be read as a spreadsheet or
+    lacks a required column"""
+
+    pass
+
+
+# A spreadsheet row: its number in the file (the header is row 1) and its
+# values by normalized column name
+Record = Tuple[int, Dict[str, str]]
+
+
+@dataclass(slots=True)
+class RejectedRow:
+    """A row left out of an import and why"""
+
+    line: int
+    values: Dict[str, str]
+    error: str
+
+
+@dataclass(slots=True)
+class ImportStats:
+    """Counters of an import.
+
+    rows counts the rows read. inserted, updated and unchanged count
+    distinct keys, so a key repeated in a chunk counts once, with the
+    values of its last row"""
+
+    rows: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    rejected: List[RejectedRow] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        """Return how many rows were read per second"""
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def column_name(header) -> str:
+    """Normalize a header cell: lower case words joined by underscores"""
+    return "_".join(str(header).strip().lower().split())
+
+
+def records(
+    rows: Iterable[Tuple[int, List[str]]], required: Sequence[str] = ()
+) -> Iterator[Record]:
+    """Turn numbered rows into records keyed by the names of the first row.
+
+    Blank rows are skipped. Raises InvalidSpreadsheet if a required column
+    is missing"""
+    rows = iter(rows)
+    first = next(rows, None)
+    header = [column_name(cell) for cell in first[1]] if first else []
+    missing = [column for column in required if column not in header]
+    if missing:
+        raise InvalidSpreadsheet(f"Missing columns: {', '.join(missing)}")
+    for number, cells in rows:
+        if not any(cell.strip() for cell in cells):
+            continue
+        yield number, {
+            column: cells[i].strip() if i < len(cells) else ""
+            for i, column in enumerate(header)
+            if column
+        }
+
+
+def read_csv(path: str, required: Sequence[str] = ()) -> Iterator[Record]:
+    """Stream the records of a csv file, gzip compressed if path ends with .gz.
+
+    The delimiter (comma, semicolon or tab) is guessed from the first lines"""
+    raw: IO[bytes]
+    if path.endswith(".gz"):
+        raw = cast(IO[bytes], gzip.GzipFile(path, "rb"))
+    else:
+        raw = open(path, "rb")
+    with io.TextIOWrapper(raw, encoding="utf-8-sig", newline="") as file:
+        sample = file.read(4096)
+        file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(file, dialect)
+        yield from records(((reader.line_num, row) for row in reader), required)
+
+
+_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_RELATIONSHIPS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_DOCUMENT = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+
+def _column_index(reference: str) -> int:
+    index = 0
+    for letter in reference:
+        if not letter.isalpha():
+            break
+        index = index * 26 + ord(letter.upper()) - ord("A") + 1
+    return index - 1
+
+
+def _text(element: ElementTree.Element) -> str:
+    # Plain text or rich text runs. Phonetic runs (rPh) are left out
+    texts = element.findall(f"{_MAIN}t") + element.findall(f"{_MAIN}r/{_MAIN}t")
+    return "".join(t.text or "" for t in texts)
+
+
+def _shared_strings(book: zipfile.ZipFile) -> List[str]:
+    if "xl/sharedStrings.xml" not in book.namelist():
+        return []
+    strings = []
+    with book.open("xl/sharedStrings.xml") as file:
+        for _, element in ElementTree.iterparse(file):
+            if element.tag == f"{_MAIN}si":
+                strings.append(_text(element))
+                element.clear()
+    return strings
+
+
+def _sheet_path(book: zipfile.ZipFile, sheet: Optional[str]) -> str:
+    workbook = ElementTree.fromstring(book.read("xl/workbook.xml"))
+    sheets = workbook.iter(f"{_MAIN}sheet")
+    chosen = next((s for s in sheets if sheet is None or s.get("name") == sheet), None)
+    if chosen is None:
+        raise InvalidSpreadsheet(f"No sheet {sheet!r} in workbook")
+    rels = ElementTree.fromstring(book.read("xl/_rels/workbook.xml.rels"))
+    targets = {
+        relationship.get("Id"): relationship.get("Target")
+        for relationship in rels.iter(f"{_RELATIONSHIPS}Relationship")
+    }
+    target = targets[chosen.get(f"{_DOCUMENT}id")]
+    if target is None:
+        raise InvalidSpreadsheet(f"No target for sheet {sheet!r} in workbook")
+    return target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+
+
+def _sheet_rows(file, strings: List[str]) -> Iterator[Tuple[int, List[str]]]:
+    number = 0
+    for _, element in ElementTree.iterparse(file):
+        if element.tag != f"{_MAIN}row":
+            continue
+        number = int(element.get("r", number + 1))
+        cells: List[str] = []
+        for cell in element.iter(f"{_MAIN}c"):
+            reference = cell.get("r")
+            index = _column_index(reference) if reference else len(cells)
+            kind = cell.get("t")
+            value = cell.find(f"{_MAIN}v")
+            inline = cell.find(f"{_MAIN}is")
+            if kind == "inlineStr" and inline is not None:
+                text = _text(inline)
+            elif value is None or value.text is None:
+                text = ""
+            elif kind == "s":
+                text = strings[int(value.text)]
+            else:
+                text = value.text
+            cells.extend([""] * (index - len(cells)))
+            cells.append(text)
+        element.clear()
+        yield number, cells
+
+
+def read_xlsx(
+    path: str, required: Sequence[str] = (), sheet: Optional[str] = None
+) -> Iterator[Record]:
+    """Stream the records of a sheet of an xlsx workbook (the first one by
+    default), reading its xml incrementally with the standard library.
+
+    Cells are read as stored: dates are serial day numbers, which
+    parse_date accepts"""
+    try:
+        book = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise InvalidSpreadsheet(f"Not an xlsx workbook: {path}") from None
+    with book:
+        strings = _shared_strings(book)
+        with book.open(_sheet_path(book, sheet)) as file:
+            yield from records(_sheet_rows(file, strings), required)
+
+
+def read_spreadsheet(
+    path: str, required: Sequence[str] = (), sheet: Optional[str] = None
+) -> Iterator[Record]:
+    """Stream the records of a csv, csv.gz or xlsx file"""
+    if path.lower().endswith(".xlsx"):
+        return read_xlsx(path, required, sheet)
+    return read_csv(path, required)
+
+
+# Dates are accepted as ISO or as day/month/year, optionally followed by a
+# time, which is dropped. A regular expression is several times faster than
+# strptime, and dates are most of the cells of a contract row
+DATE_PATTERN = re.compile(r"(\d{4})-(\d{2})-(\d{2})|(\d{2})/(\d{2})/(\d{4})")
+
+# Day 0 of spreadsheet serial dates
+SERIAL_EPOCH = date(1899, 12, 30)
+
+
+def parse_date(value: str) -> datetime:
+    """Return the date a cell holds, as a datetime at midnight"""
+    text = value.strip()
+    match = DATE_PATTERN.match(text)
+    if match:
+        year, month, day, day_, month_, year_ = match.groups()
+        try:
+            if year:
+                return datetime(int(year), int(month), int(day))
+            return datetime(int(year_), int(month_), int(day_))
+        except ValueError:
+            raise InvalidRow(f"Invalid date: {value!r}") from None
+    try:
+        serial = float(text)
+    except ValueError:
+        raise InvalidRow(f"Invalid date: {value!r}") from None
+    if not 0 < serial < 2958466:
+        raise InvalidRow(f"Invalid date: {value!r}")
+    day = SERIAL_EPOCH + timedelta(days=int(serial))
+    return datetime(day.year, day.month, day.day)
+
+
+def parse_int(value: str, column: str) -> int:
+    """Return the integer a cell holds. Spreadsheets may write 20 as 20.0"""
+    try:
+        number = Decimal(value.strip())
+    except InvalidOperation:
+        raise InvalidRow(f"Invalid {column}: {value!r}") from None
+    if not number.is_finite() or number != number.to_integral_value():
+        raise InvalidRow(f"Invalid {column}: {value!r}")
+    return int(number)
+
+
+def parse_money(value: str, column: str, cls=Money) -> Money:
+    """Return the non negative amount of reais a cell holds. Both 1234.56
+    and 1.234,56 are accepted, with or without R$"""
+    text = value.strip().removeprefix("R$").strip()
+    if "," in text:
+        text = text.replace(".", "").replace(",", ".")
+    try:
+        amount = cls.from_decimal(text)
+    except (InvalidOperation, ValueError):
+        raise InvalidRow(f"Invalid {column}: {value!r}") from None
+    if amount < cls():
+        raise InvalidRow(f"Negative {column}: {value!r}")
+    return amount
+
+
+def _date_range(values: Dict[str, str]) -> Tuple[datetime, datetime]:
+    starts, ends = parse_date(values["starts"]), parse_date(values["ends"])
+    if ends < starts:
+        raise InvalidRow(f"ends {values['ends']} before starts {values['starts']}")
+    return starts, ends
+
+
+# Inep codes are 8 digits
+INEP_PATTERN = re.compile(r"\d{8}")
+
+
+def parse_inep(value: str) -> int:
+    """Return the inep code of a school"""
+    text = value.strip()
+    if text.endswith(".0"):
+        text = text[:-2]
+    if not INEP_PATTERN.fullmatch(text):
+        raise InvalidRow(f"Invalid inep: {value!r}")
+    return int(text)
+
+
+def school_of(values: Dict[str, str]) -> School:
+    """Normalize a row with name and inep columns"""
+    name = " ".join(values["name"].split())
+    if not name:
+        raise InvalidRow("Missing name")
+    return School(name=name, inep=parse_inep(values["inep"]))
+
+
+@dataclass(slots=True)
+class ContractRow:
+    """A normalized contract row, whose school is known by inep only"""
+
+    inep: int
+    school_name: str
+    contract: Contract
+
+
+def contract_of(values: Dict[str, str]) -> ContractRow:
+    """Normalize a row with contract_id, inep, starts, ends, hours and an
+    optional school (name) column"""
+    contract_id = values["contract_id"].strip().removesuffix(".0")
+    if not contract_id:
+        raise InvalidRow("Missing contract_id")
+    starts, ends = _date_range(values)
+    hours = parse_int(values["hours"], "hours")
+    if hours <= 0:
+        raise InvalidRow(f"Invalid hours: {values['hours']!r}")
+    return ContractRow(
+        inep=parse_inep(values["inep"]),
+        school_name=" ".join(values.get("school", "").split()),
+        contract=Contract(0, contract_id, starts, ends, hours),
+    )
+
+
+def months_of(starts: datetime, ends: datetime) -> Tuple[int, int]:
+    """Return the month_keys of the first and last months of a period"""
+    return month_key(starts.year, starts.month), month_key(ends.year, ends.month)
+
+
+def payment_table_of(values: Dict[str, str]) -> PaymentTable:
+    """Normalize a row with starts, ends, hour_value, prv, eoy_bonus and an
+    optional formula column"""
+    starts, ends = _date_range(values)
+    formula = values.get("formula", "").strip() or None
+    if formula:
+        try:
+            compile_formula(formula)
+        except InvalidFormula as error:
+            raise InvalidRow(str(error)) from None
+    return PaymentTable(
+        starts=starts,
+        ends=ends,
+        hour_value=cast(
+            HourRate, parse_money(values["hour_value"], "hour_value", HourRate)
+        ),
+        prv=parse_money(values["prv"], "prv"),
+        eoy_bonus=parse_money(values["eoy_bonus"], "eoy_bonus"),
+        formula=formula,
+    )
+
+
+SCHOOL_COLUMNS = ("name", "inep")
+CONTRACT_COLUMNS = ("contract_id", "inep", "starts", "ends", "hours")
+PAYMENT_TABLE_COLUMNS = ("starts", "ends", "hour_value", "prv", "eoy_bonus")
+
+
+class SpreadsheetImporter:
+    """Upserts spreadsheet rows in chunked transactions.
+
+    Each chunk of chunk_size rows is normalized, the keys it holds are
+    looked up with one query, and new and changed rows are written with one
+    executemany each, in a transaction of its own: a failed import keeps
+    the chunks before it. Stored rows whose values did not change are not
+    written again, so re-importing a file only logs real changes in
+    tb_change. Where a key is stored more than once, the last one saved is
+    updated"""
+
+    def __init__(self, conn=None, chunk_size: int = BATCH_SIZE):
+        self.conn = conn if conn else get_connection()
+        self.chunk_size = chunk_size
+        self.stats = ImportStats()
+
+    def import_schools(self, path: str, sheet: Optional[str] = None) -> ImportStats:
+        """Upsert the schools of a spreadsheet by inep"""
+        rows = read_spreadsheet(path, SCHOOL_COLUMNS, sheet)
+        return self.run(rows, school_of, self.upsert_schools)
+
+    def import_contracts(self, path: str, sheet: Optional[str] = None) -> ImportStats:
+        """Upsert the contracts of a spreadsheet by contract_id and starts.
+
+        Schools are found by inep. Missing ones are created when the row
+        has a school column, otherwise the row is rejected"""
+        rows = read_spreadsheet(path, CONTRACT_COLUMNS, sheet)
+        return self.run(rows, contract_of, self.upsert_contracts)
+
+    def import_payment_tables(
+        self, path: str, sheet: Optional[str] = None
+    ) -> ImportStats:
+        """Upsert the payment tables of a spreadsheet by starts and ends"""
+        rows = read_spreadsheet(path, PAYMENT_TABLE_COLUMNS, sheet)
+        return self.run(rows, payment_table_of, self.upsert_payment_tables)
+
+    def run(
+        self,
+        rows: Iterable[Record],
+        normalize: Callable[[Dict[str, str]], object],
+        upsert: Callable[[List[Tuple[Record, Any]]], None],
+    ) -> ImportStats:
+        """Normalize and upsert records chunk by chunk"""
+        self.stats = ImportStats()
+        started = time.perf_counter()
+        rejected = self.stats.rejected
+        for chunk in chunked(rows, self.chunk_size):
+            first_rejected = len(rejected)
+            normalized = []
+            for record in chunk:
+                self.stats.rows += 1
+                try:
+                    normalized.append((record, normalize(record[1])))
+                except InvalidRow as error:
+                    self.reject(record, str(error))
+            if normalized:
+                with self.conn:
+                    upsert(normalized)
+            # Rows rejected while upserting come after the ones of normalize
+            rejected[first_rejected:] = sorted(
+                rejected[first_rejected:], key=lambda row: row.line
+            )
+        self.stats.seconds = time.perf_counter() - started
+        return self.stats
+
+    def reject(self, record: Record, error: str) -> None:
+        """Leave a row out of the import"""
+        self.stats.rejected.append(RejectedRow(record[0], record[1], error))
+
+    def upsert_schools(self, rows: List[Tuple[Record, School]]) -> None:
+        """Write a chunk of schools"""
+        schools = {school.inep: school for _, school in rows}
+        ids = self.stored_ids(
+            "select inep, max(id) from tb_school where inep in ({marks})"
+            " group by inep",
+            list(schools),
+        )
+        self.write(School.table, School.columns, set(), ids, schools, School.row)
+
+    def upsert_contracts(self, rows: List[Tuple[Record, ContractRow]]) -> None:
+        """Write a chunk of contracts, creating the schools they name"""
+        ineps = list({row.inep for _, row in rows})
+        schools = self.stored_ids(
+            "select inep, max(id) from tb_school where inep in ({marks})"
+            " group by inep",
+            ineps,
+        )
+        missing = {
+            row.inep: School(name=row.school_name, inep=row.inep)
+            for _, row in rows
+            if row.inep not in schools and row.school_name
+        }
+        if missing:
+            self.conn.executemany(
+                f"insert into tb_school ({', '.join(School.columns)}) values (?, ?)",
+                [school.row() for school in missing.values()],
+            )
+            schools.update(
+                self.stored_ids(
+                    "select inep, max(id) from tb_school where inep in ({marks})"
+                    " group by inep",
+                    list(missing),
+                )
+            )
+
+        contracts: Dict[Tuple[Any, date], Contract] = {}
+        for record, row in rows:
+            if row.inep not in schools:
+                self.reject(record, f"Unknown school inep: {row.inep}")
+                continue
+            row.contract.school_id = schools[row.inep]
+            contract = row.contract
+            contracts[(contract.contract_id, contract.starts.date())] = contract
+        ids = {
+            (contract_id, date.fromisoformat(starts)): id
+            for (contract_id, starts), id in self.stored_ids(
+                "select contract_id, date(starts), max(id) from tb_contract"
+                " where contract_id in ({marks}) group by contract_id, date(starts)",
+                list({key[0] for key in contracts}),
+            ).items()
+        }
+        self.write(
+            Contract.table,
+            Contract.columns,
+            {"starts", "ends"},
+            ids,
+            contracts,
+            Contract.row,
+        )
+
+    def upsert_payment_tables(self, rows: List[Tuple[Record, PaymentTable]]) -> None:
+        """Write a chunk of payment tables. There are few of them, so every
+        stored one is looked up. A table sharing a month with a stored one
+        or another row is rejected, as payments find their table by month"""
+        ids: Dict[Hashable, int] = {}
+        months: Dict[Hashable, Tuple[int, int]] = {}
+        for id, starts, ends in self.conn.execute(
+            "select id, starts, ends from tb_paymenttable order by id"
+        ):
+            ids[(starts.date(), ends.date())] = id
+            months[id] = months_of(starts, ends)
+        accepted: Dict[Hashable, Tuple[int, int, int]] = {}
+        tables: Dict[Hashable, PaymentTable] = {}
+        for record, table in rows:
+            key = (table.starts.date(), table.ends.date())
+            first, last = months_of(table.starts, table.ends)
+            stored = [
+                id
+                for id, (starts, ends) in months.items()
+                if id != ids.get(key) and starts <= last and first <= ends
+            ]
+            lines = [
+                line
+                for other, (line, starts, ends) in accepted.items()
+                if other != key and starts <= last and first <= ends
+            ]
+            if stored:
+                self.reject(record, f"Overlaps stored payment table {stored[0]}")
+            elif lines:
+                self.reject(record, f"Overlaps payment table of line {lines[0]}")
+            else:
+                accepted[key] = (record[0], first, last)
+                tables[key] = table
+        self.write(
+            PaymentTable.table,
+            PaymentTable.columns,
+            {"starts", "ends"},
+            ids,
+            tables,
+            PaymentTable.row,
+        )
+
+    def stored_ids(self, sql: str, keys: List) -> Dict[Any, int]:
+        """Return the ids of stored rows by key. sql selects the key
+        columns and the id, with {marks} where keys are placed. Keys are
+        placed 500 at a time, below any sqlite variable limit"""
+        ids = {}
+        cur = self.conn.cursor()
+        for chunk in chunked(keys, 500):
+            cur.execute(sql.format(marks=", ".join("?" * len(chunk))), chunk)
+            for row in cur:
+                ids[row[0] if len(row) == 2 else tuple(row[:-1])] = row[-1]
+        return ids
+
+    def write(
+        self,
+        table: str,
+        columns: Sequence[str],
+        dates: Set[str],
+        ids: Mapping[Any, int],
+        objects: Mapping[Any, Any],
+        row: Callable[[Any], tuple],
+    ) -> None:
+        """Insert objects whose key is not in ids and update the others
+        where some column changed. Date columns are compared as dates"""
+        new = [row(obj) for key, obj in objects.items() if key not in ids]
+        old = [row(obj) + (ids[key],) for key, obj in objects.items() if key in ids]
+        cur = self.conn.cursor()
+        if new:
+            marks = ", ".join("?" * len(columns))
+            cur.executemany(
+                f"insert into {table} ({', '.join(columns)}) values ({marks})", new
+            )
+            self.stats.inserted += len(new)
+        if old:
+            changed = " or ".join(
+                f"date({c}) is not date(?)" if c in dates else f"{c} is not ?"
+                for c in columns
+            )
+            cur.executemany(
+                f"update {table} set {', '.join(f'{c} = ?' for c in columns)}"
+                f" where id = ? and ({changed})",
+                [values + values[:-1] for values in old],
+            )
+            self.stats.updated += cur.rowcount
+            self.stats.unchanged += len(old) - cur.rowcount
+            if cur.rowcount:
+                identity_map.invalidate(self.conn, table)
+                if table == PaymentTable.table:
+                    rate_cache.invalidate()
+
+    def write_rejected(self, path: str) -> int:
+        """Write rejected rows to a csv file with their line and error, so
+        they can be fixed and imported again. Returns how many were written"""
+        columns: Dict[str, None] = {}
+        for rejected in self.stats.rejected:
+            columns.update(dict.fromkeys(rejected.values))
+        with open(path, "w", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["line", "error", *columns])
+            for rejected in self.stats.rejected:
+                writer.writerow(
+                    [rejected.line, rejected.error]
+                    + [rejected.values.get(column, "") for column in columns]
+                )
+        return len(self.stats.rejected)
@@ -0,0 +1,133 @@
+"""Module that measures Controller pipeline stages"""
+
+import io
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO
+
+
+@dataclass(slots=True)
+class StageMetrics:
+    """What a pipeline stage did and how long it took"""
+
+    stage: str
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    rows: int = 0
+    sql_statements: int = 0
+    peak_kb: Optional[float] = None
+    profile: Optional[str] = None
+    # repr of the exception the stage raised, None if it finished
+    error: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+class Instrumentation:
+    """Measures wall time, cpu time, rows and sql statements of every stage.
+
+    Callbacks given as on_start are called with the stage name before it
+    runs, on_end ones with its StageMetrics after it finishes. profile=True
+    adds the top cProfile entries of each stage, trace_memory=True its
+    tracemalloc peak. With an emit stream, every stage and the run summary
+    are written to it as one json object per line"""
+
+    def __init__(
+        self,
+        on_start: Optional[List[Callable[[str], None]]] = None,
+        on_end: Optional[List[Callable[[StageMetrics], None]]] = None,
+        profile: bool = False,
+        trace_memory: bool = False,
+        emit: Optional[TextIO] = None,
+        profile_lines: int = 20,
+    ):
+        self.on_start = on_start if on_start else []
+        self.on_end = on_end if on_end else []
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.emit = emit
+        self.profile_lines = profile_lines
+        self.stages: List[StageMetrics] = []
+        self.info: Dict[str, Any] = {}
+
+    @contextmanager
+    def stage(self, name: str, conn=None) -> Iterator[StageMetrics]:
+        """Measure the code run inside the with block as a stage.
+
+        The yielded StageMetrics rows should be set by the caller. sql
+        statements are counted with conn trace callback. A stage that raises
+        is recorded and emitted too, with its error, before the exception
+        propagates"""
+        metrics = StageMetrics(stage=name)
+        for callback in self.on_start:
+            callback(name)
+
+        if conn is not None:
+
+            def count(statement: str) -> None:
+                metrics.sql_statements += 1
+
+            conn.set_trace_callback(count)
+        profiler = None
+        if self.profile:
+            # Imported here, profiling is off in most runs
+            import cProfile
+
+            profiler = cProfile.Profile()
+        if self.trace_memory:
+            tracemalloc.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield metrics
+        except Exception as error:
+            metrics.error = repr(error)
+            raise
+        finally:
+            if profiler:
+                profiler.disable()
+            metrics.wall_seconds = time.perf_counter() - wall
+            metrics.cpu_seconds = time.process_time() - cpu
+            if self.trace_memory:
+                metrics.peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+                tracemalloc.stop()
+            if conn is not None:
+                conn.set_trace_callback(None)
+            if profiler:
+                import pstats
+
+                output = io.StringIO()
+                stats = pstats.Stats(profiler, stream=output)
+                stats.sort_stats("cumulative").print_stats(self.profile_lines)
+                metrics.profile = output.getvalue()
+
+            self.stages.append(metrics)
+            self.write({"event": "stage", **asdict(metrics)})
+            for on_end in self.on_end:
+                on_end(metrics)
+
+    def summary(self) -> Dict[str, Any]:
+        """Return totals of every measured stage"""
+        return {
+            "event": "run",
+            "wall_seconds": sum(s.wall_seconds for s in self.stages),
+            "cpu_seconds": sum(s.cpu_seconds for s in self.stages),
+            "sql_statements": sum(s.sql_statements for s in self.stages),
+            "stages": {s.stage: s.wall_seconds for s in self.stages},
+            **self.info,
+        }
+
+    def finish(self) -> Dict[str, Any]:
+        """Emit and return the run summary"""
+        summary = self.summary()
+        self.write(summary)
+        return summary
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """Write a record to the emit stream as a json line"""
+        if self.emit is not None:
+            self.emit.write(json.dumps(record, default=str) + "\n")
+            self.emit.flush()
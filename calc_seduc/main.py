@@ -1,16 +1,20 @@
 """Main module of calc_seduc application"""
 
-from calc_seduc.models import ContractCreator, PaymentTableCreator
-from calc_seduc.controller import MainController
+from calc_seduc.models import ContractFactory, PaymentTableFactory
+from calc_seduc.controller import Controller
 from calc_seduc.processors import PerHourProcessor
-from calc_seduc.connection import defconn
+from calc_seduc.connection import get_connection
+from calc_seduc.schema import migrate
 
 
 if __name__ == "__main__":
-    main = MainController(
-        contract_creator=ContractCreator(),
-        ptable_creator=PaymentTableCreator,
+    conn = get_connection()
+    # Bring the database to the schema version Controller expects
+    migrate(conn)
+    main = Controller(
+        contract_factory=ContractFactory(),
+        ptable_factory=PaymentTableFactory,
         processor=PerHourProcessor,
-        conn=defconn,
+        conn=conn,
     )
     main()
@@ -1,20 +1,65 @@
-from decimal import DefaultContext, setcontext
-from .school import AbstractSchool, School, SchoolFactory  # noqa
-from .contract import AbstractContract, Contract, ContractFactory  # noqa
-from .payment_table import (
-    AbstractPaymentTable,
-    PaymentTable,
-    PaymentTableFactory,
-)  # noqa
-from .earning import AbstractEarning, Earning, EarningFactory  # noqa
-from .payment import (
-    AbstractPayment,
-    PerHourPayment,
-    FormulaPayment,
-    PaymentFactory,
-)  # noqa
-
-
-# Decimal default precision
-DefaultContext.prec = 9
-setcontext(DefaultContext)
+"""Models of calc_seduc application.
+
+Model modules are only imported when one of their names is first used, so
+importing calc_seduc.models is cheap and has no side effects"""
+
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+
+# Public name -> module that defines it
+_EXPORTS = {
+    "AbstractSchool": ".school",
+    "School": ".school",
+    "SchoolFactory": ".school",
+    "AbstractContract": ".contract",
+    "Contract": ".contract",
+    "ContractFactory": ".contract",
+    "ContractBatch": ".contract",
+    "AbstractPaymentTable": ".payment_table",
+    "PaymentTable": ".payment_table",
+    "PaymentTableFactory": ".payment_table",
+    "AbstractEarning": ".earning",
+    "Earning": ".earning",
+    "EarningFactory": ".earning",
+    "AbstractPayment": ".payment",
+    "PerHourPayment": ".payment",
+    "FormulaPayment": ".payment",
+    "PaymentFactory": ".payment",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if TYPE_CHECKING:
+    from .school import AbstractSchool, School, SchoolFactory  # noqa
+    from .contract import (  # noqa
+        AbstractContract,
+        Contract,
+        ContractBatch,
+        ContractFactory,
+    )
+    from .payment_table import (  # noqa
+        AbstractPaymentTable,
+        PaymentTable,
+        PaymentTableFactory,
+    )
+    from .earning import AbstractEarning, Earning, EarningFactory  # noqa
+    from .payment import (  # noqa
+        AbstractPayment,
+        PerHourPayment,
+        FormulaPayment,
+        PaymentFactory,
+    )
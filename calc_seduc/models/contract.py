@@ -1,14 +1,54 @@
 import math
+from array import array
 from dataclasses import dataclass
-from functools import lru_cache
 from datetime import datetime
-from typing import Protocol, Optional, List
-from calc_seduc.connection import defconn
+from typing import ClassVar, Protocol, Optional, List, Iterable, Iterator, Tuple
+from calc_seduc.cache import identity_map
+from calc_seduc.calendar import month_range
+from calc_seduc.connection import get_connection
+from calc_seduc.utils import BATCH_SIZE, build_where, save_many
+
+
+# Contracts active in a month (starts < next month, ends >= first day) and
+# without a payment for it in the {payments} table. They come in the order
+# of ix_contract_dates (starts, ends, then id), which is read as it is:
+# ordering by id alone makes sqlite scan the whole table instead
+UNPROCESSED_SQL = """
+    select {columns} from tb_contract c
+    where c.starts < ? and c.ends >= ?
+    and not exists (
+        select 1 from {payments} p
+        where p.contract_id = c.id
+        and p.ref_year = ?
+        and p.ref_month = ?
+    )
+    order by c.starts, c.ends, c.id
+"""
+
+# ContractBatch row columns, dates as ordinals: julianday of 0001-01-01 is
+# 1721425.5 and its ordinal is 1
+BATCH_COLUMNS = (
+    "{prefix}id, {prefix}school_id, {prefix}contract_id,"
+    " cast(julianday(date({prefix}starts)) - 1721424.5 as integer),"
+    " cast(julianday(date({prefix}ends)) - 1721424.5 as integer),"
+    " {prefix}hours"
+)
+
+
+def unprocessed_sql(columns: str, payment_table: str) -> str:
+    """Return UNPROCESSED_SQL selecting columns, anti joined with
+    payment_table"""
+    if payment_table not in ("tb_perhourpayment", "tb_formulapayment"):
+        raise ValueError(f"Not a payment table: {payment_table}")
+    return UNPROCESSED_SQL.format(columns=columns, payments=payment_table)
 
 
 class AbstractContract(Protocol):
     """Protocol that abstracts a Contract"""
 
+    starts: datetime
+    ends: datetime
+    hours: int
     id: Optional[int] = None
 
     @property
@@ -27,6 +67,15 @@ class AbstractContract(Protocol):
 class Contract:
     """Class that represents a Contract"""
 
+    table: ClassVar[str] = "tb_contract"
+    columns: ClassVar[Tuple[str, ...]] = (
+        "school_id",
+        "contract_id",
+        "starts",
+        "ends",
+        "hours",
+    )
+
     school_id: int
     contract_id: str
     starts: datetime
@@ -51,11 +100,30 @@ class Contract:
     #     """Given today's date, check if contract should be processed"""
     #     now = datetime.now()
 
+    def row(self) -> tuple:
+        """Return instance data in Contract.columns order"""
+        return (
+            self.school_id,
+            self.contract_id,
+            datetime(self.starts.year, self.starts.month, self.starts.day),
+            datetime(self.ends.year, self.ends.month, self.ends.day),
+            self.hours,
+        )
+
+    @classmethod
+    def save_many(
+        cls, objects: Iterable["Contract"], conn=None, batch_size: int = BATCH_SIZE
+    ) -> None:
+        """Saves many Contract instances on database in a single transaction"""
+        if not conn:
+            conn = get_connection()
+        save_many(conn, cls.table, cls.columns, objects, cls.row, batch_size)
+
     def save(self, conn=None):
         """Saves Contract instance data on database"""
 
         if not conn:
-            conn = defconn
+            conn = get_connection()
         cur = conn.cursor()
 
         if not self.id:
@@ -89,20 +157,122 @@ class Contract:
                 (self.school_id, self.starts, self.ends, self.hours, self.id),
             )
         conn.commit()
+        identity_map.invalidate(conn, self.table, self.id)
+
+
+class ContractBatch:
+    """Contracts held column by column in typed arrays.
+
+    Ids and school ids are kept as 64 bit ints, start and end dates as
+    date ordinals and hours with total_hours computed once, so a batch of
+    millions of contracts costs a few bytes per contract instead of one
+    object each. Processors read the columns directly; iterating or
+    indexing a batch builds Contract objects, for code that needs them"""
+
+    __slots__ = (
+        "ids",
+        "school_ids",
+        "contract_ids",
+        "starts",
+        "ends",
+        "hours",
+        "total_hours",
+    )
+
+    def __init__(self):
+        self.ids = array("q")
+        self.school_ids = array("q")
+        self.contract_ids: List[str] = []
+        self.starts = array("l")
+        self.ends = array("l")
+        self.hours = array("H")
+        self.total_hours = array("H")
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> "ContractBatch":
+        """Build a batch from (id, school_id, contract_id, starts, ends,
+        hours) rows, dates as ordinals"""
+        batch = cls()
+        for row in rows:
+            batch.append_row(row)
+        return batch
+
+    @classmethod
+    def from_contracts(cls, contracts: Iterable[Contract]) -> "ContractBatch":
+        """Build a batch from Contract objects"""
+        return cls.from_rows(
+            (
+                c.id,
+                c.school_id,
+                c.contract_id,
+                c.starts.toordinal(),
+                c.ends.toordinal(),
+                c.hours,
+            )
+            for c in contracts
+        )
+
+    def append_row(self, row: tuple) -> None:
+        """Add a (id, school_id, contract_id, starts, ends, hours) row"""
+        id, school_id, contract_id, starts, ends, hours = row
+        self.ids.append(id)
+        self.school_ids.append(school_id)
+        self.contract_ids.append(contract_id)
+        self.starts.append(starts)
+        self.ends.append(ends)
+        self.hours.append(hours)
+        # Same as Contract.total_hours, hours plus a third of them rounded up
+        self.total_hours.append(hours + (hours + 2) // 3)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i: int) -> Contract:
+        return Contract(
+            id=self.ids[i],
+            school_id=self.school_ids[i],
+            contract_id=self.contract_ids[i],
+            starts=datetime.fromordinal(self.starts[i]),
+            ends=datetime.fromordinal(self.ends[i]),
+            hours=self.hours[i],
+        )
+
+    def __iter__(self) -> Iterator[Contract]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def slice(self, start: int, stop: int) -> "ContractBatch":
+        """Return the contracts from start to stop as a new batch"""
+        batch = ContractBatch()
+        for name in self.__slots__:
+            setattr(batch, name, getattr(self, name)[start:stop])
+        return batch
+
+    def chunks(self, size: int) -> Iterator["ContractBatch"]:
+        """Split the batch in batches of up to size contracts"""
+        for start in range(0, len(self), size):
+            yield self.slice(start, start + size)
+
+    def __reduce__(self):
+        # Arrays pickle as raw bytes, so batches are cheap to send to workers
+        return (_rebuild_batch, tuple(getattr(self, name) for name in self.__slots__))
+
+
+def _rebuild_batch(*columns) -> ContractBatch:
+    batch = ContractBatch()
+    for name, column in zip(ContractBatch.__slots__, columns):
+        setattr(batch, name, column)
+    return batch
 
 
 class ContractFactory:
     """Factory class for Contract instances"""
 
-    @lru_cache
-    def get(self, id: int, conn=None) -> Contract:
-        """Retrieve a Contract object from database"""
+    columns = ("id",) + Contract.columns
 
-        if not conn:
-            conn = defconn
-        cur = conn.cursor()
-        cur.execute("select * from tb_contract where id = ?", (id,))
-        data = cur.fetchone()
+    @staticmethod
+    def from_row(data: tuple) -> Contract:
+        """Build a Contract from a row selected with ContractFactory.columns"""
         return Contract(
             id=data[0],
             school_id=data[1],
@@ -112,15 +282,104 @@ class ContractFactory:
             hours=data[5],
         )
 
-    @lru_cache
-    def get_all(self, conn=None) -> List[Contract]:
-        """Retrieve all Contract objects from database"""
+    def get(self, id: int, conn=None) -> Contract:
+        """Retrieve a Contract object from database"""
+
+        if not conn:
+            conn = get_connection()
+        obj = identity_map.get(conn, Contract.table, id)
+        if obj is None:
+            cur = conn.cursor()
+            cur.execute(
+                f"select {', '.join(self.columns)} from tb_contract where id = ?",
+                (id,),
+            )
+            obj = self.from_row(cur.fetchone())
+            identity_map.put(conn, Contract.table, id, obj)
+        return obj
+
+    def get_many(self, conn=None, **filters) -> Iterator[Contract]:
+        """Stream Contract objects from database using a single query.
+
+        Accepts the filters understood by utils.build_where, e.g.
+        `id__in=[1, 2]`, `school_id=3` or `starts__gte=datetime(2022, 1, 1)`"""
 
         if not conn:
-            conn = defconn
+            conn = get_connection()
 
+        where, params = build_where(filters, self.columns)
         cur = conn.cursor()
-        cur.execute("select id from tb_contract")
-        ids = cur.fetchall()
-        ids = (id[0] for id in ids)
-        return [self.get(id, conn) for id in ids]
+        cur.execute(
+            f"select {', '.join(self.columns)} from tb_contract{where} order by id",
+            params,
+        )
+        for data in cur:
+            yield self.from_row(data)
+
+    def get_unprocessed(
+        self,
+        year: int,
+        month: int,
+        conn=None,
+        chunk_size: int = BATCH_SIZE,
+        payment_table: str = "tb_perhourpayment",
+    ) -> Iterator[Contract]:
+        """Stream Contracts active in a given year/month and without a
+        payment for it in payment_table, e.g. FormulaPayment.table.
+
+        The anti join runs in sqlite, so payments saved just before are taken
+        into account, and rows are fetched chunk_size at a time"""
+
+        if not conn:
+            conn = get_connection()
+
+        first_day, next_month = month_range(year, month)
+        columns = ", ".join(f"c.{column}" for column in self.columns)
+        cur = conn.cursor()
+        cur.execute(
+            unprocessed_sql(columns, payment_table),
+            (next_month, first_day, year, month),
+        )
+        while rows := cur.fetchmany(chunk_size):
+            for data in rows:
+                yield self.from_row(data)
+
+    def get_batch(self, conn=None, **filters) -> ContractBatch:
+        """Load Contracts straight into a ContractBatch, no Contract object
+        is built. Accepts the filters of get_many"""
+
+        if not conn:
+            conn = get_connection()
+
+        where, params = build_where(filters, self.columns)
+        cur = conn.cursor()
+        cur.execute(
+            f"select {BATCH_COLUMNS.format(prefix='')} from tb_contract{where}"
+            " order by id",
+            params,
+        )
+        return ContractBatch.from_rows(cur)
+
+    def get_unprocessed_batch(
+        self,
+        year: int,
+        month: int,
+        conn=None,
+        payment_table: str = "tb_perhourpayment",
+    ) -> ContractBatch:
+        """Load the Contracts get_unprocessed gives into a ContractBatch"""
+
+        if not conn:
+            conn = get_connection()
+
+        first_day, next_month = month_range(year, month)
+        cur = conn.cursor()
+        cur.execute(
+            unprocessed_sql(BATCH_COLUMNS.format(prefix="c."), payment_table),
+            (next_month, first_day, year, month),
+        )
+        return ContractBatch.from_rows(cur)
+
+    def get_all(self, conn=None) -> List[Contract]:
+        """Retrieve all Contract objects from database"""
+        return list(self.get_many(conn))
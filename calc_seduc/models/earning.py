@@ -1,9 +1,10 @@
-from decimal import Decimal
 from dataclasses import dataclass
-from functools import lru_cache
 from datetime import datetime
-from typing import Protocol, Optional, List
-from calc_seduc.connection import defconn
+from typing import ClassVar, Protocol, Optional, List, Iterable, Iterator, Tuple
+from calc_seduc.cache import identity_map
+from calc_seduc.connection import get_connection
+from calc_seduc.money import Money
+from calc_seduc.utils import BATCH_SIZE, build_where, save_many
 
 
 class AbstractEarning(Protocol):
@@ -19,10 +20,17 @@ class AbstractEarning(Protocol):
 class Earning:
     """Class that represents a concrete Earning"""
 
+    table: ClassVar[str] = "tb_earning"
+    columns: ClassVar[Tuple[str, ...]] = ("date", "value")
+
     date: datetime
-    value: Decimal
+    value: Money
     id: Optional[int] = None
 
+    def __post_init__(self):
+        # Numbers of reais, e.g. Decimal("74.04"), are converted
+        self.value = Money.of(self.value)
+
     @property
     def ref_month(self):
         """Return month of reference from earning"""
@@ -33,10 +41,26 @@ class Earning:
         """Return year of reference from earning"""
         return self.date.year if self.date.month != 1 else self.date.year - 1
 
+    def row(self) -> tuple:
+        """Return instance data in Earning.columns order"""
+        return (
+            datetime(self.date.year, self.date.month, self.date.day),
+            Money.of(self.value).units,
+        )
+
+    @classmethod
+    def save_many(
+        cls, objects: Iterable["Earning"], conn=None, batch_size: int = BATCH_SIZE
+    ) -> None:
+        """Saves many Earning instances on database in a single transaction"""
+        if not conn:
+            conn = get_connection()
+        save_many(conn, cls.table, cls.columns, objects, cls.row, batch_size)
+
     def save(self, conn=None):
         """Saves Earning instance data on database"""
         if not conn:
-            conn = defconn
+            conn = get_connection()
         cur = conn.cursor()
 
         if not self.id:
@@ -49,7 +73,7 @@ class Earning:
             """,
                 (
                     datetime(self.date.year, self.date.month, self.date.day),
-                    float(self.value),
+                    Money.of(self.value).units,
                 ),
             )
             id = cur.fetchone()[0]
@@ -64,36 +88,56 @@ class Earning:
             """,
                 (
                     datetime(self.date.year, self.date.month, self.date.day),
-                    float(self.value),
+                    Money.of(self.value).units,
                     self.id,
                 ),
             )
         conn.commit()
+        identity_map.invalidate(conn, self.table, self.id)
 
 
 class EarningFactory:
     """Factory class for Earning instances"""
 
-    @lru_cache
+    columns = ("id",) + Earning.columns
+
+    @staticmethod
+    def from_row(data: tuple) -> Earning:
+        """Build a Earning from a row selected with EarningFactory.columns"""
+        return Earning(id=data[0], date=data[1], value=Money(data[2]))
+
     def get(self, id: int, conn=None) -> Earning:
         """Retrieve a Earning object from database"""
 
         if not conn:
-            conn = defconn
-        cur = conn.cursor()
-        cur.execute("select * from tb_earning where id = ?", (id,))
-        data = cur.fetchone()
-        return Earning(id=data[0], date=data[1], value=Decimal(data[2]))
+            conn = get_connection()
+        obj = identity_map.get(conn, Earning.table, id)
+        if obj is None:
+            cur = conn.cursor()
+            cur.execute(
+                f"select {', '.join(self.columns)} from tb_earning where id = ?", (id,)
+            )
+            obj = self.from_row(cur.fetchone())
+            identity_map.put(conn, Earning.table, id, obj)
+        return obj
 
-    @lru_cache
-    def get_all(self, conn=None) -> List[Earning]:
-        """Retrieve all Earning objects from database"""
+    def get_many(self, conn=None, **filters) -> Iterator[Earning]:
+        """Stream Earning objects from database using a single query.
+
+        Accepts the filters understood by utils.build_where"""
 
         if not conn:
-            conn = defconn
+            conn = get_connection()
 
+        where, params = build_where(filters, self.columns)
         cur = conn.cursor()
-        cur.execute("select id from tb_earning")
-        ids = cur.fetchall()
-        ids = (id[0] for id in ids)
-        return [self.get(id, conn) for id in ids]
+        cur.execute(
+            f"select {', '.join(self.columns)} from tb_earning{where} order by id",
+            params,
+        )
+        for data in cur:
+            yield self.from_row(data)
+
+    def get_all(self, conn=None) -> List[Earning]:
+        """Retrieve all Earning objects from database"""
+        return list(self.get_many(conn))
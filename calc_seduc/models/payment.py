@@ -1,36 +1,90 @@
-from decimal import Decimal
 from dataclasses import dataclass
-from functools import lru_cache
 from datetime import datetime
-from typing import Protocol, Optional, List
-from calc_seduc.connection import defconn
+from typing import ClassVar, Protocol, Optional, List, Iterable, Iterator, Tuple
+from calc_seduc.cache import identity_map
+from calc_seduc.connection import get_connection
+from calc_seduc.money import Money
+from calc_seduc.utils import BATCH_SIZE, build_where, save_many
 
 
 class AbstractPayment(Protocol):
     """Protocol that abstracts Payment"""
 
+    # Table the payments of a type are saved to
+    table: ClassVar[str]
+    contract_id: int
+    paymenttable_id: int
+    process_date: datetime
+    ref_month: int
+    ref_year: int
+    value: Money
     id: Optional[int] = None
 
     def save(self, conn=None):
         """Saves object data instance into database"""
 
+    @classmethod
+    def save_many(cls, objects, conn=None, batch_size: int = BATCH_SIZE) -> None:
+        """Saves many instances into database in a single transaction"""
+
 
 @dataclass(slots=True)
 class PerHourPayment:
     """Class that represents a PerHourPayment"""
 
+    table: ClassVar[str] = "tb_perhourpayment"
+    columns: ClassVar[Tuple[str, ...]] = (
+        "contract_id",
+        "paymenttable_id",
+        "process_date",
+        "ref_month",
+        "ref_year",
+        "value",
+    )
+
     contract_id: int
     paymenttable_id: int
     process_date: datetime
     ref_month: int
     ref_year: int
-    value: Decimal
+    value: Money
     id: Optional[int] = None
 
+    def __post_init__(self):
+        # Numbers of reais, e.g. Decimal("2000.00"), are converted
+        self.value = Money.of(self.value)
+
+    def row(self) -> tuple:
+        """Return instance data in PerHourPayment.columns order"""
+        return (
+            self.contract_id,
+            self.paymenttable_id,
+            datetime(
+                self.process_date.year,
+                self.process_date.month,
+                self.process_date.day,
+            ),
+            self.ref_month,
+            self.ref_year,
+            Money.of(self.value).units,
+        )
+
+    @classmethod
+    def save_many(
+        cls,
+        objects: Iterable["PerHourPayment"],
+        conn=None,
+        batch_size: int = BATCH_SIZE,
+    ) -> None:
+        """Saves many PerHourPayment instances on database in a single transaction"""
+        if not conn:
+            conn = get_connection()
+        save_many(conn, cls.table, cls.columns, objects, cls.row, batch_size)
+
     def save(self, conn=None):
         """Saves PerHourPayment instance data on database"""
         if not conn:
-            conn = defconn
+            conn = get_connection()
         cur = conn.cursor()
 
         if not self.id:
@@ -56,7 +110,7 @@ class PerHourPayment:
                     ),
                     self.ref_month,
                     self.ref_year,
-                    float(self.value),
+                    Money.of(self.value).units,
                 ),
             )
             id = cur.fetchone()[0]
@@ -83,20 +137,130 @@ class PerHourPayment:
                     ),
                     self.ref_month,
                     self.ref_year,
-                    float(self.value),
+                    Money.of(self.value).units,
                     self.id,
                 ),
             )
         conn.commit()
+        identity_map.invalidate(conn, self.table, self.id)
 
 
-@dataclass
+@dataclass(slots=True)
 class FormulaPayment:
-    """Class that represents a FormulaPayment"""
+    """Class that represents a FormulaPayment, a payment whose value comes
+    from the formula of its payment table"""
+
+    table: ClassVar[str] = "tb_formulapayment"
+    columns: ClassVar[Tuple[str, ...]] = (
+        "contract_id",
+        "paymenttable_id",
+        "process_date",
+        "ref_month",
+        "ref_year",
+        "value",
+    )
+
+    contract_id: int
+    paymenttable_id: int
+    process_date: datetime
+    ref_month: int
+    ref_year: int
+    value: Money
+    id: Optional[int] = None
 
-    pass
+    def __post_init__(self):
+        # Numbers of reais, e.g. Decimal("2000.00"), are converted
+        self.value = Money.of(self.value)
+
+    def row(self) -> tuple:
+        """Return instance data in FormulaPayment.columns order"""
+        return (
+            self.contract_id,
+            self.paymenttable_id,
+            datetime(
+                self.process_date.year,
+                self.process_date.month,
+                self.process_date.day,
+            ),
+            self.ref_month,
+            self.ref_year,
+            Money.of(self.value).units,
+        )
+
+    @classmethod
+    def save_many(
+        cls,
+        objects: Iterable["FormulaPayment"],
+        conn=None,
+        batch_size: int = BATCH_SIZE,
+    ) -> None:
+        """Saves many FormulaPayment instances on database in a single transaction"""
+        if not conn:
+            conn = get_connection()
+        save_many(conn, cls.table, cls.columns, objects, cls.row, batch_size)
 
-    # TODO: implement its logic
+    def save(self, conn=None):
+        """Saves FormulaPayment instance data on database"""
+        if not conn:
+            conn = get_connection()
+        cur = conn.cursor()
+
+        if not self.id:
+            cur.execute(
+                """
+                insert into tb_formulapayment (
+                        contract_id,
+                        paymenttable_id,
+                        process_date,
+                        ref_month,
+                        ref_year,
+                        value
+                ) values (?, ?, ?, ?, ?, ?)
+                returning id
+            """,
+                (
+                    self.contract_id,
+                    self.paymenttable_id,
+                    datetime(
+                        self.process_date.year,
+                        self.process_date.month,
+                        self.process_date.day,
+                    ),
+                    self.ref_month,
+                    self.ref_year,
+                    Money.of(self.value).units,
+                ),
+            )
+            id = cur.fetchone()[0]
+            self.id = id
+        else:
+            cur.execute(
+                """
+                update tb_formulapayment
+                set contract_id = ?,
+                    paymenttable_id = ?,
+                    process_date = ?,
+                    ref_month = ?,
+                    ref_year = ?,
+                    value = ?
+                where id = ?;
+            """,
+                (
+                    self.contract_id,
+                    self.paymenttable_id,
+                    datetime(
+                        self.process_date.year,
+                        self.process_date.month,
+                        self.process_date.day,
+                    ),
+                    self.ref_month,
+                    self.ref_year,
+                    Money.of(self.value).units,
+                    self.id,
+                ),
+            )
+        conn.commit()
+        identity_map.invalidate(conn, self.table, self.id)
 
 
 class AbstractPaymentFactory(Protocol):
@@ -112,15 +276,11 @@ class AbstractPaymentFactory(Protocol):
 class PerHourPaymentFactory:
     """Factory class for PerHourPayment instances"""
 
-    @lru_cache
-    def get(self, id: int, conn=None) -> PerHourPayment:
-        """Retrieve a PerHourPayment object from database"""
+    columns = ("id",) + PerHourPayment.columns
 
-        if not conn:
-            conn = defconn
-        cur = conn.cursor()
-        cur.execute("select * from tb_perhourpayment where id = ?", (id,))
-        data = cur.fetchone()
+    @staticmethod
+    def from_row(data: tuple) -> PerHourPayment:
+        """Build a PerHourPayment from a row selected with the factory columns"""
         return PerHourPayment(
             id=data[0],
             contract_id=data[1],
@@ -128,39 +288,105 @@ class PerHourPaymentFactory:
             process_date=data[3],
             ref_month=data[4],
             ref_year=data[5],
-            value=Decimal(data[6]),
+            value=Money(data[6]),
         )
 
-    @lru_cache
-    def get_all(self, conn=None) -> List[PerHourPayment]:
-        """Retrieve all PerHourPayment objects from database"""
+    def get(self, id: int, conn=None) -> PerHourPayment:
+        """Retrieve a PerHourPayment object from database"""
 
         if not conn:
-            conn = defconn
+            conn = get_connection()
+        obj = identity_map.get(conn, PerHourPayment.table, id)
+        if obj is None:
+            cur = conn.cursor()
+            cur.execute(
+                f"select {', '.join(self.columns)} "
+                "from tb_perhourpayment where id = ?",
+                (id,),
+            )
+            obj = self.from_row(cur.fetchone())
+            identity_map.put(conn, PerHourPayment.table, id, obj)
+        return obj
+
+    def get_many(self, conn=None, **filters) -> Iterator[PerHourPayment]:
+        """Stream PerHourPayment objects from database using a single query.
+
+        Accepts the filters understood by utils.build_where"""
 
+        if not conn:
+            conn = get_connection()
+
+        where, params = build_where(filters, self.columns)
         cur = conn.cursor()
-        cur.execute("select id from tb_perhourpayment")
-        ids = cur.fetchall()
-        ids = (id[0] for id in ids)
-        return [self.get(id, conn) for id in ids]
+        cur.execute(
+            f"select {', '.join(self.columns)} "
+            f"from tb_perhourpayment{where} order by id",
+            params,
+        )
+        for data in cur:
+            yield self.from_row(data)
+
+    def get_all(self, conn=None) -> List[PerHourPayment]:
+        """Retrieve all PerHourPayment objects from database"""
+        return list(self.get_many(conn))
 
 
 class FormulaPaymentFactory:
-    """Factory class for PerHourPayment instances"""
+    """Factory class for FormulaPayment instances"""
 
-    @lru_cache
-    def get(self, id: int, conn=None) -> PerHourPayment:
-        """Retrieve a PerHourPayment object from database"""
-        pass
+    columns = ("id",) + FormulaPayment.columns
 
-        # TODO: create this method logic
+    @staticmethod
+    def from_row(data: tuple) -> FormulaPayment:
+        """Build a FormulaPayment from a row selected with the factory columns"""
+        return FormulaPayment(
+            id=data[0],
+            contract_id=data[1],
+            paymenttable_id=data[2],
+            process_date=data[3],
+            ref_month=data[4],
+            ref_year=data[5],
+            value=Money(data[6]),
+        )
 
-    @lru_cache
-    def get_all(self, conn=None) -> List[PerHourPayment]:
-        """Retrieve all PerHourPayment objects from database"""
-        pass
+    def get(self, id: int, conn=None) -> FormulaPayment:
+        """Retrieve a FormulaPayment object from database"""
+
+        if not conn:
+            conn = get_connection()
+        obj = identity_map.get(conn, FormulaPayment.table, id)
+        if obj is None:
+            cur = conn.cursor()
+            cur.execute(
+                f"select {', '.join(self.columns)} "
+                "from tb_formulapayment where id = ?",
+                (id,),
+            )
+            obj = self.from_row(cur.fetchone())
+            identity_map.put(conn, FormulaPayment.table, id, obj)
+        return obj
+
+    def get_many(self, conn=None, **filters) -> Iterator[FormulaPayment]:
+        """Stream FormulaPayment objects from database using a single query.
+
+        Accepts the filters understood by utils.build_where"""
+
+        if not conn:
+            conn = get_connection()
+
+        where, params = build_where(filters, self.columns)
+        cur = conn.cursor()
+        cur.execute(
+            f"select {', '.join(self.columns)} "
+            f"from tb_formulapayment{where} order by id",
+            params,
+        )
+        for data in cur:
+            yield self.from_row(data)
 
-        # TODO: create this method logic
+    def get_all(self, conn=None) -> List[FormulaPayment]:
+        """Retrieve all FormulaPayment objects from database"""
+        return list(self.get_many(conn))
 
 
 class PaymentFactory:
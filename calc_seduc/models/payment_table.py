@@ -1,9 +1,10 @@
-from decimal import Decimal
 from dataclasses import dataclass
-from functools import lru_cache
 from datetime import datetime
-from typing import Protocol, Optional, List
-from calc_seduc.connection import defconn
+from typing import ClassVar, Protocol, Optional, List, Iterable, Iterator, Tuple
+from calc_seduc.cache import identity_map, rate_cache
+from calc_seduc.connection import get_connection
+from calc_seduc.money import HourRate, Money
+from calc_seduc.utils import BATCH_SIZE, build_where, save_many
 
 
 class AbstractPaymentTable(Protocol):
@@ -19,34 +20,76 @@ class AbstractPaymentTable(Protocol):
 class PaymentTable:
     """Class that represents a concrete PaymentTable"""
 
+    table: ClassVar[str] = "tb_paymenttable"
+    columns: ClassVar[Tuple[str, ...]] = (
+        "starts",
+        "ends",
+        "hour_value",
+        "prv",
+        "eoy_bonus",
+        "formula",
+    )
+
     starts: datetime
     ends: datetime
-    hour_value: Decimal
-    prv: Decimal
-    eoy_bonus: Decimal  # end of year bonus
+    hour_value: HourRate
+    prv: Money
+    eoy_bonus: Money  # end of year bonus
     id: Optional[int] = None
+    # Used by FormulaProcessor, see calc_seduc.formula
+    formula: Optional[str] = None
+
+    def __post_init__(self):
+        # Numbers of reais, e.g. Decimal("19.228"), are converted
+        self.hour_value = HourRate.of(self.hour_value)
+        self.prv = Money.of(self.prv)
+        self.eoy_bonus = Money.of(self.eoy_bonus)
+
+    def row(self) -> tuple:
+        """Return instance data in PaymentTable.columns order"""
+        return (
+            datetime(self.starts.year, self.starts.month, self.starts.day),
+            datetime(self.ends.year, self.ends.month, self.ends.day),
+            HourRate.of(self.hour_value).units,
+            Money.of(self.prv).units,
+            Money.of(self.eoy_bonus).units,
+            self.formula,
+        )
+
+    @classmethod
+    def save_many(
+        cls, objects: Iterable["PaymentTable"], conn=None, batch_size: int = BATCH_SIZE
+    ) -> None:
+        """Saves many PaymentTable instances on database in a single transaction"""
+        if not conn:
+            conn = get_connection()
+        objects = list(objects)
+        save_many(conn, cls.table, cls.columns, objects, cls.row, batch_size)
+        for obj in objects:
+            rate_cache.invalidate(obj.id)
 
     def save(self, conn=None):
         """Saves Payment instance data on database"""
 
         if not conn:
-            conn = defconn
+            conn = get_connection()
         cur = conn.cursor()
 
         if not self.id:
             cur.execute(
                 """
                 insert into tb_paymenttable
-                (starts, ends, hour_value, prv, eoy_bonus) values
-                (?, ?, ?, ?, ?)
+                (starts, ends, hour_value, prv, eoy_bonus, formula) values
+                (?, ?, ?, ?, ?, ?)
                 returning id
             """,
                 (
                     self.starts,
                     self.ends,
-                    float(self.hour_value),
-                    float(self.prv),
-                    float(self.eoy_bonus),
+                    HourRate.of(self.hour_value).units,
+                    Money.of(self.prv).units,
+                    Money.of(self.eoy_bonus).units,
+                    self.formula,
                 ),
             )
             id = cur.fetchone()[0]
@@ -59,57 +102,85 @@ class PaymentTable:
                     ends = ?,
                     hour_value = ?,
                     prv = ?,
-                    eoy_bonus = ?
+                    eoy_bonus = ?,
+                    formula = ?
                 where id = ?;
             """,
                 (
                     datetime(self.starts.year, self.starts.month, self.starts.day),
                     datetime(self.ends.year, self.ends.month, self.ends.day),
-                    float(self.hour_value),
-                    float(self.prv),
-                    float(self.eoy_bonus),
+                    HourRate.of(self.hour_value).units,
+                    Money.of(self.prv).units,
+                    Money.of(self.eoy_bonus).units,
+                    self.formula,
                     self.id,
                 ),
             )
         conn.commit()
+        identity_map.invalidate(conn, self.table, self.id)
+        rate_cache.invalidate(self.id)
 
     def is_applicable(self, month: int, year: int) -> bool:
         """Check if a PaymentTable is applicable for a given month and year"""
         return (
-            self.starts.month <= month <= self.ends.month
-            and self.starts.year <= year <= self.ends.year
+            (self.starts.year, self.starts.month)
+            <= (year, month)
+            <= (self.ends.year, self.ends.month)
         )
 
 
 class PaymentTableFactory:
     """Factory class for PaymentTable instances"""
 
-    @lru_cache
-    def get(self, id: int, conn=None) -> PaymentTable:
-        """Retrieve a PaymentTable object from database"""
+    columns = ("id",) + PaymentTable.columns
 
-        if not conn:
-            conn = defconn
-        cur = conn.cursor()
-        cur.execute("select * from tb_paymenttable where id = ?", (id,))
-        data = cur.fetchone()
+    @staticmethod
+    def from_row(data: tuple) -> PaymentTable:
+        """Build a PaymentTable from a row selected with PaymentTableFactory.columns"""
         return PaymentTable(
             id=data[0],
             starts=data[1],
             ends=data[2],
-            hour_value=Decimal(data[3]),
-            prv=Decimal(data[4]),
-            eoy_bonus=Decimal(data[5]),
+            hour_value=HourRate(data[3]),
+            prv=Money(data[4]),
+            eoy_bonus=Money(data[5]),
+            formula=data[6],
         )
 
-    @lru_cache
-    def get_all(self, conn=None) -> List[PaymentTable]:
-        """Retrieve all PaymentTable objects from database"""
+    def get(self, id: int, conn=None) -> PaymentTable:
+        """Retrieve a PaymentTable object from database"""
+
         if not conn:
-            conn = defconn
+            conn = get_connection()
+        obj = identity_map.get(conn, PaymentTable.table, id)
+        if obj is None:
+            cur = conn.cursor()
+            cur.execute(
+                f"select {', '.join(self.columns)} from tb_paymenttable where id = ?",
+                (id,),
+            )
+            obj = self.from_row(cur.fetchone())
+            identity_map.put(conn, PaymentTable.table, id, obj)
+        return obj
+
+    def get_many(self, conn=None, **filters) -> Iterator[PaymentTable]:
+        """Stream PaymentTable objects from database using a single query.
+
+        Accepts the filters understood by utils.build_where"""
 
+        if not conn:
+            conn = get_connection()
+
+        where, params = build_where(filters, self.columns)
         cur = conn.cursor()
-        cur.execute("select id from tb_paymenttable")
-        ids = cur.fetchall()
-        ids = (id[0] for id in ids)
-        return [self.get(id, conn) for id in ids]
+        cur.execute(
+            f"select {', '.join(self.columns)} "
+            f"from tb_paymenttable{where} order by id",
+            params,
+        )
+        for data in cur:
+            yield self.from_row(data)
+
+    def get_all(self, conn=None) -> List[PaymentTable]:
+        """Retrieve all PaymentTable objects from database"""
+        return list(self.get_many(conn))
@@ -1,7 +1,8 @@
 from dataclasses import dataclass
-from typing import Protocol, Optional, List
-from calc_seduc.connection import defconn
-from functools import lru_cache
+from typing import ClassVar, Protocol, Optional, List, Iterable, Iterator, Tuple
+from calc_seduc.cache import identity_map
+from calc_seduc.connection import get_connection
+from calc_seduc.utils import BATCH_SIZE, build_where, save_many
 
 
 class AbstractSchool(Protocol):
@@ -17,14 +18,30 @@ class AbstractSchool(Protocol):
 class School:
     """Class that represents a School"""
 
+    table: ClassVar[str] = "tb_school"
+    columns: ClassVar[Tuple[str, ...]] = ("name", "inep")
+
     name: str
     inep: int
     id: Optional[int] = None
 
+    def row(self) -> tuple:
+        """Return instance data in School.columns order"""
+        return (self.name, self.inep)
+
+    @classmethod
+    def save_many(
+        cls, objects: Iterable["School"], conn=None, batch_size: int = BATCH_SIZE
+    ) -> None:
+        """Saves many School instances on database in a single transaction"""
+        if not conn:
+            conn = get_connection()
+        save_many(conn, cls.table, cls.columns, objects, cls.row, batch_size)
+
     def save(self, conn=None):
         """Saves School instance data on database"""
         if not conn:
-            conn = defconn
+            conn = get_connection()
         cur = conn.cursor()
 
         if not self.id:
@@ -50,29 +67,51 @@ class School:
                 (self.name, self.inep, self.id),
             )
         conn.commit()
+        identity_map.invalidate(conn, self.table, self.id)
 
 
 class SchoolFactory:
     """Factory class for School instances"""
 
-    @lru_cache
+    columns = ("id",) + School.columns
+
+    @staticmethod
+    def from_row(data: tuple) -> School:
+        """Build a School from a row selected with SchoolFactory.columns"""
+        return School(id=data[0], name=data[1], inep=data[2])
+
     def get(self, id: int, conn=None) -> School:
         """Retrieve a School object from database"""
-        conn = defconn if not conn else conn
-        cur = conn.cursor()
-        cur.execute("select * from tb_school where id = ?", (id,))
-        data = cur.fetchone()
-        return School(id=data[0], name=data[1], inep=data[2])
 
-    @lru_cache
-    def get_all(self, conn=None) -> List[School]:
-        """Retrieve all School objects from database"""
+        if not conn:
+            conn = get_connection()
+        obj = identity_map.get(conn, School.table, id)
+        if obj is None:
+            cur = conn.cursor()
+            cur.execute(
+                f"select {', '.join(self.columns)} from tb_school where id = ?", (id,)
+            )
+            obj = self.from_row(cur.fetchone())
+            identity_map.put(conn, School.table, id, obj)
+        return obj
+
+    def get_many(self, conn=None, **filters) -> Iterator[School]:
+        """Stream School objects from database using a single query.
+
+        Accepts the filters understood by utils.build_where"""
 
         if not conn:
-            conn = defconn
+            conn = get_connection()
 
+        where, params = build_where(filters, self.columns)
         cur = conn.cursor()
-        cur.execute("select id from tb_school")
-        ids = cur.fetchall()
-        ids = (id[0] for id in ids)
-        return [self.get(id, conn) for id in ids]
+        cur.execute(
+            f"select {', '.join(self.columns)} from tb_school{where} order by id",
+            params,
+        )
+        for data in cur:
+            yield self.from_row(data)
+
+    def get_all(self, conn=None) -> List[School]:
+        """Retrieve all School objects from database"""
+        return list(self.get_many(conn))
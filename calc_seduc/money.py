@@ -0,0 +1,118 @@
+"""Exact money values backed by integers.
+
+Money counts centavos and HourRate counts thousandths of real, the precision
+SEDUC hour values are published with. Both are stored as INTEGER columns.
+Arithmetic on them never rounds; the only rounding step is round_half_up,
+used once when a computed amount is turned into centavos"""
+
+from decimal import ROUND_HALF_UP, Decimal, localcontext
+from functools import total_ordering
+from typing import Union
+
+
+def round_half_up(numerator: int, denominator: int) -> int:
+    """Divide two integers rounding halves away from zero"""
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if remainder * 2 >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+@total_ordering
+class Money:
+    """An amount of reais held as an integer number of centavos"""
+
+    __slots__ = ("units",)
+
+    # Decimal places of one unit
+    PLACES = 2
+
+    def __init__(self, units: int = 0):
+        # A float or Decimal here is an amount of reais, not of units, and
+        # truncating it would lose money. Amounts go through of or from_decimal
+        if not isinstance(units, int):
+            raise TypeError(
+                f"{type(self).__name__} units must be int, "
+                f"not {type(units).__name__}: {units!r}"
+            )
+        self.units = units
+
+    @classmethod
+    def from_decimal(cls, value: Union[Decimal, int, str]) -> "Money":
+        """Build from a number of reais, rounding half up to PLACES"""
+        with localcontext() as context:
+            context.prec = 50
+            units = Decimal(value).scaleb(cls.PLACES)
+            return cls(int(units.quantize(Decimal(1), rounding=ROUND_HALF_UP)))
+
+    @classmethod
+    def of(cls, value) -> "Money":
+        """Return value as this type, converting numbers of reais"""
+        if type(value) is cls:
+            return value
+        if isinstance(value, Money):
+            raise TypeError(f"Can't use {type(value).__name__} as {cls.__name__}")
+        if isinstance(value, float):
+            # The shortest repr of a float is the number it was written as
+            value = repr(value)
+        return cls.from_decimal(value)
+
+    def to_decimal(self) -> Decimal:
+        """Return the amount of reais as an exact Decimal"""
+        return Decimal(self.units).scaleb(-self.PLACES)
+
+    def __str__(self) -> str:
+        sign = "-" if self.units < 0 else ""
+        whole, fraction = divmod(abs(self.units), 10**self.PLACES)
+        return f"{sign}{whole}.{fraction:0{self.PLACES}d}"
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}('{self}')"
+
+    def __hash__(self) -> int:
+        return hash((type(self), self.units))
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.units == other.units
+
+    def __lt__(self, other) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.units < other.units
+
+    def __add__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return type(self)(self.units + other.units)
+
+    def __sub__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return type(self)(self.units - other.units)
+
+    def __mul__(self, other):
+        if not isinstance(other, int):
+            return NotImplemented
+        return type(self)(self.units * other)
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return type(self)(-self.units)
+
+    def __bool__(self) -> bool:
+        return bool(self.units)
+
+    def __reduce__(self):
+        return (type(self), (self.units,))
+
+
+class HourRate(Money):
+    """Value of one work hour, held as an integer number of thousandths of
+    real"""
+
+    __slots__ = ()
+
+    PLACES = 3
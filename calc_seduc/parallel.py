@@ -0,0 +1,82 @@
+"""Module that runs payment processors on many cores"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Iterable, List, Optional, Tuple, cast
+from calc_seduc.models import AbstractContract, AbstractPayment, ContractBatch
+from calc_seduc.utils import BATCH_SIZE, chunked
+
+
+# Processor shipped to every worker process by the pool initializer
+_processor: Any = None
+
+
+@dataclass(slots=True)
+class ChunkFailure:
+    """A chunk of contracts whose processing raised an error"""
+
+    chunk: int
+    contract_ids: List[int]
+    error: str
+
+
+def _init_worker(processor) -> None:
+    global _processor
+    _processor = processor
+
+
+def _process_chunk(
+    contracts: Iterable[AbstractContract],
+    periods: List[Tuple[int, int]],
+    process_date: datetime,
+) -> List[AbstractPayment]:
+    return _processor.process_many(contracts, periods, process_date=process_date)
+
+
+def process_parallel(
+    processor,
+    contracts: Iterable[AbstractContract],
+    periods: Iterable[Tuple[int, int]],
+    workers: int,
+    chunk_size: int = BATCH_SIZE,
+    process_date: Optional[datetime] = None,
+) -> Tuple[List[AbstractPayment], List[ChunkFailure]]:
+    """Process contracts chunk by chunk on a pool of worker processes.
+
+    The processor (payment tables and calendar included) is sent once to
+    every worker. Payments come back in contract order, the same ones
+    processor.process_many returns, and a chunk that raises is reported in
+    the returned failures while the other chunks are still processed"""
+    periods = list(periods)
+    if not process_date:
+        process_date = datetime.now()
+
+    payments: List[AbstractPayment] = []
+    failures: List[ChunkFailure] = []
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(processor,)
+    ) as pool:
+        chunks: List[Iterable[AbstractContract]]
+        if isinstance(contracts, ContractBatch):
+            # Sent to workers as arrays, not as Contract objects
+            chunks = list(contracts.chunks(chunk_size))
+        else:
+            chunks = list(chunked(contracts, chunk_size))
+        futures = [
+            pool.submit(_process_chunk, chunk, periods, process_date)
+            for chunk in chunks
+        ]
+        for i, (chunk, future) in enumerate(zip(chunks, futures)):
+            try:
+                payments.extend(future.result())
+            except Exception as error:
+                failures.append(
+                    ChunkFailure(
+                        chunk=i,
+                        contract_ids=[cast(int, contract.id) for contract in chunk],
+                        error=repr(error),
+                    )
+                )
+
+    return payments, failures
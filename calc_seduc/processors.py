@@ -1,20 +1,70 @@
 """Module that offers all types of payment processors objects"""
 
-from decimal import Decimal
-from typing import Protocol, List
-from calc_seduc.models import AbstractContract, PaymentTable
-from calc_seduc.calendar import Month
+from bisect import bisect_right
+from datetime import datetime
+from fractions import Fraction
+from typing import (
+    Any,
+    ClassVar,
+    Dict,
+    Protocol,
+    List,
+    Optional,
+    Iterable,
+    Sequence,
+    Tuple,
+    Type,
+    cast,
+)
+from calc_seduc.cache import MonthRate, rate_cache
+from calc_seduc.models import (
+    AbstractContract,
+    AbstractPayment,
+    ContractBatch,
+    FormulaPayment,
+    PaymentTable,
+    PerHourPayment,
+)
+from calc_seduc.calendar import CalendarIndex
+from calc_seduc.formula import DEFAULT_FORMULA, compile_formula
+from calc_seduc.money import HourRate, Money, round_half_up
 
 
 class AbstractProcessor(Protocol):
     """Protocol that abstracts all application's payment processors"""
 
-    def __init__(self, payment_tables: List[PaymentTable], conn=None):
+    # The payment class generated, its table holds the saved payments
+    payment_type: ClassVar[Type[AbstractPayment]]
+
+    def __init__(
+        self,
+        payment_tables: List[PaymentTable],
+        conn=None,
+        calendar: Optional[CalendarIndex] = None,
+    ):
         """Processor initializer"""
 
+    def define_payment_table(self, year: int, month: int) -> PaymentTable:
+        """Get the payment table applicable for a given year/month"""
+
     def process(self, contract: AbstractContract, year: int, month: int):
         """Method that process information from a given contract"""
 
+    def process_many(
+        self,
+        contracts: Iterable[AbstractContract],
+        periods: Iterable[Tuple[int, int]],
+        process_date: Optional[datetime] = None,
+    ) -> List[AbstractPayment]:
+        """Method that process every given contract for every (year, month)"""
+
+    def process_pairs(
+        self,
+        pairs: Iterable[Tuple[AbstractContract, int, int]],
+        process_date: Optional[datetime] = None,
+    ) -> Sequence[AbstractPayment]:
+        """Method that process (contract, year, month) pairs"""
+
     # TODO: check what methods a PaymentProcessor should have
 
 
@@ -25,35 +75,480 @@ class NoPaymentTable(Exception):
     pass
 
 
-class PerHourProcessor:
-    """A processor that generates PerHourPayments"""
+class OverlappingPaymentTables(Exception):
+    """This error is raised when more than one PaymentTable is applicable for
+    the same year/month"""
+
+    pass
+
+
+def month_key(year: int, month: int) -> int:
+    """Return a sortable, contiguous number for a given year/month"""
+    return year * 12 + month - 1
+
+
+def key_month(key: int) -> Tuple[int, int]:
+    """Return the (year, month) of a given month_key"""
+    return key // 12, key % 12 + 1
+
+
+class PaymentTableIndex:
+    """Sorted interval index over payment tables (starts, ends) months.
+
+    Overlapping tables raise OverlappingPaymentTables when the index is built.
+    Months not covered by any table are kept in gaps as ((year, month),
+    (year, month)) ranges, so they can be reported before processing"""
+
+    def __init__(self, payment_tables: List[PaymentTable]):
+        tables = sorted(
+            payment_tables, key=lambda t: month_key(t.starts.year, t.starts.month)
+        )
+        self.tables = tables
+        self.starts = [month_key(t.starts.year, t.starts.month) for t in tables]
+        self.ends = [month_key(t.ends.year, t.ends.month) for t in tables]
+        self.gaps: List[Tuple[Tuple[int, int], Tuple[int, int]]] = []
 
-    # TODO: create PerHourProcessor logic
+        for i in range(1, len(tables)):
+            if self.starts[i] <= self.ends[i - 1]:
+                raise OverlappingPaymentTables(
+                    f"Payment tables {tables[i - 1].id} and {tables[i].id} overlap"
+                )
+            if self.starts[i] > self.ends[i - 1] + 1:
+                self.gaps.append(
+                    (
+                        key_month(self.ends[i - 1] + 1),
+                        key_month(self.starts[i] - 1),
+                    )
+                )
 
-    def __init__(self, payment_tables: List[PaymentTable], conn=None):
+    def find(self, year: int, month: int) -> Optional[PaymentTable]:
+        """Return the PaymentTable applicable for a given year/month, if any"""
+        key = month_key(year, month)
+        i = bisect_right(self.starts, key) - 1
+        if i >= 0 and key <= self.ends[i]:
+            return self.tables[i]
+        return None
+
+
+class TableProcessor:
+    """Base of processors that pay contracts by the payment table of each
+    month. Subclasses implement process and process_pairs.
+
+    With prorate (the default) a contract is only paid the workdays of a
+    month between its starts and ends days, otherwise every month it is
+    processed for is paid whole"""
+
+    def __init__(
+        self,
+        payment_tables: List[PaymentTable],
+        conn=None,
+        calendar: Optional[CalendarIndex] = None,
+        prorate: bool = True,
+    ):
         self.payment_tables = payment_tables
+        self.table_index = PaymentTableIndex(payment_tables)
+        self.calendar = calendar if calendar else CalendarIndex()
+        self.prorate = prorate
 
     def define_payment_table(self, year: int, month: int) -> PaymentTable:
-        """Get payment table, raise KeyError if none"""
-        for table in self.payment_tables:
-            if table.is_applicable(month, year):
-                return table
-        raise NoPaymentTable(f"No payment table for {year}/{month}")
+        """Get payment table, raise NoPaymentTable if none"""
+        table = self.table_index.find(year, month)
+        if table is None:
+            raise NoPaymentTable(f"No payment table for {year}/{month}")
+        return table
+
+    def month_range(self, year: int, month: int) -> Tuple[int, int, int]:
+        """Return the ordinals of the first and last days of a month and
+        its workdays"""
+        first, last = self.calendar.month_bounds(year, month)
+        return first, last, sum(self.calendar.month_weeks(year, month))
+
+    def contract_workdays(self, year: int, month: int, starts: int, ends: int) -> int:
+        """Workdays a contract works in a month, given the ordinals of its
+        first and last days. Only contracts starting or ending inside the
+        month need a range query"""
+        first, last, workdays = self.month_range(year, month)
+        if not self.prorate or (starts <= first and ends >= last):
+            return workdays
+        return self.calendar.month_workdays(year, month, starts, ends)
+
+    def process_pairs(
+        self,
+        pairs: Iterable[Tuple[AbstractContract, int, int]],
+        process_date: Optional[datetime] = None,
+    ) -> List[Any]:
+        """Process (contract, year, month) pairs, in the given order"""
+        raise NotImplementedError
+
+    def process_batch(
+        self,
+        batch: ContractBatch,
+        periods: List[Tuple[int, int]],
+        process_date: Optional[datetime] = None,
+    ) -> List[Any]:
+        """Process every contract of a batch for every period, in contract
+        order"""
+        raise NotImplementedError
+
+    def process_many(
+        self,
+        contracts: Iterable[AbstractContract],
+        periods: Iterable[Tuple[int, int]],
+        process_date: Optional[datetime] = None,
+    ) -> List[AbstractPayment]:
+        """Process every contract for every (year, month) period in one pass.
+
+        Every period is checked for a payment table before any contract is
+        processed. Results are the same as calling process for every pair, in
+        contract order. A ContractBatch is processed from its columns, without
+        building Contract objects"""
+        periods = list(periods)
+        for year, month in periods:
+            self.define_payment_table(year, month)
+        if isinstance(contracts, ContractBatch):
+            return self.process_batch(contracts, periods, process_date)
+        return self.process_pairs(
+            (
+                (contract, year, month)
+                for contract in contracts
+                for year, month in periods
+            ),
+            process_date,
+        )
+
+
+class PerHourProcessor(TableProcessor):
+    """A processor that generates PerHourPayments"""
+
+    payment_type: ClassVar[Type[AbstractPayment]] = PerHourPayment
+
+    @staticmethod
+    def compute_value(
+        hour_value: HourRate, total_hours: int, workdays: Sequence[int]
+    ) -> Money:
+        """Sum the value of every week, given the workdays of each one.
+
+        Every week is worth hour_value * total_hours / 5 * workdays. The sum
+        is computed in thousandths of real and rounded half up to centavos
+        once, so the result doesn't depend on how weeks are split"""
+        thousandths = hour_value.units * total_hours * sum(workdays)
+        # / 5 per workday, / 10 from thousandths to centavos
+        return Money(round_half_up(thousandths, 50))
 
-    def process(self, contract: AbstractContract, year: int, month: int) -> Decimal:
+    def month_rate(self, ptable: PaymentTable, year: int, month: int) -> MonthRate:
+        """Return the values of a payment table in a month by (total hours,
+        workdays) load. Its source is the hour value, in thousandths, the
+        only thing compute_value needs besides the load. Rates of saved
+        tables are kept in rate_cache between calls"""
+        if ptable.id is None:
+            return MonthRate(ptable.hour_value.units, {})
+        return rate_cache.rate(
+            ptable.id, year, month, "per_hour", ptable.hour_value.units
+        )
+
+    @staticmethod
+    def rate_value(rate: MonthRate, total_hours: int, workdays: int) -> Money:
+        """Return the value of a load in a month, computing it once. Same
+        as compute_value, since only the sum of weekly workdays matters"""
+        value = rate.values.get((total_hours, workdays))
+        if value is None:
+            value = rate.values[(total_hours, workdays)] = Money(
+                round_half_up(rate.source * total_hours * workdays, 50)
+            )
+        return value
+
+    def process(self, contract: AbstractContract, year: int, month: int) -> Money:
         """Method that process information from a given contract"""
         ptable = self.define_payment_table(year, month)
-        month_obj = Month(year, month)
-        value = Decimal(0)
-        for week in month_obj.weeks:
-            value += (
-                (ptable.hour_value * Decimal(contract.total_hours)) / 5 * week.workdays
+        workdays = self.contract_workdays(
+            year, month, contract.starts.toordinal(), contract.ends.toordinal()
+        )
+        return self.rate_value(
+            self.month_rate(ptable, year, month), contract.total_hours, workdays
+        )
+
+    def process_pairs(
+        self,
+        pairs: Iterable[Tuple[AbstractContract, int, int]],
+        process_date: Optional[datetime] = None,
+    ) -> List[PerHourPayment]:
+        """Process (contract, year, month) pairs, in the given order.
+
+        Payment table and month rate depend only on the period, so they are
+        resolved once per period. Inside a period only total hours and
+        workdays change between contracts, so each distinct load is
+        computed once and shared, also with later calls (see month_rate)"""
+        if not process_date:
+            process_date = datetime.now()
+
+        # Payment table id and month rate of every period. Tables given to
+        # processors come from the database, so they have ids
+        grid: Dict[Tuple[int, int], Tuple[int, MonthRate]] = {}
+        payments = []
+        for contract, year, month in pairs:
+            period = grid.get((year, month))
+            if period is None:
+                ptable = self.define_payment_table(year, month)
+                period = grid[(year, month)] = (
+                    cast(int, ptable.id),
+                    self.month_rate(ptable, year, month),
+                )
+            ptable_id, rate = period
+            load = (
+                contract.total_hours,
+                self.contract_workdays(
+                    year, month, contract.starts.toordinal(), contract.ends.toordinal()
+                ),
+            )
+            value = rate.values.get(load)
+            if value is None:
+                value = self.rate_value(rate, *load)
+            payments.append(
+                PerHourPayment(
+                    contract_id=cast(int, contract.id),
+                    paymenttable_id=ptable_id,
+                    process_date=process_date,
+                    ref_month=month,
+                    ref_year=year,
+                    value=value,
+                )
             )
 
-        return value
+        return payments
+
+    def process_batch(
+        self,
+        batch: ContractBatch,
+        periods: List[Tuple[int, int]],
+        process_date: Optional[datetime] = None,
+    ) -> List[PerHourPayment]:
+        """Process every contract of a batch for every period, in contract
+        order, reading ids, total hours and dates straight from its arrays"""
+        if not process_date:
+            process_date = datetime.now()
+
+        grid = []
+        for year, month in periods:
+            ptable = self.define_payment_table(year, month)
+            rate = self.month_rate(ptable, year, month)
+            index = self.calendar.year(year)
+            grid.append(
+                (
+                    year,
+                    month,
+                    cast(int, ptable.id),
+                    rate,
+                    *self.month_range(year, month),
+                    index.cumulative,
+                    index.first_ordinal,
+                )
+            )
+        prorate = self.prorate
+        payments = []
+        for contract_id, total_hours, starts, ends in zip(
+            batch.ids, batch.total_hours, batch.starts, batch.ends
+        ):
+            for (
+                year,
+                month,
+                ptable_id,
+                rate,
+                first,
+                last,
+                workdays,
+                cumulative,
+                base,
+            ) in grid:
+                if prorate and (starts > first or ends < last):
+                    # Same range query as CalendarIndex.month_workdays, inlined
+                    low = (starts if starts > first else first) - base
+                    high = (ends if ends < last else last) - base
+                    days = cumulative[high + 1] - cumulative[low] if high >= low else 0
+                    load = (total_hours, days)
+                else:
+                    load = (total_hours, workdays)
+                value = rate.values.get(load)
+                if value is None:
+                    value = self.rate_value(rate, *load)
+                payments.append(
+                    PerHourPayment(
+                        contract_id=contract_id,
+                        paymenttable_id=ptable_id,
+                        process_date=process_date,
+                        ref_month=month,
+                        ref_year=year,
+                        value=value,
+                    )
+                )
+
+        return payments
+
+
+class FormulaProcessor(TableProcessor):
+    """A processor that generates FormulaPayments.
+
+    The value of a contract is the formula of the month payment table, or
+    default_formula for tables without one. Formulas are compiled once (see
+    calc_seduc.formula) and every period is evaluated as one batch"""
 
+    payment_type: ClassVar[Type[AbstractPayment]] = FormulaPayment
 
-class FormulaProcessor:
-    """A processor that generates Formula Payments"""
+    def __init__(
+        self,
+        payment_tables: List[PaymentTable],
+        conn=None,
+        calendar: Optional[CalendarIndex] = None,
+        default_formula: str = DEFAULT_FORMULA,
+        prorate: bool = True,
+    ):
+        super().__init__(payment_tables, conn, calendar, prorate)
+        self.default_formula = default_formula
+        # Fail on invalid formulas before any contract is processed
+        for table in payment_tables:
+            compile_formula(table.formula or default_formula)
 
-    # TODO: create FormulaProcessor logic
+    def period_variables(self, ptable: PaymentTable, year: int, month: int) -> dict:
+        """Return the formula period variables of a given year/month"""
+        weeks = self.calendar.month_weeks(year, month)
+        return {
+            "hour_value": Fraction(ptable.hour_value.units, 10**HourRate.PLACES),
+            "prv": Fraction(ptable.prv.units, 10**Money.PLACES),
+            "eoy_bonus": Fraction(ptable.eoy_bonus.units, 10**Money.PLACES),
+            "month_workdays": sum(weeks),
+            "weeks": len(weeks),
+            "year": year,
+            "month": month,
+            "december": int(month == 12),
+        }
+
+    def period_values(
+        self,
+        ptable: PaymentTable,
+        year: int,
+        month: int,
+        loads: Iterable[Tuple[int, int, int]],
+    ) -> Dict[Tuple[int, int, int], Money]:
+        """Return the values of a period by (hours, total_hours, workdays)
+        load.
+
+        Loads not computed yet are evaluated in a single call of the compiled
+        formula. Values of saved tables are kept in rate_cache between calls,
+        by formula and period variables"""
+        formula = compile_formula(ptable.formula or self.default_formula)
+        variables = self.period_variables(ptable, year, month)
+        source = tuple(variables.items())
+        if ptable.id is None:
+            rate = MonthRate(source, {})
+        else:
+            rate = rate_cache.rate(ptable.id, year, month, formula.digest, source)
+        values = rate.values
+        missing = [load for load in dict.fromkeys(loads) if load not in values]
+        if missing:
+            values.update(
+                zip(
+                    missing,
+                    formula.evaluate(
+                        variables,
+                        [hours for hours, _, _ in missing],
+                        [total_hours for _, total_hours, _ in missing],
+                        [workdays for _, _, workdays in missing],
+                    ),
+                )
+            )
+        return values
+
+    def process(self, contract: AbstractContract, year: int, month: int) -> Money:
+        """Method that process information from a given contract"""
+        return self.process_pairs([(contract, year, month)])[0].value
+
+    def process_pairs(
+        self,
+        pairs: Iterable[Tuple[AbstractContract, int, int]],
+        process_date: Optional[datetime] = None,
+    ) -> List[FormulaPayment]:
+        """Process (contract, year, month) pairs, in the given order.
+
+        Pairs are grouped by period and the distinct (hours, total_hours,
+        workdays) loads of a period are evaluated together (see
+        period_values)"""
+        if not process_date:
+            process_date = datetime.now()
+
+        loaded = [
+            (
+                contract,
+                year,
+                month,
+                (
+                    contract.hours,
+                    contract.total_hours,
+                    self.contract_workdays(
+                        year,
+                        month,
+                        contract.starts.toordinal(),
+                        contract.ends.toordinal(),
+                    ),
+                ),
+            )
+            for contract, year, month in pairs
+        ]
+        loads: Dict[Tuple[int, int], Dict[Tuple[int, int, int], None]] = {}
+        for _, year, month, load in loaded:
+            loads.setdefault((year, month), {})[load] = None
+
+        tables: Dict[Tuple[int, int], PaymentTable] = {}
+        values: Dict[Tuple[int, int], Dict[Tuple[int, int, int], Money]] = {}
+        for (year, month), period in loads.items():
+            ptable = tables[(year, month)] = self.define_payment_table(year, month)
+            values[(year, month)] = self.period_values(ptable, year, month, period)
+
+        return [
+            FormulaPayment(
+                contract_id=cast(int, contract.id),
+                paymenttable_id=cast(int, tables[(year, month)].id),
+                process_date=process_date,
+                ref_month=month,
+                ref_year=year,
+                value=values[(year, month)][load],
+            )
+            for contract, year, month, load in loaded
+        ]
+
+    def process_batch(
+        self,
+        batch: ContractBatch,
+        periods: List[Tuple[int, int]],
+        process_date: Optional[datetime] = None,
+    ) -> List[FormulaPayment]:
+        """Process every contract of a batch for every period, in contract
+        order. The distinct loads of the batch columns are evaluated once
+        per period"""
+        if not process_date:
+            process_date = datetime.now()
+
+        contract_workdays = self.contract_workdays
+        grid = []
+        for year, month in periods:
+            ptable = self.define_payment_table(year, month)
+            loads = [
+                (hours, total_hours, contract_workdays(year, month, starts, ends))
+                for hours, total_hours, starts, ends in zip(
+                    batch.hours, batch.total_hours, batch.starts, batch.ends
+                )
+            ]
+            values = self.period_values(ptable, year, month, loads)
+            ptable_id = cast(int, ptable.id)
+            grid.append((year, month, ptable_id, [values[load] for load in loads]))
+
+        return [
+            FormulaPayment(
+                contract_id=contract_id,
+                paymenttable_id=ptable_id,
+                process_date=process_date,
+                ref_month=month,
+                ref_year=year,
+                value=values[i],
+            )
+            for i, contract_id in enumerate(batch.ids)
+            for year, month, ptable_id, values in grid
+        ]
@@ -0,0 +1,133 @@
+"""Module that reconciles what SEDUC paid against computed payments"""
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+from calc_seduc.connection import get_connection
+from calc_seduc.money import Money
+
+
+# Earnings and payments summed by reference period in a single statement,
+# every table scanned once. An earning refers to the month before its date
+# (see Earning.ref_month and Earning.ref_year)
+RECONCILE_SQL = """
+    select ref_year, ref_month,
+           sum(earned), sum(paid), sum(earnings), sum(payments)
+    from (
+        select cast(strftime('%Y', ref) as integer) as ref_year,
+               cast(strftime('%m', ref) as integer) as ref_month,
+               value as earned, 0 as paid, 1 as earnings, 0 as payments
+        from (
+            select date("date", 'start of month', '-1 month') as ref, value
+            from tb_earning
+        )
+        union all
+        select ref_year, ref_month, 0, value, 0, 1
+        from {table}
+    )
+    group by ref_year, ref_month
+    order by ref_year, ref_month
+"""
+
+
+@dataclass(slots=True)
+class PeriodBalance:
+    """Earned and paid amounts of a (ref_year, ref_month) period"""
+
+    ref_year: int
+    ref_month: int
+    earned: Money
+    paid: Money
+    earnings: int = 0
+    payments: int = 0
+
+    @property
+    def difference(self) -> Money:
+        """Return earned minus paid, positive when SEDUC paid more"""
+        return self.earned - self.paid
+
+
+@dataclass(slots=True)
+class Reconciliation:
+    """Every period balance and the periods that need attention.
+
+    missing_earnings are periods with payments but nothing earned,
+    missing_payments periods with earnings but no payment, and
+    overpayments/underpayments periods where SEDUC paid more/less than
+    computed by more than the tolerance"""
+
+    periods: List[PeriodBalance] = field(default_factory=list)
+    missing_earnings: List[Tuple[int, int]] = field(default_factory=list)
+    missing_payments: List[Tuple[int, int]] = field(default_factory=list)
+    overpayments: List[Tuple[int, int]] = field(default_factory=list)
+    underpayments: List[Tuple[int, int]] = field(default_factory=list)
+
+    @property
+    def earned(self) -> Money:
+        """Return the total earned"""
+        return sum((p.earned for p in self.periods), Money())
+
+    @property
+    def paid(self) -> Money:
+        """Return the total of computed payments"""
+        return sum((p.paid for p in self.periods), Money())
+
+    def by_period(self) -> Dict[Tuple[int, int], PeriodBalance]:
+        """Return balances by (ref_year, ref_month)"""
+        return {(p.ref_year, p.ref_month): p for p in self.periods}
+
+    def summary(self) -> Dict[str, object]:
+        """Return totals and flagged period counts, e.g. for run metrics"""
+        return {
+            "periods": len(self.periods),
+            "earned": str(self.earned),
+            "paid": str(self.paid),
+            "missing_earnings": len(self.missing_earnings),
+            "missing_payments": len(self.missing_payments),
+            "overpayments": len(self.overpayments),
+            "underpayments": len(self.underpayments),
+        }
+
+
+def period_balances(conn, table: str) -> Iterator[PeriodBalance]:
+    """Stream the balance of every period with earnings or payments"""
+    cur = conn.cursor()
+    cur.execute(RECONCILE_SQL.format(table=table))
+    for year, month, earned, paid, earnings, payments in cur:
+        yield PeriodBalance(
+            year,
+            month,
+            Money(earned),
+            Money(paid),
+            earnings,
+            payments,
+        )
+
+
+def reconcile(
+    conn=None,
+    payment_table: str = "tb_perhourpayment",
+    tolerance: Optional[Money] = None,
+) -> Reconciliation:
+    """Compare earnings with the payments of payment_table, period by period.
+
+    payment_table is the table of a payment type, e.g. PerHourPayment.table.
+    Differences up to tolerance (none by default) are not flagged"""
+    if payment_table not in ("tb_perhourpayment", "tb_formulapayment"):
+        raise ValueError(f"Not a payment table: {payment_table}")
+    if not conn:
+        conn = get_connection()
+    tolerance = tolerance if tolerance else Money()
+
+    result = Reconciliation()
+    for balance in period_balances(conn, payment_table):
+        result.periods.append(balance)
+        period = (balance.ref_year, balance.ref_month)
+        if not balance.earnings:
+            result.missing_earnings.append(period)
+        elif not balance.payments:
+            result.missing_payments.append(period)
+        elif balance.difference > tolerance:
+            result.overpayments.append(period)
+        elif -balance.difference > tolerance:
+            result.underpayments.append(period)
+    return result
@@ -0,0 +1,433 @@
+"""Database schema of calc_seduc application.
+
+The schema is versioned with PRAGMA user_version: MIGRATIONS[n] brings a
+database from version n to n + 1, and migrate runs the ones a database
+has not seen yet. A migration interrupted before its version was recorded
+is run again: migrate_money rebuilds every table in a transaction and
+finishes copying a table an older run left renamed, the other migrations
+only create or add what is missing.
+
+Controller refuses databases not at SCHEMA_VERSION (see check_schema),
+main migrates the database before running"""
+
+from sqlite3 import Connection
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+# Money is stored as integers: hour values in thousandths of real (HourRate),
+# every other amount in centavos (Money). Decimal places of every column
+MONEY_COLUMNS = {
+    "tb_paymenttable": {"hour_value": 3, "prv": 2, "eoy_bonus": 2},
+    "tb_earning": {"value": 2},
+    "tb_perhourpayment": {"value": 2},
+    "tb_formulapayment": {"value": 2},
+}
+
+TABLES = [
+    """
+    create table if not exists tb_school (
+        id integer primary key autoincrement,
+        name varchar(100) not null,
+        inep integer not null
+    )
+    """,
+    """
+    create table if not exists tb_contract (
+        id integer primary key autoincrement,
+        school_id int not null,
+        contract_id varchar(20) not null,
+        starts timestamp not null,
+        ends timestamp not null,
+        hours int not null,
+        constraint fk_school_id foreign key (school_id) references tb_school(id)
+    )
+    """,
+    """
+    create table if not exists tb_paymenttable (
+        id integer primary key autoincrement,
+        starts timestamp not null,
+        ends timestamp not null,
+        hour_value integer not null,
+        prv integer not null,
+        eoy_bonus integer not null,
+        formula varchar(500)
+    )
+    """,
+    """
+    create table if not exists tb_earning (
+        id integer primary key autoincrement,
+        "date" timestamp not null,
+        value integer not null
+    )
+    """,
+    """
+    create table if not exists tb_perhourpayment (
+        id integer primary key autoincrement,
+        contract_id int not null,
+        paymenttable_id int not null,
+        process_date timestamp not null,
+        ref_month integer not null,
+        ref_year integer not null,
+        value integer not null
+    )
+    """,
+    """
+    create table if not exists tb_formulapayment (
+        id integer primary key autoincrement,
+        contract_id int not null,
+        paymenttable_id int not null,
+        process_date timestamp not null,
+        ref_month integer not null,
+        ref_year integer not null,
+        value integer not null
+    )
+    """,
+]
+
+# Indexes of the pipeline queries, e.g. the unprocessed contracts anti join
+# (tb_contract dates, payment period) and export joins (tb_contract school).
+# The unique ones allow a single payment per contract and month
+INDEXES = [
+    "create index if not exists ix_contract_dates on tb_contract (starts, ends)",
+    "create index if not exists ix_contract_school on tb_contract (school_id)",
+    """
+    create index if not exists ix_paymenttable_dates
+    on tb_paymenttable (starts, ends)
+    """,
+    """
+    create unique index if not exists ux_perhourpayment_period
+    on tb_perhourpayment (contract_id, ref_year, ref_month)
+    """,
+    """
+    create unique index if not exists ux_formulapayment_period
+    on tb_formulapayment (contract_id, ref_year, ref_month)
+    """,
+]
+
+# Natural keys spreadsheets are imported by (see calc_seduc.importer). They
+# are not unique, since older databases may repeat them. Payment tables are
+# imported by (starts, ends), already indexed by ix_paymenttable_dates
+KEY_INDEXES = [
+    "create index if not exists ix_school_inep on tb_school (inep)",
+    "create index if not exists ix_contract_contract_id on tb_contract (contract_id)",
+]
+
+# Every insert or update of a contract or payment table is logged in
+# tb_change with the date range it covers (updates log old and new ranges),
+# and every Controller run in tb_run with its reference period and the last
+# change it had seen
+CHANGE_TRACKING = [
+    """
+    create table if not exists tb_change (
+        id integer primary key autoincrement,
+        table_name varchar(30) not null,
+        row_id integer not null,
+        starts timestamp not null,
+        ends timestamp not null
+    )
+    """,
+    """
+    create table if not exists tb_run (
+        id integer primary key autoincrement,
+        started timestamp not null,
+        finished timestamp,
+        watermark integer not null,
+        rows integer,
+        ref_year integer,
+        ref_month integer
+    )
+    """,
+]
+for _table in ("tb_contract", "tb_paymenttable"):
+    CHANGE_TRACKING += [
+        f"""
+        create trigger if not exists tg_{_table}_insert after insert on {_table}
+        begin
+            insert into tb_change (table_name, row_id, starts, ends)
+            values ('{_table}', new.id, new.starts, new.ends);
+        end
+        """,
+        f"""
+        create trigger if not exists tg_{_table}_update after update on {_table}
+        begin
+            insert into tb_change (table_name, row_id, starts, ends)
+            values ('{_table}', old.id, old.starts, old.ends),
+                   ('{_table}', new.id, new.starts, new.ends);
+        end
+        """,
+    ]
+
+
+def install_change_tracking(conn: Connection) -> None:
+    """Create change log and run log tables and triggers missing in database"""
+    cur = conn.cursor()
+    for statement in CHANGE_TRACKING:
+        cur.execute(statement)
+    conn.commit()
+
+
+def create_tables(conn: Connection) -> None:
+    """Create every table missing in database"""
+    cur = conn.cursor()
+    for table in TABLES:
+        cur.execute(table)
+    conn.commit()
+
+
+def migrate_money(conn: Connection) -> None:
+    """Convert float money columns of an older database to integer units.
+
+    Each table still declaring a float money column is renamed to
+    {table}_float, rebuilt with the current definition and its rows copied,
+    rounding every amount to the column decimal places. Every table is
+    converted in its own transaction, and a {table}_float left by an older
+    interrupted conversion is copied on. Tables already migrated are left
+    untouched"""
+    cur = conn.cursor()
+    definitions = {}
+    for statement in TABLES:
+        for table in MONEY_COLUMNS:
+            if f"exists {table} (" in statement:
+                definitions[table] = statement
+    for table, places in MONEY_COLUMNS.items():
+        source = f"{table}_float"
+        types = table_columns(conn, source)
+        if not types:
+            source = table
+            types = table_columns(conn, table)
+            if not any(types.get(column) == "float" for column in places):
+                continue
+        dependents = [
+            row[0]
+            for row in cur.execute(
+                "select sql from sqlite_master where type in ('index', 'trigger')"
+                " and tbl_name = ? and sql is not null",
+                (source,),
+            )
+        ]
+        columns = ", ".join(f'"{column}"' for column in types)
+        values = ", ".join(
+            f'cast(round("{column}" * {10 ** places[column]}) as integer)'
+            if column in places
+            else f'"{column}"'
+            for column in types
+        )
+        # DDL doesn't open a transaction by itself, so one is opened here
+        conn.commit()
+        cur.execute("begin")
+        try:
+            if source == table:
+                cur.execute(f"alter table {table} rename to {table}_float")
+            cur.execute(definitions[table])
+            # Rows copied before an interruption keep their ids
+            cur.execute(
+                f"insert into {table} ({columns}) select {values}"
+                f" from {table}_float where id not in (select id from {table})"
+            )
+            cur.execute(f"drop table {table}_float")
+            # Indexes and triggers are dropped with the old table
+            for statement in dependents:
+                cur.execute(statement)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def table_columns(conn: Connection, table: str) -> Dict[str, str]:
+    """Return the declared type of every column of a table, by name. Empty
+    if there is no such table"""
+    return {
+        row[1]: row[2].lower() for row in conn.execute(f"pragma table_info({table})")
+    }
+
+
+def add_formula_column(conn: Connection) -> None:
+    """Add the formula column to payment tables of an older database"""
+    columns = {row[1] for row in conn.execute("pragma table_info(tb_paymenttable)")}
+    if "formula" not in columns:
+        with conn:
+            conn.execute("alter table tb_paymenttable add column formula varchar(500)")
+
+
+class DuplicatePayments(Exception):
+    """This error is raised when a unique payment index can't be created
+    because a contract has more than one payment for the same month.
+    duplicates lists (table, contract_id, ref_year, ref_month, ids)"""
+
+    def __init__(self, duplicates: List[Tuple[str, int, int, int, List[int]]]):
+        self.duplicates = duplicates
+        lines = [
+            f"{table} contract {contract_id} {year}/{month}: ids {ids}"
+            for table, contract_id, year, month, ids in duplicates
+        ]
+        super().__init__(
+            f"{len(duplicates)} contract months have more than one payment, "
+            "remove the wrong ones and migrate again:\n" + "\n".join(lines)
+        )
+
+
+def duplicate_payments(
+    conn: Connection, table: str
+) -> List[Tuple[str, int, int, int, List[int]]]:
+    """Return every contract month of a payment table with more than one
+    payment, with the ids of its payments"""
+    rows = conn.execute(
+        f"""
+        select contract_id, ref_year, ref_month, group_concat(id)
+        from {table}
+        group by contract_id, ref_year, ref_month
+        having count(*) > 1
+        order by contract_id, ref_year, ref_month
+        """
+    )
+    return [
+        (table, contract_id, year, month, sorted(int(id) for id in ids.split(",")))
+        for contract_id, year, month, ids in rows
+    ]
+
+
+def create_indexes(conn: Connection) -> None:
+    """Create the indexes of INDEXES missing in database.
+
+    Payments are financial records, so they are never removed here: if a
+    contract has more than one payment for a month, DuplicatePayments is
+    raised listing them and no index is created"""
+    duplicates = []
+    for table in ("tb_perhourpayment", "tb_formulapayment"):
+        duplicates += duplicate_payments(conn, table)
+    if duplicates:
+        raise DuplicatePayments(duplicates)
+    with conn:
+        for index in INDEXES:
+            conn.execute(index)
+
+
+def create_key_indexes(conn: Connection) -> None:
+    """Create the indexes of KEY_INDEXES missing in database"""
+    with conn:
+        for index in KEY_INDEXES:
+            conn.execute(index)
+
+
+def add_run_period(conn: Connection) -> None:
+    """Add the reference period columns to the run log of an older database.
+    Runs logged before have no period, so none of them is resumed from"""
+    columns = {row[1] for row in conn.execute("pragma table_info(tb_run)")}
+    with conn:
+        for column in ("ref_year", "ref_month"):
+            if column not in columns:
+                conn.execute(f"alter table tb_run add column {column} integer")
+
+
+# Version n + 1 of the schema is reached by running MIGRATIONS[n]
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    create_tables,
+    migrate_money,
+    add_formula_column,
+    install_change_tracking,
+    create_indexes,
+    create_key_indexes,
+    add_run_period,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn: Connection) -> int:
+    """Return the schema version a database is at"""
+    return conn.execute("pragma user_version").fetchone()[0]
+
+
+class OutdatedSchema(Exception):
+    """This error is raised when a database is not at SCHEMA_VERSION, so
+    migrate must be run on it first"""
+
+    pass
+
+
+def check_schema(conn: Connection) -> None:
+    """Raise OutdatedSchema unless a database is at SCHEMA_VERSION"""
+    version = schema_version(conn)
+    if version != SCHEMA_VERSION:
+        raise OutdatedSchema(
+            f"Database schema is at version {version}, expected "
+            f"{SCHEMA_VERSION}: run calc_seduc.schema.migrate on it first"
+        )
+
+
+def migrate(conn: Connection, target: Optional[int] = None) -> List[int]:
+    """Run the migrations a database is missing, up to target (the latest
+    version by default), recording the version after each one. Returns the
+    versions reached"""
+    target = SCHEMA_VERSION if target is None else target
+    reached = []
+    for version in range(schema_version(conn), target):
+        MIGRATIONS[version](conn)
+        conn.execute(f"pragma user_version = {version + 1}")
+        conn.commit()
+        reached.append(version + 1)
+    return reached
+
+
+def create_schema(conn: Connection) -> None:
+    """Create every table missing in database and bring older ones up to date"""
+    migrate(conn)
+
+
+def query_plan(conn: Connection, sql: str, params: Sequence = ()) -> List[str]:
+    """Return the details of every step of a query plan"""
+    return [row[3] for row in conn.execute(f"explain query plan {sql}", params)]
+
+
+def full_scans(conn: Connection, sql: str, params: Sequence = ()) -> List[str]:
+    """Return the steps of a query plan reading a whole table without index"""
+    return [
+        step
+        for step in query_plan(conn, sql, params)
+        if step.startswith("SCAN ") and " USING " not in step
+    ]
+
+
+def hot_queries(batch: int = 3) -> Dict[str, str]:
+    """Return the pipeline queries that must not read whole tables, with
+    batch placeholders where they take a list of ids"""
+    # Imported here, models are not needed to create or migrate a database
+    from calc_seduc.models.contract import (
+        BATCH_COLUMNS,
+        ContractFactory,
+        unprocessed_sql,
+    )
+
+    ids = ", ".join("?" * batch)
+    columns = ", ".join(f"c.{column}" for column in ContractFactory.columns)
+    queries = {}
+    # The very queries ContractFactory.get_unprocessed(_batch) run
+    for table in ("tb_perhourpayment", "tb_formulapayment"):
+        queries[f"unprocessed_{table}"] = unprocessed_sql(columns, table)
+        queries[f"unprocessed_batch_{table}"] = unprocessed_sql(
+            BATCH_COLUMNS.format(prefix="c."), table
+        )
+    return {
+        **queries,
+        "contracts_of_schools": f"""
+            select id from tb_contract where school_id in ({ids})
+        """,
+        "payment_tables_of_day": """
+            select id from tb_paymenttable where starts <= ? and ends >= ?
+        """,
+        "existing_payments": f"""
+            select contract_id, ref_year, ref_month from tb_perhourpayment
+            where ref_year between ? and ? and contract_id in ({ids})
+        """,
+        "schools_of_ineps": f"""
+            select inep, id from tb_school where inep in ({ids})
+        """,
+        "contracts_of_keys": f"""
+            select contract_id, id from tb_contract where contract_id in ({ids})
+        """,
+        "replace_payments": f"""
+            delete from tb_perhourpayment
+            where ref_year = ? and ref_month = ? and contract_id in ({ids})
+        """,
+    }
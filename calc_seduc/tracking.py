@@ -0,0 +1,98 @@
+"""Module that tracks changes between Controller runs"""
+
+from datetime import date, datetime
+from typing import Optional, Set, Tuple
+from calc_seduc.connection import get_connection
+
+
+def months_between(starts: date, ends: date) -> Set[Tuple[int, int]]:
+    """Return every (year, month) from starts to ends, both included"""
+    months = set()
+    year, month = starts.year, starts.month
+    while (year, month) <= (ends.year, ends.month):
+        months.add((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+class RunLog:
+    """Run log and change log queries (see schema.CHANGE_TRACKING).
+
+    A run records its reference period and the id of the last change it had
+    seen, its watermark. The next run of a period only needs contracts and
+    periods changed after the watermark of its last finished run"""
+
+    def __init__(self, conn=None):
+        self.conn = conn if conn else get_connection()
+
+    def last_watermark(self, year: int, month: int) -> Optional[int]:
+        """Return the watermark of the last finished run of a given
+        year/month, None if none"""
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            select watermark from tb_run
+            where finished is not null and ref_year = ? and ref_month = ?
+            order by id desc limit 1
+        """,
+            (year, month),
+        )
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    def current_watermark(self) -> int:
+        """Return the id of the last logged change"""
+        cur = self.conn.cursor()
+        cur.execute("select coalesce(max(id), 0) from tb_change")
+        return cur.fetchone()[0]
+
+    def start(self, watermark: int, year: int, month: int) -> int:
+        """Log a new run of a given year/month and return its id"""
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            insert into tb_run (started, watermark, ref_year, ref_month)
+            values (?, ?, ?, ?) returning id
+        """,
+            (datetime.now(), watermark, year, month),
+        )
+        id = cur.fetchone()[0]
+        self.conn.commit()
+        return id
+
+    def finish(self, run_id: int, rows: int) -> None:
+        """Mark a run as finished"""
+        cur = self.conn.cursor()
+        cur.execute(
+            "update tb_run set finished = ?, rows = ? where id = ?",
+            (datetime.now(), rows, run_id),
+        )
+        self.conn.commit()
+
+    def changed_contracts(self, since: int, until: int) -> Set[int]:
+        """Return ids of contracts inserted or updated between two watermarks"""
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            select distinct row_id from tb_change
+            where table_name = 'tb_contract' and id > ? and id <= ?
+        """,
+            (since, until),
+        )
+        return {row[0] for row in cur}
+
+    def changed_periods(self, since: int, until: int) -> Set[Tuple[int, int]]:
+        """Return (year, month) periods covered by payment tables inserted or
+        updated between two watermarks"""
+        cur = self.conn.cursor()
+        cur.execute(
+            """
+            select starts, ends from tb_change
+            where table_name = 'tb_paymenttable' and id > ? and id <= ?
+        """,
+            (since, until),
+        )
+        periods: Set[Tuple[int, int]] = set()
+        for starts, ends in cur:
+            periods |= months_between(starts, ends)
+        return periods
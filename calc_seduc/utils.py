@@ -1,12 +1,136 @@
 from sqlite3 import Connection
-from functools import lru_cache
-from typing import List
+from itertools import islice
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+from calc_seduc.cache import identity_map
 
 
-@lru_cache
-def get_processed_contracts_ids(conn: Connection) -> List[int]:
-    """Function that gets all processed contracts ids"""
+# Default number of rows sent to sqlite in every executemany call
+BATCH_SIZE = 1000
+
+
+# Suffixes accepted by build_where and the SQL operator each one maps to
+OPERATORS = {
+    "": "=",
+    "gt": ">",
+    "gte": ">=",
+    "lt": "<",
+    "lte": "<=",
+    "in": "in",
+}
+
+
+class InvalidFilter(Exception):
+    """This error is raised when a filter references a column or an operator
+    that the queried table does not know about"""
+
+    pass
+
+
+def build_where(
+    filters: Dict[str, Any], columns: Iterable[str]
+) -> Tuple[str, List[Any]]:
+    """Build a sql where clause and its parameters from keyword filters.
+
+    Filters follow the `column__operator=value` form, where operator is one
+    of OPERATORS (`school_id=1`, `id__in=[1, 2]`, `starts__gte=date`). Columns
+    are checked against the given ones, so user input never reaches the sql
+    text itself."""
+    clauses = []
+    params: List[Any] = []
+    for key, value in filters.items():
+        column, _, op = key.partition("__")
+        if column not in columns or op not in OPERATORS:
+            raise InvalidFilter(f"Invalid filter: {key}")
+        if op == "in":
+            values = list(value)
+            if not values:
+                # Nothing can match an empty list
+                clauses.append("0")
+                continue
+            marks = ", ".join("?" * len(values))
+            clauses.append(f"{column} in ({marks})")
+            params.extend(values)
+        else:
+            clauses.append(f"{column} {OPERATORS[op]} ?")
+            params.append(value)
+
+    if not clauses:
+        return "", params
+    return " where " + " and ".join(clauses), params
+
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Split an iterable in lists of at most size items"""
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def save_many(
+    conn: Connection,
+    table: str,
+    columns: Sequence[str],
+    objects: Iterable[Any],
+    row: Callable[[Any], tuple],
+    batch_size: int = BATCH_SIZE,
+) -> None:
+    """Insert or update objects with executemany inside a single transaction.
+
+    Objects without id are inserted, the others are updated. Generated ids
+    are read from last_insert_rowid, since rows inserted by one executemany
+    in a transaction get consecutive ids, and are only assigned back to the
+    objects after the transaction commits"""
+    marks = ", ".join("?" * len(columns))
+    insert = f"insert into {table} ({', '.join(columns)}) values ({marks})"
+    sets = ", ".join(f"{c} = ?" for c in columns)
+    update = f"update {table} set {sets} where id = ?"
+
+    new_ids: List[Tuple[Any, int]] = []
+    updated: List[int] = []
+    cur = conn.cursor()
+    with conn:
+        for batch in chunked(objects, batch_size):
+            new = [obj for obj in batch if not obj.id]
+            old = [obj for obj in batch if obj.id]
+            if new:
+                cur.executemany(insert, [row(obj) for obj in new])
+                last = cur.execute("select last_insert_rowid()").fetchone()[0]
+                new_ids.extend(zip(new, range(last - len(new) + 1, last + 1)))
+            if old:
+                cur.executemany(update, [row(obj) + (obj.id,) for obj in old])
+                updated.extend(obj.id for obj in old)
+
+    for obj, id in new_ids:
+        obj.id = id
+    for id in updated:
+        identity_map.invalidate(conn, table, id)
+
+
+def get_processed_contracts_ids(
+    conn: Connection, year: Optional[int] = None, month: Optional[int] = None
+) -> Set[int]:
+    """Function that gets all processed contracts ids, optionally only the ones
+    processed for a given year/month"""
     cur = conn.cursor()
-    cur.execute("select id from tb_perhourpayment")
-    result = cur.fetchall()
-    return [r[0] for r in result]
+    if year is None or month is None:
+        cur.execute("select distinct contract_id from tb_perhourpayment")
+    else:
+        cur.execute(
+            """
+            select distinct contract_id from tb_perhourpayment
+            where ref_year = ? and ref_month = ?
+        """,
+            (year, month),
+        )
+    return {r[0] for r in cur}
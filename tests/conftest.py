@@ -1,18 +1,18 @@
 """Fixtures for testing calc_seduc"""
 
-import sqlite3
 from pytest import fixture
+from calc_seduc.cache import identity_map
+from calc_seduc.connection import connect
 from calc_seduc.models import ContractFactory, PaymentTableFactory
 from calc_seduc.processors import PerHourProcessor
+from calc_seduc.schema import create_schema
 from calc_seduc.controller import Controller
 
 
 @fixture(scope="module")
 def database():
     """Fixture that define database tables"""
-    conn = sqlite3.connect(
-        ":memory:", detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
-    )
+    conn = connect(":memory:")
     cur = conn.cursor()
     cur.execute(
         """
@@ -164,9 +164,14 @@ def database():
         (1, 3, '2022-04-01 00:00:00.00001', 3, 2022, 3500.00);
     """
     )
+    # Data above is written as older databases stored it, in float columns
+    create_schema(conn)
 
     yield conn
 
+    identity_map.forget(conn)
+    conn.close()
+
 
 @fixture(scope="module")
 def main_controller():
@@ -0,0 +1,122 @@
+"""Module for testing async_controller.py"""
+
+from datetime import datetime
+from pytest import fixture, raises
+from calc_seduc.async_controller import AsyncController
+from calc_seduc.connection import connect
+from calc_seduc.controller import Controller
+from calc_seduc.models import (
+    Contract,
+    ContractFactory,
+    PaymentTable,
+    PaymentTableFactory,
+    School,
+)
+from calc_seduc.processors import NoPaymentTable, PerHourProcessor
+from calc_seduc.schema import create_schema
+
+
+def make_database():
+    conn = connect(":memory:", check_same_thread=False)
+    create_schema(conn)
+    School(name="EEFM TEST", inep=1).save(conn)
+    Contract.save_many(
+        [
+            Contract(1, str(i), datetime(2022, 1, 1), datetime(2022, 12, 31), i % 20)
+            for i in range(50)
+        ],
+        conn=conn,
+    )
+    PaymentTable(datetime(2022, 1, 1), datetime(2022, 12, 31), "19.228", 0, 0).save(
+        conn
+    )
+    return conn
+
+
+@fixture
+def databases():
+    """Fixture with two identical databases, one for each controller"""
+    first, second = make_database(), make_database()
+    yield first, second
+    first.close()
+    second.close()
+
+
+def controller(cls, conn, path, **kwargs):
+    return cls(
+        contract_factory=ContractFactory(),
+        ptable_factory=PaymentTableFactory,
+        processor=PerHourProcessor,
+        conn=conn,
+        export_path=str(path),
+        ref_year=2022,
+        ref_month=6,
+        **kwargs,
+    )
+
+
+def stored(conn):
+    return conn.execute(
+        "select contract_id, paymenttable_id, ref_year, ref_month, value"
+        " from tb_perhourpayment order by id"
+    ).fetchall()
+
+
+def test_async_controller_matches_controller(databases, tmp_path):
+    """Assert if both controllers save and export the same payments"""
+    serial = controller(Controller, databases[0], tmp_path / "serial.csv")
+    serial()
+    concurrent = controller(
+        AsyncController,
+        databases[1],
+        tmp_path / "async.csv",
+        chunk_size=7,
+        batch_size=3,
+        queue_size=1,
+    )
+    concurrent()
+    assert len(concurrent.payments) == 50
+    assert stored(databases[1]) == stored(databases[0])
+    assert (tmp_path / "async.csv").read_bytes() == (
+        tmp_path / "serial.csv"
+    ).read_bytes()
+    stages = [stage.stage for stage in concurrent.instrumentation.stages]
+    assert stages == ["pipeline", "export"]
+    pipeline = concurrent.instrumentation.stages[0]
+    assert {"fetch_seconds", "process_seconds", "save_seconds"} <= set(pipeline.extra)
+
+
+def test_async_controller_with_workers(databases, tmp_path):
+    """Assert if chunks processed on worker processes keep their order"""
+    serial = controller(Controller, databases[0], tmp_path / "serial.csv")
+    serial()
+    concurrent = controller(
+        AsyncController, databases[1], tmp_path / "async.csv", workers=2, chunk_size=9
+    )
+    concurrent()
+    assert stored(databases[1]) == stored(databases[0])
+
+
+def test_async_controller_reconcile_stage(databases, tmp_path):
+    """Assert if both controllers reconcile the same periods when asked to"""
+    serial = controller(
+        Controller, databases[0], tmp_path / "serial.csv", reconcile=True
+    )
+    serial()
+    concurrent = controller(
+        AsyncController, databases[1], tmp_path / "async.csv", reconcile=True
+    )
+    concurrent()
+    stages = [stage.stage for stage in concurrent.instrumentation.stages]
+    assert stages == ["pipeline", "export", "reconcile"]
+    assert concurrent.reconciliation.summary() == serial.reconciliation.summary()
+    assert (2022, 6) in concurrent.reconciliation.missing_earnings
+
+
+def test_async_controller_failure_stops_pipeline(databases, tmp_path):
+    """Assert if an error in a stage stops the others and is raised"""
+    concurrent = controller(AsyncController, databases[1], tmp_path / "async.csv")
+    concurrent.processor = PerHourProcessor([])
+    with raises(NoPaymentTable):
+        concurrent()
+    assert stored(databases[1]) == []
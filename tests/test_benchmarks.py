@@ -0,0 +1,20 @@
+"""Module for testing benchmarks data generator"""
+
+from benchmarks.data import generate
+
+
+def test_generate_is_seeded():
+    """Assert if the same seed always generates the same rows"""
+    first, second = generate(200, seed=7), generate(200, seed=7)
+    query = "select school_id, contract_id, starts, ends, hours from tb_contract"
+    assert first.execute(query).fetchall() == second.execute(query).fetchall()
+
+
+def test_generate_sizes():
+    """Assert if generated tables have the expected number of rows"""
+    conn = generate(300)
+    counts = [
+        conn.execute(f"select count(*) from {table}").fetchone()[0]
+        for table in ("tb_school", "tb_contract", "tb_earning")
+    ]
+    assert counts == [3, 300, 300]
@@ -0,0 +1,99 @@
+"""Module for testing cache.py"""
+
+from datetime import datetime
+from calc_seduc.cache import IdentityMap, RateCache, identity_map, rate_cache
+from calc_seduc.models import Contract, PaymentTable, School, SchoolFactory
+from calc_seduc.money import HourRate, Money
+from calc_seduc.processors import FormulaProcessor, PerHourProcessor
+
+
+def test_identity_map_returns_same_object(database):
+    """Assert if factory get returns the same object while it is cached"""
+    assert SchoolFactory().get(3, database) is SchoolFactory().get(3, database)
+
+
+def test_identity_map_invalidated_by_save(database):
+    """Assert if saving an object drops it from the identity map"""
+    school = SchoolFactory().get(4, database)
+    school.save(database)
+    assert identity_map.get(database, School.table, 4) is None
+
+
+def test_identity_map_invalidated_by_save_many(database):
+    """Assert if saving objects in bulk drops them from the identity map"""
+    school = SchoolFactory().get(5, database)
+    School.save_many([school], conn=database)
+    assert identity_map.get(database, School.table, 5) is None
+
+
+def test_identity_map_get_all_returns_new_lists(database):
+    """Assert if get_all does not share the same list between callers"""
+    factory = SchoolFactory()
+    assert factory.get_all(database) is not factory.get_all(database)
+
+
+def test_identity_map_size_eviction():
+    """Assert if least recently used objects are evicted above max_size"""
+    cache = IdentityMap(max_size=2)
+    cache.put(None, "tb", 1, "a")
+    cache.put(None, "tb", 2, "b")
+    cache.get(None, "tb", 1)
+    cache.put(None, "tb", 3, "c")
+    assert cache.get(None, "tb", 2) is None
+    assert cache.get(None, "tb", 1) == "a"
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.evictions) == (2, 1, 1)
+
+
+def test_identity_map_ttl_eviction():
+    """Assert if objects older than ttl are not returned"""
+    cache = IdentityMap(ttl=0)
+    cache.put(None, "tb", 1, "a")
+    cache.configure(ttl=-1)
+    assert cache.get(None, "tb", 1) is None
+    assert len(cache) == 0
+
+
+def test_identity_map_forget_connection():
+    """Assert if forget drops only objects of the given connection"""
+    cache = IdentityMap()
+    first, second = object(), object()
+    cache.put(first, "tb", 1, "a")
+    cache.put(second, "tb", 1, "b")
+    cache.forget(first)
+    assert cache.get(first, "tb", 1) is None
+    assert cache.get(second, "tb", 1) == "b"
+
+
+def test_rate_cache_replaces_other_source():
+    """Assert if a rate is only reused when computed from the same source"""
+    cache = RateCache()
+    cache.rate(1, 2022, 6, "per_hour", 100).values[4] = "a"
+    assert cache.rate(1, 2022, 6, "per_hour", 100).values == {4: "a"}
+    assert cache.rate(1, 2022, 6, "per_hour", 200).values == {}
+    assert (cache.stats.hits, cache.stats.misses) == (1, 2)
+    cache.invalidate(1)
+    assert len(cache) == 0
+
+
+def test_rate_cache_shared_between_calls(database):
+    """Assert if processing a month again reuses its memoized values, and
+    saving the payment table drops them"""
+    rate_cache.clear()
+    table = PaymentTable(
+        datetime(2031, 1, 1), datetime(2031, 12, 31), HourRate(20000), Money(), Money()
+    )
+    table.save(database)
+    contract = Contract(1, "1", datetime(2031, 1, 1), datetime(2031, 12, 31), 20, 1)
+    for processor in (PerHourProcessor([table]), FormulaProcessor([table])):
+        first = processor.process_many([contract], [(2031, 3)])
+        again = processor.process_many([contract], [(2031, 3)])
+        assert again[0].value == first[0].value
+    assert (rate_cache.stats.hits, rate_cache.stats.misses) == (2, 2)
+
+    table.hour_value = HourRate(30000)
+    table.save(database)
+    assert len(rate_cache) == 0
+    value = PerHourProcessor([table]).process(contract, 2031, 3)
+    assert value == PerHourProcessor.compute_value(
+        HourRate(30000), 27, PerHourProcessor([table]).calendar.month_weeks(2031, 3)
+    )
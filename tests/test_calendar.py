@@ -1,5 +1,12 @@
-from datetime import datetime
-from calc_seduc.calendar import Week, Month
+from datetime import date, datetime
+from calc_seduc.calendar import (
+    Week,
+    Month,
+    CalendarIndex,
+    ceara_holidays,
+    easter,
+    national_holidays,
+)
 
 
 def test_month_generate_weeks_2022_07_len_weeks():
@@ -42,3 +49,46 @@ def test_month_generate_weeks_2022_02_last_week_workdays():
     """Assert with given method is creating weeks correctly"""
     m = Month(year=2022, month=2)
     assert m.weeks[4].workdays == 1
+
+
+def test_calendar_index_month_weeks_matches_month():
+    """Assert if CalendarIndex weeks match Month weeks without holidays"""
+    index = CalendarIndex()
+    for year in (2020, 2021, 2022):
+        for month in range(1, 13):
+            weeks = tuple(week.workdays for week in Month(year, month).weeks)
+            assert index.month_weeks(year, month) == weeks
+
+
+def test_calendar_index_month_weeks_with_holidays():
+    """Assert if holidays are removed from weeks workdays"""
+    index = CalendarIndex(holidays=(national_holidays, ceara_holidays))
+    # 2022-03-25 (friday) is a Ceará holiday
+    assert index.month_weeks(2022, 3) == (4, 5, 5, 4, 4)
+
+
+def test_calendar_index_workdays_between_across_years():
+    """Assert if workdays between two dates are counted across years"""
+    index = CalendarIndex()
+    assert index.workdays_between(date(2021, 12, 27), date(2022, 1, 7)) == 10
+
+
+def test_calendar_index_workdays_between_extra_days():
+    """Assert if extra days, like school recess, are not workdays"""
+    index = CalendarIndex(extra=[date(2022, 7, 4), date(2022, 7, 5)])
+    assert index.workdays_between(date(2022, 7, 4), date(2022, 7, 8)) == 3
+    assert index.is_workday(date(2022, 7, 6))
+
+
+def test_calendar_index_month_workdays_inside_range():
+    """Assert if only workdays of a month inside the given days are counted"""
+    index = CalendarIndex()
+    ends = date(2023, 1, 13).toordinal()
+    assert index.month_workdays(2022, 4, date(2022, 4, 5).toordinal(), ends) == 19
+    assert index.month_workdays(2022, 4, date(2022, 3, 1).toordinal(), ends) == 21
+    assert index.month_workdays(2022, 3, date(2022, 4, 5).toordinal(), ends) == 0
+
+
+def test_easter_2022():
+    """Assert if easter is correctly calculated"""
+    assert easter(2022) == date(2022, 4, 17)
@@ -0,0 +1,108 @@
+"""Module for testing connection.py"""
+
+import threading
+from pytest import raises
+from calc_seduc.connection import (
+    ConnectionProvider,
+    apply_profile,
+    connect,
+    settings,
+    use_profile,
+)
+
+
+def test_provider_is_lazy(tmp_path):
+    """Assert if creating a provider does not touch the database file"""
+    ConnectionProvider(str(tmp_path / "db.sqlite"))
+    assert not (tmp_path / "db.sqlite").exists()
+
+
+def test_provider_same_connection_per_thread(tmp_path):
+    """Assert if a thread always gets its own, single connection"""
+    provider = ConnectionProvider(str(tmp_path / "db.sqlite"))
+    other = []
+    thread = threading.Thread(target=lambda: other.append(provider.get()))
+    thread.start()
+    thread.join()
+    assert provider.get() is provider.get()
+    assert other[0] is not provider.get()
+    provider.close()
+
+
+def test_provider_reader_pool_reuses_connections(tmp_path):
+    """Assert if readers are returned to the pool and reused"""
+    provider = ConnectionProvider(str(tmp_path / "db.sqlite"), pool_size=1)
+    with provider.reader() as first:
+        assert first is not provider.get()
+    with provider.reader() as second:
+        assert second is first
+    provider.close()
+
+
+def test_provider_reader_sees_writer_commits(tmp_path):
+    """Assert if pooled readers read what the thread connection wrote"""
+    provider = ConnectionProvider(str(tmp_path / "db.sqlite"))
+    writer = provider.get()
+    writer.execute("create table tb_test (id integer primary key)")
+    writer.execute("insert into tb_test default values")
+    writer.commit()
+    with provider.reader() as reader:
+        assert reader.execute("select count(*) from tb_test").fetchone()[0] == 1
+    provider.close()
+
+
+def test_provider_configure_env(tmp_path, monkeypatch):
+    """Assert if the database path comes from CALC_SEDUC_DB by default"""
+    monkeypatch.setenv("CALC_SEDUC_DB", str(tmp_path / "env.sqlite"))
+    provider = ConnectionProvider()
+    assert provider.database == str(tmp_path / "env.sqlite")
+    provider.configure(":memory:")
+    assert provider.database == ":memory:"
+
+
+def test_connect_applies_default_profile(tmp_path):
+    """Assert if new connections use write ahead logging and safe settings"""
+    conn = connect(str(tmp_path / "db.sqlite"))
+    applied = settings(conn)
+    assert applied["journal_mode"] == "wal"
+    assert applied["synchronous"] == "normal"
+    assert applied["temp_store"] == "memory"
+    assert applied["busy_timeout"] == 5000
+    conn.close()
+
+
+def test_use_profile_restores_settings(tmp_path):
+    """Assert if the bulk load profile is only used inside the with block"""
+    conn = connect(str(tmp_path / "db.sqlite"))
+    before = settings(conn)
+    with use_profile(conn, "bulk_load") as applied:
+        assert applied["profile"] == "bulk_load"
+        assert settings(conn)["synchronous"] == "normal"
+        assert settings(conn)["cache_size"] == -512_000
+    assert settings(conn) == before
+    conn.close()
+
+
+def test_unknown_profile(tmp_path):
+    """Assert if unknown profile names are refused"""
+    conn = connect(str(tmp_path / "db.sqlite"), profile=None)
+    with raises(KeyError):
+        apply_profile(conn, "fastest")
+    conn.close()
+
+
+def test_writer_commits_while_reader_reads(tmp_path):
+    """Assert if a batch can be saved while an export is reading"""
+    provider = ConnectionProvider(str(tmp_path / "db.sqlite"))
+    writer = provider.get()
+    writer.execute("create table tb_test (id integer primary key)")
+    writer.executemany("insert into tb_test values (?)", ((i,) for i in range(10)))
+    writer.commit()
+    with provider.reader() as reader:
+        rows = reader.execute("select id from tb_test")
+        rows.fetchone()
+        writer.execute("insert into tb_test values (10)")
+        writer.commit()
+        # The reader keeps its snapshot until it finishes
+        assert len(rows.fetchall()) == 9
+    provider.close()
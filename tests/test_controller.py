@@ -1,8 +1,19 @@
 """Module for testing controller.py methods"""
 
-
-from calc_seduc.models import Contract
+from datetime import date, datetime
+from decimal import Decimal
+from pytest import raises
+from calc_seduc.connection import connect
+from calc_seduc.models import (
+    Contract,
+    ContractFactory,
+    PaymentTable,
+    PaymentTableFactory,
+    School,
+)
 from calc_seduc.controller import Controller
+from calc_seduc.processors import FormulaProcessor
+from calc_seduc.schema import OutdatedSchema, create_schema, migrate
 
 
 def test_controller_instantiation(main_controller):
@@ -46,3 +57,51 @@ def test_controller_get_non_processed_contracts_list_models(main_controller, dat
         if not isinstance(contract, Contract):
             check = False
     assert check
+
+
+def test_controller_formula_processor_runs_twice(tmp_path):
+    """Assert if payments of another type are looked up in their own table,
+    so a second run and a backfill save nothing twice"""
+    conn = connect(":memory:")
+    create_schema(conn)
+    School(name="EEFM TEST", inep=1).save(conn)
+    starts, ends = datetime(2022, 1, 1), datetime(2022, 12, 31)
+    for hours in (4, 10):
+        Contract(1, "1", starts, ends, hours).save(conn)
+    PaymentTable(starts, ends, Decimal(10), Decimal(0), Decimal(0)).save(conn)
+
+    def run():
+        controller = Controller(
+            contract_factory=ContractFactory(),
+            ptable_factory=PaymentTableFactory,
+            processor=FormulaProcessor,
+            conn=conn,
+            export_path=str(tmp_path / "payments.csv"),
+            reconcile=True,
+        )
+        controller()
+        return controller
+
+    assert len(run().payments) == 2
+    controller = run()
+    assert controller.payments == []
+    assert controller.reconciliation.missing_earnings == [(2022, 2)]
+    assert controller.backfill(date(2022, 1, 1), date(2022, 3, 31)) == 4
+    count = "select count(*) from {}"
+    assert conn.execute(count.format("tb_formulapayment")).fetchone() == (6,)
+    assert conn.execute(count.format("tb_perhourpayment")).fetchone() == (0,)
+    conn.close()
+
+
+def test_controller_refuses_outdated_schema():
+    """Assert if a database not migrated to the latest version is refused"""
+    conn = connect(":memory:")
+    migrate(conn, 1)
+    with raises(OutdatedSchema):
+        Controller(
+            contract_factory=ContractFactory(),
+            ptable_factory=PaymentTableFactory,
+            processor=FormulaProcessor,
+            conn=conn,
+        )
+    conn.close()
@@ -0,0 +1,101 @@
+"""Module for testing export.py"""
+
+import csv
+import gzip
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+from pytest import fixture, raises
+from calc_seduc.connection import connect
+from calc_seduc.export import CsvExporter
+from calc_seduc.models import (
+    Contract,
+    ContractFactory,
+    FormulaPayment,
+    PaymentTable,
+    PaymentTableFactory,
+    PerHourPayment,
+    School,
+)
+from calc_seduc.processors import FormulaProcessor, PerHourProcessor
+from calc_seduc.schema import create_schema
+
+
+@fixture(scope="module")
+def payments(database):
+    """Fixture with saved payments for every contract in 2022/6"""
+    processor = PerHourProcessor(PaymentTableFactory().get_all(database), database)
+    payments = processor.process_many(ContractFactory().get_all(database), [(2022, 6)])
+    PerHourPayment.save_many(payments, conn=database)
+    yield payments
+
+
+def test_export_memory_and_stored_are_identical(database, payments, tmp_path):
+    """Assert if exporting in memory payments or stored ones gives same bytes"""
+    exporter = CsvExporter(database, periods=[(2022, 6)], chunk_size=4)
+    exporter.export(str(tmp_path / "memory.csv"), payments)
+    exporter.export(str(tmp_path / "stored.csv"))
+    memory = (tmp_path / "memory.csv").read_bytes()
+    assert memory == (tmp_path / "stored.csv").read_bytes()
+
+
+def test_export_gzip_rows_and_stats(database, payments, tmp_path):
+    """Assert if gzip exports have a header plus one row per payment"""
+    exporter = CsvExporter(database, columns=["payment_id", "value"])
+    stats = exporter.export(str(tmp_path / "payments.csv.gz"), payments)
+    with gzip.open(tmp_path / "payments.csv.gz", "rt", newline="") as file:
+        lines = list(csv.reader(file))
+    assert lines[0] == ["payment_id", "value"]
+    assert len(lines) - 1 == stats.rows == len(payments)
+    assert stats.rows_per_second > 0
+
+
+def test_export_periods_filter(database, payments, tmp_path):
+    """Assert if only payments of the given periods are exported"""
+    exporter = CsvExporter(
+        database, columns=["ref_year", "ref_month"], periods=[(2022, 1)]
+    )
+    stats = exporter.export(str(tmp_path / "payments.csv"))
+    assert stats.rows == 1
+
+
+def test_export_stored_formula_payments(database, tmp_path):
+    """Assert if stored payments are read from the given payment table"""
+    processor = FormulaProcessor(PaymentTableFactory().get_all(database))
+    payments = processor.process_many(ContractFactory().get_all(database), [(2022, 7)])
+    FormulaPayment.save_many(payments, conn=database)
+    exporter = CsvExporter(
+        database, periods=[(2022, 7)], payment_table=FormulaPayment.table
+    )
+    exporter.export(str(tmp_path / "memory.csv"), payments)
+    stats = exporter.export(str(tmp_path / "stored.csv"))
+    assert stats.rows == len(payments) > 0
+    memory = (tmp_path / "memory.csv").read_bytes()
+    assert memory == (tmp_path / "stored.csv").read_bytes()
+    with raises(ValueError):
+        CsvExporter(database, payment_table="tb_contract")
+
+
+def test_export_chunk_above_variable_limit(tmp_path):
+    """Assert if chunks with more contracts than sqlite oldest variable
+    limit are exported"""
+    conn = connect(":memory:")
+    create_schema(conn)
+    School(name="EEFM TEST", inep=1).save(conn)
+    starts, ends = datetime(2022, 1, 1), datetime(2022, 12, 31)
+    Contract.save_many(
+        [Contract(1, str(i), starts, ends, 4) for i in range(1200)], conn=conn
+    )
+    PaymentTable(starts, ends, Decimal(10), Decimal(0), Decimal(0)).save(conn)
+    conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    processor = PerHourProcessor(PaymentTableFactory().get_all(conn))
+    payments = processor.process_many(ContractFactory().get_all(conn), [(2022, 6)])
+    stats = CsvExporter(conn).export(str(tmp_path / "payments.csv"), payments)
+    assert stats.rows == 1200
+    conn.close()
+
+
+def test_export_unknown_column(database):
+    """Assert if unknown columns are refused"""
+    with raises(KeyError):
+        CsvExporter(database, columns=["foo"])
@@ -0,0 +1,117 @@
+"""Module for testing formula.py and FormulaProcessor"""
+
+from datetime import datetime
+from pytest import raises
+from calc_seduc.formula import InvalidFormula, compile_formula
+from calc_seduc.models import (
+    ContractFactory,
+    FormulaPayment,
+    PaymentTable,
+    PaymentTableFactory,
+)
+from calc_seduc.models.payment import FormulaPaymentFactory
+from calc_seduc.money import Money
+from calc_seduc.processors import FormulaProcessor, PerHourProcessor
+
+PERIOD = {
+    "hour_value": 10,
+    "prv": 0,
+    "eoy_bonus": 0,
+    "month_workdays": 21,
+    "weeks": 5,
+    "year": 2022,
+    "month": 6,
+    "december": 0,
+}
+
+
+def test_compile_formula_is_cached():
+    """Assert if the same source is compiled only once"""
+    assert compile_formula("hours * 2") is compile_formula("hours * 2")
+
+
+def test_formula_evaluates_batches():
+    """Assert if every contract of a batch is evaluated, in order"""
+    formula = compile_formula("hour_value * hours + max(total_hours, 5) / 2")
+    values = formula.evaluate(PERIOD, [1, 2, 3], [4, 6, 8])
+    assert values == [Money(1250), Money(2300), Money(3400)]
+
+
+def test_formula_is_exact():
+    """Assert if decimal literals and divisions are not rounded"""
+    formula = compile_formula("0.1 + 0.2 + 1 / 3 * 3")
+    assert formula.evaluate(PERIOD, [1], [1]) == [Money(130)]
+
+
+def test_formula_rejects_unsafe_code():
+    """Assert if anything but arithmetic over known names is refused"""
+    for source in (
+        "__import__('os')",
+        "hours.__class__",
+        "hours ** 2",
+        "salary * 2",
+        "[hours]",
+        "hours if month else 0",
+        "hours *",
+    ):
+        with raises(InvalidFormula):
+            compile_formula(source)
+
+
+def test_formula_rejects_non_decimal_literals():
+    """Assert if numbers not written in decimal are refused as invalid"""
+    for source in ("hours * 0x10", "hours * 0b11", "hours * 0o7"):
+        with raises(InvalidFormula):
+            compile_formula(source)
+
+
+def test_formula_processor_default_matches_per_hour(database):
+    """Assert if the default formula pays what PerHourProcessor pays"""
+    contracts = ContractFactory().get_all(database)
+    ptables = PaymentTableFactory().get_all(database)
+    periods = [(2022, 2), (2022, 6), (2021, 3)]
+    expected = PerHourProcessor(ptables).process_many(contracts, periods)
+    payments = FormulaProcessor(ptables).process_many(contracts, periods)
+    assert all(isinstance(payment, FormulaPayment) for payment in payments)
+    assert [p.value for p in payments] == [p.value for p in expected]
+    assert [p.paymenttable_id for p in payments] == [
+        p.paymenttable_id for p in expected
+    ]
+
+
+def test_formula_processor_uses_table_formula(database):
+    """Assert if a payment table formula is used for its months"""
+    ptable = PaymentTable(
+        datetime(2030, 1, 1),
+        datetime(2030, 12, 31),
+        "10.000",
+        "100.00",
+        "500.00",
+        formula="hour_value * hours * workdays + prv + eoy_bonus * december",
+    )
+    contract = ContractFactory().get(2, database)
+    # Contract 2 ended in 2023, so months are paid whole
+    processor = FormulaProcessor([ptable], prorate=False)
+    # 4 hours * 20 workdays in june 2030, 22 in december 2030
+    assert processor.process(contract, 2030, 6) == Money.of("900.00")
+    assert processor.process(contract, 2030, 12) == Money.of("1480.00")
+
+
+def test_formula_processor_rejects_invalid_table_formula():
+    """Assert if invalid formulas fail before processing"""
+    ptable = PaymentTable(datetime(2030, 1, 1), datetime(2030, 12, 31), 1, 0, 0)
+    ptable.formula = "open('x')"
+    with raises(InvalidFormula):
+        FormulaProcessor([ptable])
+
+
+def test_formula_payment_saved(database):
+    """Assert if formula payments are stored and read back"""
+    contracts = ContractFactory().get_all(database)[:3]
+    ptables = PaymentTableFactory().get_all(database)
+    payments = FormulaProcessor(ptables).process_many(contracts, [(2022, 6)])
+    FormulaPayment.save_many(payments, conn=database)
+    stored = FormulaPaymentFactory().get_many(
+        database, id__in=[payment.id for payment in payments]
+    )
+    assert [payment.value for payment in stored] == [p.value for p in payments]
@@ -0,0 +1,268 @@
+"""Module for testing spreadsheet imports"""
+
+import csv
+import sqlite3
+import zipfile
+from datetime import datetime
+from pytest import fixture, raises
+from calc_seduc.connection import connect
+from calc_seduc.importer import (
+    InvalidSpreadsheet,
+    SpreadsheetImporter,
+    parse_date,
+    parse_money,
+)
+from calc_seduc.models import ContractFactory, PaymentTableFactory
+from calc_seduc.money import HourRate, Money
+from calc_seduc.schema import create_schema
+
+
+@fixture
+def conn():
+    """Fixture with an empty database"""
+    conn = connect(":memory:")
+    create_schema(conn)
+    yield conn
+    conn.close()
+
+
+def write_csv(path, rows, delimiter=","):
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        csv.writer(file, delimiter=delimiter).writerows(rows)
+    return str(path)
+
+
+def write_xlsx(path, rows):
+    """Write a minimal workbook, text cells as shared strings"""
+    main = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    rels = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    strings = []
+    lines = []
+    for number, row in enumerate(rows, 1):
+        cells = []
+        for column, value in enumerate(row):
+            reference = f"{chr(ord('A') + column)}{number}"
+            if isinstance(value, str):
+                strings.append(value)
+                cells.append(f'<c r="{reference}" t="s"><v>{len(strings) - 1}</v></c>')
+            else:
+                cells.append(f'<c r="{reference}"><v>{value}</v></c>')
+        lines.append(f'<row r="{number}">{"".join(cells)}</row>')
+    with zipfile.ZipFile(path, "w") as book:
+        book.writestr(
+            "xl/workbook.xml",
+            f'<workbook xmlns="{main}" xmlns:r="{rels}"><sheets>'
+            '<sheet name="Contratos" sheetId="1" r:id="rId1"/></sheets></workbook>',
+        )
+        book.writestr(
+            "xl/_rels/workbook.xml.rels",
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+            'relationships"><Relationship Id="rId1" Target="worksheets/sheet1.xml"'
+            ' Type="worksheet"/></Relationships>',
+        )
+        book.writestr(
+            "xl/sharedStrings.xml",
+            f'<sst xmlns="{main}">'
+            + "".join(f"<si><t>{s}</t></si>" for s in strings)
+            + "</sst>",
+        )
+        book.writestr(
+            "xl/worksheets/sheet1.xml",
+            f'<worksheet xmlns="{main}"><sheetData>{"".join(lines)}</sheetData>'
+            "</worksheet>",
+        )
+    return str(path)
+
+
+def test_parse_date():
+    """Assert if ISO, brazilian and serial dates give the same day"""
+    expected = datetime(2022, 4, 5)
+    assert parse_date("2022-04-05") == expected
+    assert parse_date("05/04/2022") == expected
+    assert parse_date("2022-04-05 00:00:00.000001") == expected
+    assert parse_date("44656") == expected
+
+
+def test_parse_money():
+    """Assert if both decimal separators are accepted"""
+    assert parse_money("R$ 1.234,56", "prv") == Money(123456)
+    assert parse_money("19.228", "hour_value", HourRate) == HourRate(19228)
+
+
+def test_import_schools_upserts_by_inep(conn, tmp_path):
+    """Assert if a school is updated by inep, and unchanged ones left alone"""
+    path = write_csv(
+        tmp_path / "schools.csv",
+        [
+            ["Name", "INEP"],
+            ["EEFM ANÍSIO TEIXEIRA", "23065214"],
+            ["EEFM PAZ", "2306"],
+        ],
+        delimiter=";",
+    )
+    importer = SpreadsheetImporter(conn)
+    stats = importer.import_schools(path)
+    assert (stats.rows, stats.inserted) == (2, 1)
+    assert [(r.line, r.error) for r in stats.rejected] == [(3, "Invalid inep: '2306'")]
+
+    stats = importer.import_schools(path)
+    assert (stats.inserted, stats.updated, stats.unchanged) == (0, 0, 1)
+
+    path = write_csv(
+        tmp_path / "renamed.csv", [["name", "inep"], ["EEFM TEIXEIRA", "23065214"]]
+    )
+    stats = importer.import_schools(path)
+    assert (stats.inserted, stats.updated) == (0, 1)
+    names = conn.execute("select name from tb_school").fetchall()
+    assert names == [("EEFM TEIXEIRA",)]
+
+
+def test_import_contracts(conn, tmp_path):
+    """Assert if contracts are upserted in chunks, creating named schools
+    and rejecting bad rows"""
+    header = ["contract_id", "inep", "school", "starts", "ends", "hours"]
+    path = write_csv(
+        tmp_path / "contracts.csv",
+        [
+            header,
+            [
+                "22200180950012",
+                "23065214",
+                "EEFM ANÍSIO TEIXEIRA",
+                "05/04/2022",
+                "13/01/2023",
+                "4",
+            ],
+            ["22200180950004", "23065214", "", "2022-04-05", "2023-01-13", "6"],
+            ["22200180949995", "23071095", "", "2022-04-05", "2022-09-12", "2"],
+            ["22200180507011", "23065214", "", "2022-04-05", "2022-01-14", "4"],
+            ["22200180506414", "23065214", "", "2022-04-05", "2022-09-12", "x"],
+        ],
+    )
+    importer = SpreadsheetImporter(conn, chunk_size=2)
+    stats = importer.import_contracts(path)
+    assert (stats.rows, stats.inserted) == (5, 2)
+    assert [(r.line, r.error) for r in stats.rejected] == [
+        (4, "Unknown school inep: 23071095"),
+        (5, "ends 2022-01-14 before starts 2022-04-05"),
+        (6, "Invalid hours: 'x'"),
+    ]
+    contracts = ContractFactory().get_all(conn)
+    assert [(c.contract_id, c.hours, c.school_id) for c in contracts] == [
+        ("22200180950012", 4, 1),
+        ("22200180950004", 6, 1),
+    ]
+
+    rejected = tmp_path / "rejected.csv"
+    assert importer.write_rejected(str(rejected)) == 3
+    with open(rejected, encoding="utf-8", newline="") as file:
+        lines = list(csv.reader(file))
+    assert lines[0] == ["line", "error"] + header
+    assert lines[1][:3] == ["4", "Unknown school inep: 23071095", "22200180949995"]
+
+
+def test_import_chunk_above_variable_limit(conn, tmp_path):
+    """Assert if chunks with more keys than sqlite oldest variable limit are
+    imported"""
+    conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    path = write_csv(
+        tmp_path / "schools.csv",
+        [["name", "inep"]] + [["EEFM PAZ", str(23000000 + i)] for i in range(1200)],
+    )
+    importer = SpreadsheetImporter(conn, chunk_size=1200)
+    assert importer.import_schools(path).inserted == 1200
+    assert importer.import_schools(path).unchanged == 1200
+
+
+def test_import_contracts_matches_stored_dates(database, tmp_path):
+    """Assert if stored contracts are found by contract_id and start day, a
+    contract_id with many periods keeping them apart"""
+    path = write_csv(
+        tmp_path / "contracts.csv",
+        [
+            ["contract_id", "inep", "starts", "ends", "hours"],
+            ["22200180506414", "23068973", "2020-03-27", "2020-05-20", "14"],
+            ["22200180506414", "23068973", "2020-02-21", "2020-03-26", "16"],
+        ],
+    )
+    stats = SpreadsheetImporter(database).import_contracts(path)
+    assert (stats.inserted, stats.updated, stats.unchanged) == (0, 1, 1)
+    contracts = ContractFactory().get_many(database, contract_id="22200180506414")
+    assert sorted(c.hours for c in contracts) == [14, 16, 17]
+
+
+def test_import_payment_tables_xlsx(conn, tmp_path):
+    """Assert if payment tables are read from xlsx with serial dates and
+    invalid formulas are rejected"""
+    path = write_xlsx(
+        tmp_path / "tables.xlsx",
+        [
+            ["starts", "ends", "hour_value", "prv", "eoy_bonus", "formula"],
+            [44682, 44865, 19.228, 1.794, 0, "hour_value * total_hours"],
+            [44562, 44681, 19.228, 0, 0, "open('x')"],
+        ],
+    )
+    stats = SpreadsheetImporter(conn).import_payment_tables(path)
+    assert (stats.rows, stats.inserted) == (2, 1)
+    assert stats.rejected[0].line == 3
+    table = PaymentTableFactory().get_all(conn)[0]
+    assert (table.starts, table.ends) == (datetime(2022, 5, 1), datetime(2022, 10, 31))
+    assert (table.hour_value, table.prv) == (HourRate(19228), Money(179))
+    assert table.formula == "hour_value * total_hours"
+
+
+def test_import_payment_table_with_invalid_number(conn, tmp_path):
+    """Assert if a formula with a number that can't be read rejects its row
+    only"""
+    path = write_csv(
+        tmp_path / "tables.csv",
+        [
+            ["starts", "ends", "hour_value", "prv", "eoy_bonus", "formula"],
+            ["2022-01-01", "2022-06-30", "19.228", "0", "0", "hours * 0x10"],
+            ["2022-07-01", "2022-12-31", "19.228", "0", "0", "hours * 16"],
+        ],
+    )
+    stats = SpreadsheetImporter(conn).import_payment_tables(path)
+    assert (stats.rows, stats.inserted) == (2, 1)
+    assert [r.line for r in stats.rejected] == [2]
+
+
+def test_import_overlapping_payment_tables(conn, tmp_path):
+    """Assert if tables sharing a month with a stored table or another row
+    are rejected, while the stored table itself can still be updated"""
+    header = ["starts", "ends", "hour_value", "prv", "eoy_bonus"]
+    path = write_csv(
+        tmp_path / "tables.csv",
+        [header, ["2022-01-01", "2022-06-30", "19.228", "0", "0"]],
+    )
+    importer = SpreadsheetImporter(conn)
+    assert importer.import_payment_tables(path).inserted == 1
+
+    path = write_csv(
+        tmp_path / "changed.csv",
+        [
+            header,
+            ["2022-01-01", "2022-12-31", "19.228", "0", "0"],
+            ["2022-01-01", "2022-06-30", "20", "0", "0"],
+            ["2022-07-01", "2022-12-31", "20", "0", "0"],
+            ["2022-12-01", "2023-06-30", "20", "0", "0"],
+        ],
+    )
+    stats = importer.import_payment_tables(path)
+    assert (stats.inserted, stats.updated) == (1, 1)
+    assert [(r.line, r.error) for r in stats.rejected] == [
+        (2, "Overlaps stored payment table 1"),
+        (5, "Overlaps payment table of line 4"),
+    ]
+    tables = PaymentTableFactory().get_all(conn)
+    assert [(t.starts.month, t.ends.month, t.hour_value) for t in tables] == [
+        (1, 6, HourRate(20000)),
+        (7, 12, HourRate(20000)),
+    ]
+
+
+def test_import_missing_column(conn, tmp_path):
+    """Assert if a spreadsheet without a required column is refused"""
+    path = write_csv(tmp_path / "schools.csv", [["name"], ["EEFM PAZ"]])
+    with raises(InvalidSpreadsheet):
+        SpreadsheetImporter(conn).import_schools(path)
@@ -0,0 +1,22 @@
+"""Module for testing package import side effects"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+
+def test_import_has_no_side_effects(tmp_path):
+    """Assert if importing the package opens no database nor changes the
+    process Decimal context"""
+    code = (
+        "import decimal, calc_seduc.main, calc_seduc.controller, calc_seduc.models;"
+        "calc_seduc.models.PerHourPayment;"
+        "assert decimal.getcontext().prec == 28"
+    )
+    subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tmp_path,
+        env={"PYTHONPATH": str(Path(__file__).parents[1])},
+        check=True,
+    )
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,62 @@
+"""Module for testing instrumentation.py"""
+
+import io
+import json
+from pytest import raises
+from calc_seduc.controller import Controller
+from calc_seduc.instrumentation import Instrumentation
+from calc_seduc.models import ContractFactory, PaymentTableFactory
+from calc_seduc.processors import PerHourProcessor
+
+
+def test_controller_call_emits_stage_metrics(database, tmp_path):
+    """Assert if a Controller run emits one json line per stage plus a summary"""
+    stream = io.StringIO()
+    started = []
+    instrumentation = Instrumentation(
+        on_start=[started.append], emit=stream, profile=True, trace_memory=True
+    )
+    controller = Controller(
+        contract_factory=ContractFactory(),
+        ptable_factory=PaymentTableFactory,
+        processor=PerHourProcessor,
+        conn=database,
+        export_path=str(tmp_path / "payments.csv"),
+        instrumentation=instrumentation,
+        ref_year=2022,
+        ref_month=6,
+    )
+    controller()
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert started == ["fetch", "process", "save", "export"]
+    assert [r["event"] for r in records] == ["stage"] * 4 + ["run"]
+    fetch, process, save, export, run = records
+    assert fetch["rows"] == process["rows"] == save["rows"] == export["rows"] > 0
+    assert fetch["sql_statements"] > 0 and save["sql_statements"] > 0
+    assert "cumulative" in process["profile"] and process["peak_kb"] is not None
+    assert run["wall_seconds"] >= fetch["wall_seconds"]
+    assert run["sqlite"]["synchronous"] == "normal"
+
+
+def test_instrumentation_stage_rows_and_callbacks():
+    """Assert if on_end callbacks receive the stage metrics"""
+    ended = []
+    instrumentation = Instrumentation(on_end=[ended.append])
+    with instrumentation.stage("work") as stage:
+        stage.rows = 3
+    assert ended[0].stage == "work" and ended[0].rows == 3
+    assert instrumentation.summary()["stages"] == {"work": ended[0].wall_seconds}
+
+
+def test_instrumentation_records_failed_stage():
+    """Assert if a stage that raises is recorded and emitted with its error"""
+    stream = io.StringIO()
+    ended = []
+    instrumentation = Instrumentation(on_end=[ended.append], emit=stream)
+    with raises(ValueError):
+        with instrumentation.stage("work") as stage:
+            stage.rows = 2
+            raise ValueError("bad row")
+    assert ended == instrumentation.stages
+    assert ended[0].error == "ValueError('bad row')" and ended[0].rows == 2
+    assert json.loads(stream.getvalue())["error"] == "ValueError('bad row')"
@@ -1,11 +1,14 @@
 """Unit tests for data.py module"""
 
 from datetime import datetime
+from sqlite3 import IntegrityError
 from decimal import Decimal
+from pytest import raises
 from calc_seduc.models import (
     School,
     SchoolFactory,
     Contract,
+    ContractBatch,
     ContractFactory,
     PaymentTable,
     PaymentTableFactory,
@@ -14,6 +17,8 @@ from calc_seduc.models import (
     PerHourPayment,
     PaymentFactory,
 )
+from calc_seduc.money import HourRate, Money
+from calc_seduc.utils import InvalidFilter
 
 
 def test_declarative_datatype_dates(database):
@@ -173,7 +178,7 @@ def test_payment_table_save_new_instance(database):
     cur = database.cursor()
     cur.execute("select * from tb_paymenttable where id = ?", (ptable.id,))
     result = cur.fetchone()
-    assert result[3] == float(ptable.hour_value)
+    assert result[3] == ptable.hour_value.units == 2400
 
 
 def test_payment_table_save_update_instance(database):
@@ -188,7 +193,7 @@ def test_payment_table_save_update_instance(database):
         prv=Decimal(1.2),
         eoy_bonus=Decimal(4.2),
     )
-    ptable.prv = Decimal(9.999)
+    ptable.prv = Money.from_decimal("9.99")
     ptable.save(conn=database)
     new_ptable = PaymentTableFactory().get(ptable.id, conn=database)
     assert new_ptable.prv == ptable.prv
@@ -210,22 +215,22 @@ def test_payment_table_creator_get_all(database):
     assert check
 
 
-def test_payment_table_hour_value_decimal(database):
-    """Assert that PaymentTable hour_value is decimal"""
+def test_payment_table_hour_value_hour_rate(database):
+    """Assert that PaymentTable hour_value is an HourRate"""
     ptable = PaymentTableFactory().get(1, conn=database)
-    assert isinstance(ptable.hour_value, Decimal)
+    assert ptable.hour_value == HourRate.from_decimal("19.228")
 
 
-def test_payment_table_prv_decimal(database):
-    """Assert that PaymentTable prv is decimal"""
+def test_payment_table_prv_money(database):
+    """Assert that PaymentTable prv is Money"""
     ptable = PaymentTableFactory().get(1, conn=database)
-    assert isinstance(ptable.prv, Decimal)
+    assert ptable.prv == Money.from_decimal("1.79")
 
 
-def test_payment_table_prv_eoy_bonus(database):
-    """Assert that PaymentTable eoy_bonus is decimal"""
+def test_payment_table_eoy_bonus_money(database):
+    """Assert that PaymentTable eoy_bonus is Money"""
     ptable = PaymentTableFactory().get(1, conn=database)
-    assert isinstance(ptable.eoy_bonus, Decimal)
+    assert isinstance(ptable.eoy_bonus, Money)
 
 
 def test_payment_table_is_applicable_case_true(database):
@@ -252,7 +257,7 @@ def test_earning_save_new_instance(database):
     cur = database.cursor()
     cur.execute("select * from tb_earning where id = ?", (earning.id,))
     result = cur.fetchone()
-    assert float(earning.value) == result[2]
+    assert result[2] == earning.value.units == 400
 
 
 def test_earning_save_update(database):
@@ -263,7 +268,7 @@ def test_earning_save_update(database):
     earning = Earning(
         date=datetime(2022, 1, 1, 0, 0, 0, 1), value=Decimal("3.999999999999")
     )
-    earning.value = Decimal(3.14)
+    earning.value = Money.from_decimal("3.14")
     earning.save(conn=database)
 
     new_earning = EarningFactory().get(earning.id, conn=database)
@@ -276,10 +281,10 @@ def test_earning_creator_get(database):
     assert isinstance(earning, Earning)
 
 
-def test_earning_value_decimal(database):
-    """Test if earning value is a Decimal"""
+def test_earning_value_money(database):
+    """Test if earning value is Money"""
     earning = EarningFactory().get(1, conn=database)
-    assert isinstance(earning.value, Decimal)
+    assert earning.value == Money.from_decimal("74.04")
 
 
 def test_earning_ref_month_with_month_01(database):
@@ -319,7 +324,7 @@ def test_perhourpayment_save_new_instance(database):
     perhourpayment = PerHourPayment(
         contract_id=1,
         paymenttable_id=1,
-        ref_month=3,
+        ref_month=5,
         ref_year=2022,
         process_date=datetime(2022, 1, 1, 0, 0, 0, 1),
         value=Decimal("1094.99"),
@@ -329,7 +334,7 @@ def test_perhourpayment_save_new_instance(database):
     cur.execute("select * from tb_perhourpayment where id = ?", (perhourpayment.id,))
     result = cur.fetchone()
 
-    assert float(perhourpayment.value) == result[6]
+    assert result[6] == perhourpayment.value.units == 109499
 
 
 def test_perhourpayment_save_update(database):
@@ -338,7 +343,7 @@ def test_perhourpayment_save_update(database):
     instance on database
     """
     perhourpayment = PaymentFactory()("perhour").get(id=1, conn=database)
-    perhourpayment.value = Decimal(3.14)
+    perhourpayment.value = Money.from_decimal("3.14")
     perhourpayment.save(conn=database)
 
     new_payment = PaymentFactory()("perhour").get(id=perhourpayment.id, conn=database)
@@ -360,3 +365,179 @@ def test_perhourpayment_creator_get_all(database):
         if not isinstance(payment, PerHourPayment):
             check = False
     assert check
+
+
+def test_contract_creator_get_many_filter_school_id(database):
+    """Test if ContractCreator get_many filters contracts by school"""
+    contracts = list(ContractFactory().get_many(conn=database, school_id=3))
+    assert contracts and all(c.school_id == 3 for c in contracts)
+
+
+def test_contract_creator_get_many_filter_ids(database):
+    """Test if ContractCreator get_many filters contracts by a list of ids"""
+    contracts = ContractFactory().get_many(conn=database, id__in=[2, 4])
+    assert [c.id for c in contracts] == [2, 4]
+
+
+def test_contract_creator_get_many_filter_dates(database):
+    """Test if ContractCreator get_many filters contracts by a date range"""
+    contracts = list(
+        ContractFactory().get_many(
+            conn=database,
+            starts__gte=datetime(2022, 1, 1),
+            ends__lt=datetime(2023, 1, 1),
+        )
+    )
+    assert contracts and all(
+        c.starts >= datetime(2022, 1, 1) and c.ends < datetime(2023, 1, 1)
+        for c in contracts
+    )
+
+
+def test_contract_creator_get_many_invalid_filter(database):
+    """Test if ContractCreator get_many refuses unknown columns"""
+    with raises(InvalidFilter):
+        list(ContractFactory().get_many(conn=database, foo=1))
+
+
+def test_earning_creator_get_many_matches_get(database):
+    """Test if EarningCreator get_many builds the same objects as get"""
+    earnings = list(EarningFactory().get_many(conn=database, id__in=[1]))
+    assert earnings == [EarningFactory().get(1, conn=database)]
+
+
+def test_payment_table_is_applicable_across_years(database):
+    """Assert if is_applicable works for tables running across two years"""
+    ptable = PaymentTable(
+        starts=datetime(2021, 9, 1),
+        ends=datetime(2022, 2, 28),
+        hour_value=Decimal(1),
+        prv=Decimal(0),
+        eoy_bonus=Decimal(0),
+    )
+    assert ptable.is_applicable(11, 2021) and ptable.is_applicable(1, 2022)
+
+
+def test_perhourpayment_save_many_assigns_ids(database):
+    """Test if PerHourPayment save_many stores new instances and sets their ids"""
+    payments = [
+        PerHourPayment(
+            contract_id=contract_id,
+            paymenttable_id=1,
+            ref_month=4,
+            ref_year=2022,
+            process_date=datetime(2022, 5, 1),
+            value=Decimal("10.5"),
+        )
+        for contract_id in range(1, 6)
+    ]
+    PerHourPayment.save_many(payments, conn=database, batch_size=2)
+    cur = database.cursor()
+    for payment in payments:
+        cur.execute(
+            "select contract_id from tb_perhourpayment where id = ?", (payment.id,)
+        )
+        assert cur.fetchone()[0] == payment.contract_id
+
+
+def test_school_save_many_updates_existing(database):
+    """Test if School save_many updates instances already stored"""
+    schools = [School(name="New school", inep=1), SchoolFactory().get(2, database)]
+    schools[1].name = "Updated school"
+    School.save_many(schools, conn=database)
+    cur = database.cursor()
+    cur.execute("select name from tb_school where id in (?, ?)", (2, schools[0].id))
+    assert sorted(r[0] for r in cur.fetchall()) == ["New school", "Updated school"]
+
+
+def test_save_many_rolls_back_on_error(database):
+    """Test if save_many does not store nor set ids when a row fails"""
+    cur = database.cursor()
+    cur.execute("select count(*) from tb_school")
+    count = cur.fetchone()[0]
+    schools = [School(name="Valid school", inep=1), School(name=None, inep=2)]
+    with raises(IntegrityError):
+        School.save_many(schools, conn=database)
+    cur.execute("select count(*) from tb_school")
+    assert cur.fetchone()[0] == count
+    assert schools[0].id is None
+
+
+def test_contract_creator_get_unprocessed_by_period(database):
+    """Test if ContractCreator get_unprocessed is keyed on year/month"""
+    factory = ContractFactory()
+    PerHourPayment(
+        contract_id=2,
+        paymenttable_id=1,
+        ref_month=6,
+        ref_year=2022,
+        process_date=datetime(2022, 7, 1),
+        value=Decimal(1),
+    ).save(database)
+    assert 2 not in {c.id for c in factory.get_unprocessed(2022, 6, database)}
+    assert 2 in {c.id for c in factory.get_unprocessed(2022, 7, database)}
+
+
+def test_contract_creator_get_unprocessed_only_active(database):
+    """Test if ContractCreator get_unprocessed skips contracts not active in
+    the given year/month"""
+    contracts = ContractFactory().get_unprocessed(2022, 5, database)
+    assert all(
+        c.starts < datetime(2022, 6, 1) and c.ends >= datetime(2022, 5, 1)
+        for c in contracts
+    )
+    assert 14 in {c.id for c in ContractFactory().get_unprocessed(2022, 5, database)}
+
+
+def test_contract_creator_get_unprocessed_sees_new_payments(database):
+    """Test if payments saved just before are taken into account"""
+    factory = ContractFactory()
+    before = [c.id for c in factory.get_unprocessed(2022, 9, database, chunk_size=2)]
+    PerHourPayment(
+        contract_id=before[0],
+        paymenttable_id=1,
+        ref_month=9,
+        ref_year=2022,
+        process_date=datetime(2022, 10, 1),
+        value=Decimal(1),
+    ).save(database)
+    after = [c.id for c in factory.get_unprocessed(2022, 9, database, chunk_size=2)]
+    assert after == before[1:]
+
+
+def test_contract_batch_matches_contracts(database):
+    """Test if a batch loaded from sqlite holds the same contracts"""
+    contracts = ContractFactory().get_all(database)
+    batch = ContractFactory().get_batch(database)
+    assert list(batch.ids) == [c.id for c in contracts]
+    assert list(batch.total_hours) == [c.total_hours for c in contracts]
+    assert list(batch.starts) == [c.starts.toordinal() for c in contracts]
+    assert batch[0].ends.date() == contracts[0].ends.date()
+    assert batch[0].contract_id == contracts[0].contract_id
+
+
+def test_contract_batch_chunks_and_pickle(database):
+    """Test if a batch splits in chunks and survives pickling"""
+    import pickle
+
+    batch = ContractFactory().get_batch(database, school_id=4)
+    chunks = list(batch.chunks(2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    copy = pickle.loads(pickle.dumps(chunks[1]))
+    assert list(copy.ids) == list(batch.ids[2:4])
+    assert list(copy.hours) == list(batch.hours[2:4])
+
+
+def test_contract_batch_unprocessed_matches_get_unprocessed(database):
+    """Test if the unprocessed batch has the contracts get_unprocessed gives"""
+    factory = ContractFactory()
+    batch = factory.get_unprocessed_batch(2022, 6, database)
+    contracts = factory.get_unprocessed(2022, 6, database)
+    assert list(batch.ids) == [c.id for c in contracts]
+
+
+def test_contract_batch_from_contracts(database):
+    """Test if a batch built from Contract objects gives them back"""
+    contracts = ContractFactory().get_all(database)[:3]
+    batch = ContractBatch.from_contracts(contracts)
+    assert [c.hours for c in batch] == [c.hours for c in contracts]
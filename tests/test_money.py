@@ -0,0 +1,98 @@
+"""Module for testing money.py"""
+
+import pickle
+import sqlite3
+from decimal import Decimal
+from pytest import raises
+from calc_seduc.money import HourRate, Money, round_half_up
+from calc_seduc.processors import PerHourProcessor
+from calc_seduc.schema import migrate_money
+
+
+def test_round_half_up():
+    """Assert if halves are rounded away from zero"""
+    assert [round_half_up(n, 10) for n in (14, 15, 25, -15, -14)] == [
+        1,
+        2,
+        3,
+        -2,
+        -1,
+    ]
+
+
+def test_money_from_float_uses_written_value():
+    """Assert if floats are read as the number they were written as"""
+    assert Money.of(0.1 + 0.2).units == 30
+    assert HourRate.of(19.228).units == 19228
+
+
+def test_money_from_decimal_rounds_half_up():
+    """Assert if amounts with more places are rounded half up"""
+    assert Money.from_decimal("2.345").units == 235
+    assert Money.from_decimal(Decimal("-2.345")).units == -235
+
+
+def test_money_units_must_be_int():
+    """Assert if fractional units, e.g. a float column never migrated, are
+    refused instead of truncated"""
+    with raises(TypeError):
+        HourRate(19.228)
+    with raises(TypeError):
+        Money(Decimal("1234.56"))
+    assert Money.of(1234.56).units == 123456
+
+
+def test_money_str():
+    """Assert if money is formatted with its places"""
+    assert str(Money(-5)) == "-0.05"
+    assert str(HourRate(19228)) == "19.228"
+
+
+def test_money_arithmetic_is_exact():
+    """Assert if sums never lose centavos"""
+    total = sum((Money.of("0.10") for _ in range(1000)), Money())
+    assert total == Money(10000)
+    assert Money(3) * 2 - Money(1) == Money(5)
+
+
+def test_money_types_do_not_mix():
+    """Assert if centavos and thousandths are never added or compared"""
+    with raises(TypeError):
+        Money(1) + HourRate(1)
+    with raises(TypeError):
+        Money.of(HourRate(1))
+    assert Money(1) != HourRate(1)
+
+
+def test_money_pickles():
+    """Assert if money survives being sent to worker processes"""
+    assert pickle.loads(pickle.dumps(HourRate(19228))) == HourRate(19228)
+
+
+def test_compute_value_rounds_once():
+    """Assert if a month value is rounded to centavos only once"""
+    value = PerHourProcessor.compute_value(HourRate(19228), 4, [1, 5, 5, 5, 5])
+    # 19.228 * 4 / 5 * 21 = 323.0304
+    assert value == Money(32303)
+
+
+def test_migrate_money_converts_float_columns():
+    """Assert if float money columns become integer units"""
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        """
+        create table tb_earning (
+            id integer primary key autoincrement,
+            "date" timestamp not null,
+            value float not null
+        )
+        """
+    )
+    conn.execute("insert into tb_earning (date, value) values ('2022-01-03', 0.29)")
+    migrate_money(conn)
+    migrate_money(conn)
+    assert conn.execute("select id, value from tb_earning").fetchall() == [(1, 29)]
+    assert conn.execute("select typeof(value) from tb_earning").fetchone() == (
+        "integer",
+    )
+    conn.close()
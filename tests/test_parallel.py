@@ -0,0 +1,57 @@
+"""Module for testing parallel.py"""
+
+from datetime import datetime
+from calc_seduc.models import Contract, ContractFactory, PaymentTableFactory
+from calc_seduc.parallel import process_parallel
+from calc_seduc.processors import PerHourProcessor
+
+
+def test_process_parallel_matches_serial(database):
+    """Assert if parallel payments are the same, in the same order, as serial"""
+    contracts = ContractFactory().get_all(database)
+    processor = PerHourProcessor(PaymentTableFactory().get_all(database), database)
+    periods = [(2022, 2), (2022, 6)]
+    process_date = datetime(2022, 7, 1)
+    payments, failures = process_parallel(
+        processor,
+        contracts,
+        periods,
+        workers=2,
+        chunk_size=3,
+        process_date=process_date,
+    )
+    assert failures == []
+    assert payments == processor.process_many(contracts, periods, process_date)
+
+
+def test_process_parallel_batch(database):
+    """Assert if a ContractBatch is split and processed like Contract objects"""
+    batch = ContractFactory().get_batch(database)
+    processor = PerHourProcessor(PaymentTableFactory().get_all(database), database)
+    periods = [(2022, 6)]
+    process_date = datetime(2022, 7, 1)
+    payments, failures = process_parallel(
+        processor, batch, periods, workers=2, chunk_size=4, process_date=process_date
+    )
+    assert failures == []
+    assert payments == processor.process_many(batch, periods, process_date)
+
+
+def test_process_parallel_reports_failed_chunk(database):
+    """Assert if a failing chunk is reported and the others are processed"""
+    first, second, third = ContractFactory().get_all(database)[:3]
+    broken = Contract(
+        school_id=1,
+        contract_id="broken",
+        starts=datetime(2022, 1, 1),
+        ends=datetime(2022, 2, 1),
+        hours=None,
+        id=99,
+    )
+    processor = PerHourProcessor(PaymentTableFactory().get_all(database), database)
+    payments, failures = process_parallel(
+        processor, [first, second, broken, third], [(2022, 2)], workers=2, chunk_size=2
+    )
+    assert [failure.chunk for failure in failures] == [1]
+    assert failures[0].contract_ids == [99, third.id]
+    assert [payment.contract_id for payment in payments] == [first.id, second.id]
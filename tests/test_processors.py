@@ -1,5 +1,18 @@
-from calc_seduc.processors import PerHourProcessor
-from calc_seduc.models import ContractFactory, PaymentTableFactory
+from datetime import datetime
+from pytest import raises
+from calc_seduc.money import HourRate, Money
+from calc_seduc.processors import (
+    FormulaProcessor,
+    PerHourProcessor,
+    PaymentTableIndex,
+    OverlappingPaymentTables,
+)
+from calc_seduc.models import (
+    ContractFactory,
+    PaymentTable,
+    PaymentTableFactory,
+    PerHourPayment,
+)
 
 
 def test_define_payment_table_case_2022_5(database):
@@ -26,3 +39,110 @@ def test_process(database):
     value = processor.process(contract, 2022, 6)
     breakpoint()
     assert value
+
+
+def test_process_many_matches_process(database):
+    """Assert if process_many values match process for every contract/month"""
+    contracts = ContractFactory().get_all(database)
+    ptables = PaymentTableFactory().get_all(database)
+    processor = PerHourProcessor(ptables, database)
+    periods = [(2022, 2), (2022, 6), (2021, 3)]
+    payments = processor.process_many(contracts, periods)
+    expected = [
+        processor.process(contract, year, month)
+        for contract in contracts
+        for year, month in periods
+    ]
+    assert [payment.value for payment in payments] == expected
+
+
+def test_process_many_returns_payments(database):
+    """Assert if process_many returns unsaved PerHourPayments with references"""
+    contract = ContractFactory().get(2, database)
+    ptables = PaymentTableFactory().get_all(database)
+    processor = PerHourProcessor(ptables, database)
+    (payment,) = processor.process_many([contract], [(2022, 6)])
+    assert isinstance(payment, PerHourPayment)
+    assert (payment.id, payment.contract_id, payment.paymenttable_id) == (None, 2, 1)
+    assert (payment.ref_year, payment.ref_month) == (2022, 6)
+
+
+def test_process_prorates_partial_months(database):
+    """Assert if a contract is only paid the workdays of a month it works"""
+    contract = ContractFactory().get(1, database)
+    ptables = PaymentTableFactory().get_all(database)
+    processor = PerHourProcessor(ptables, database)
+    # Contract 1 ends on 2022-05-13, 10 workdays after may 1st
+    assert processor.process(contract, 2022, 5) == PerHourProcessor.compute_value(
+        HourRate(19228), 7, [10]
+    )
+    assert processor.process(contract, 2022, 6) == Money()
+    whole = PerHourProcessor(ptables, database, prorate=False)
+    assert whole.process(contract, 2022, 5) == PerHourProcessor.compute_value(
+        HourRate(19228), 7, whole.calendar.month_weeks(2022, 5)
+    )
+
+
+def test_process_many_batch_prorates(database):
+    """Assert if a ContractBatch is pro-rated like Contract objects"""
+    ptables = PaymentTableFactory().get_all(database)
+    periods = [(2022, 4), (2022, 5), (2022, 9)]
+    process_date = datetime(2022, 10, 1)
+    for processor in (PerHourProcessor(ptables), FormulaProcessor(ptables)):
+        expected = [
+            processor.process(contract, year, month)
+            for contract in ContractFactory().get_all(database)
+            for year, month in periods
+        ]
+        payments = processor.process_many(
+            ContractFactory().get_batch(database), periods, process_date
+        )
+        assert [payment.value for payment in payments] == expected
+
+
+def test_payment_table_index_gaps():
+    """Assert if months without payment table are reported at build time"""
+    index = PaymentTableIndex(
+        [
+            PaymentTable(datetime(2021, 9, 1), datetime(2022, 2, 28), 1, 0, 0, id=1),
+            PaymentTable(datetime(2022, 5, 1), datetime(2022, 10, 31), 1, 0, 0, id=2),
+        ]
+    )
+    assert index.gaps == [((2022, 3), (2022, 4))]
+    assert index.find(2022, 3) is None
+
+
+def test_payment_table_index_across_years():
+    """Assert if a table running across two years is found"""
+    table = PaymentTable(datetime(2021, 9, 1), datetime(2022, 2, 28), 1, 0, 0, id=1)
+    index = PaymentTableIndex([table])
+    assert index.find(2021, 12) is table
+    assert index.find(2022, 2) is table
+    assert index.find(2022, 3) is None
+
+
+def test_payment_table_index_overlap():
+    """Assert if overlapping payment tables are refused at build time"""
+    with raises(OverlappingPaymentTables):
+        PaymentTableIndex(
+            [
+                PaymentTable(datetime(2022, 1, 1), datetime(2022, 6, 30), 1, 0, 0),
+                PaymentTable(datetime(2022, 6, 1), datetime(2022, 12, 31), 1, 0, 0),
+            ]
+        )
+
+
+def test_process_many_batch_matches_contracts(database):
+    """Assert if a ContractBatch gives the same payments as Contract objects"""
+    factory = ContractFactory()
+    ptables = PaymentTableFactory().get_all(database)
+    periods = [(2022, 2), (2022, 6)]
+    process_date = datetime(2022, 7, 1)
+    for processor in (PerHourProcessor(ptables), FormulaProcessor(ptables)):
+        expected = processor.process_many(
+            factory.get_all(database), periods, process_date
+        )
+        payments = processor.process_many(
+            factory.get_batch(database), periods, process_date
+        )
+        assert payments == expected
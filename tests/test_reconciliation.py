@@ -0,0 +1,105 @@
+"""Module for testing reconciliation.py"""
+
+from collections import defaultdict
+from datetime import datetime
+from pytest import fixture, raises
+from calc_seduc.connection import connect
+from calc_seduc.controller import Controller
+from calc_seduc.models import (
+    ContractFactory,
+    Earning,
+    EarningFactory,
+    PaymentTableFactory,
+    PerHourPayment,
+)
+from calc_seduc.money import Money
+from calc_seduc.processors import PerHourProcessor
+from calc_seduc.reconciliation import reconcile
+from calc_seduc.schema import create_schema
+
+
+@fixture
+def ledger():
+    """Fixture with earnings and payments of four periods"""
+    conn = connect(":memory:")
+    create_schema(conn)
+    # Paid in the month after the reference period
+    Earning.save_many(
+        [
+            Earning(datetime(2022, 1, 5), "100.00"),  # 2021/12
+            Earning(datetime(2022, 1, 20), "50.00"),  # 2021/12
+            Earning(datetime(2022, 2, 5), "80.00"),  # 2022/1
+            Earning(datetime(2022, 3, 5), "90.00"),  # 2022/2
+        ],
+        conn=conn,
+    )
+    PerHourPayment.save_many(
+        [
+            PerHourPayment(1, 1, datetime(2022, 1, 1), 12, 2021, "150.00"),
+            PerHourPayment(1, 1, datetime(2022, 2, 1), 1, 2022, "79.99"),
+            PerHourPayment(2, 1, datetime(2022, 2, 1), 1, 2022, "10.00"),
+            PerHourPayment(1, 1, datetime(2022, 4, 1), 3, 2022, "70.00"),
+        ],
+        conn=conn,
+    )
+    yield conn
+    conn.close()
+
+
+def test_reconcile_groups_by_reference_period(ledger):
+    """Assert if earnings and payments are summed by reference period"""
+    balances = reconcile(ledger).by_period()
+    assert list(balances) == [(2021, 12), (2022, 1), (2022, 2), (2022, 3)]
+    december = balances[(2021, 12)]
+    assert (december.earned, december.paid) == (Money(15000), Money(15000))
+    assert (december.earnings, december.payments) == (2, 1)
+    assert balances[(2022, 1)].difference == Money(-999)
+
+
+def test_reconcile_flags_periods(ledger):
+    """Assert if missing months and differences are reported"""
+    result = reconcile(ledger)
+    assert result.missing_payments == [(2022, 2)]
+    assert result.missing_earnings == [(2022, 3)]
+    assert result.underpayments == [(2022, 1)]
+    assert result.overpayments == []
+    assert (result.earned, result.paid) == (Money(32000), Money(30999))
+
+
+def test_reconcile_tolerance(ledger):
+    """Assert if differences up to the tolerance are not flagged"""
+    assert reconcile(ledger, tolerance=Money(1000)).underpayments == []
+
+
+def test_reconcile_rejects_unknown_table(ledger):
+    """Assert if only payment tables can be reconciled"""
+    with raises(ValueError):
+        reconcile(ledger, payment_table="tb_school")
+
+
+def test_reconcile_matches_earning_ref_period(database):
+    """Assert if sql reference periods are the same Earning computes"""
+    earned = defaultdict(Money)
+    for earning in EarningFactory().get_all(database):
+        earned[(earning.ref_year, earning.ref_month)] += earning.value
+    balances = reconcile(database).by_period()
+    assert {p: balances[p].earned for p in earned} == earned
+
+
+def test_controller_reconcile_stage(database, tmp_path):
+    """Assert if the controller reconciles after exporting when asked to"""
+    controller = Controller(
+        contract_factory=ContractFactory(),
+        ptable_factory=PaymentTableFactory,
+        processor=PerHourProcessor,
+        conn=database,
+        export_path=str(tmp_path / "payments.csv"),
+        ref_year=2022,
+        ref_month=6,
+        reconcile=True,
+    )
+    controller()
+    stage = controller.instrumentation.stages[-1]
+    assert stage.stage == "reconcile"
+    assert (2022, 6) in controller.reconciliation.by_period()
+    assert stage.extra["periods"] == stage.rows > 0
@@ -0,0 +1,144 @@
+"""Module for testing schema.py"""
+
+import sqlite3
+from datetime import datetime
+from pytest import mark, raises
+from calc_seduc.connection import connect
+from calc_seduc.models import PerHourPayment
+from calc_seduc.schema import (
+    MIGRATIONS,
+    SCHEMA_VERSION,
+    DuplicatePayments,
+    create_indexes,
+    full_scans,
+    hot_queries,
+    migrate,
+    query_plan,
+    schema_version,
+)
+
+
+def test_migrate_new_database():
+    """Assert if a new database reaches the latest version once"""
+    conn = connect(":memory:")
+    assert migrate(conn) == list(range(1, SCHEMA_VERSION + 1))
+    assert schema_version(conn) == SCHEMA_VERSION
+    assert migrate(conn) == []
+    conn.close()
+
+
+def test_migrate_legacy_database():
+    """Assert if a database without version keeps its rows, migrated"""
+    conn = connect(":memory:")
+    conn.execute(
+        """
+        create table tb_perhourpayment (
+            id integer primary key autoincrement,
+            contract_id int not null,
+            paymenttable_id int not null,
+            process_date timestamp not null,
+            ref_month integer not null,
+            ref_year integer not null,
+            value float not null
+        )
+        """
+    )
+    conn.executemany(
+        "insert into tb_perhourpayment"
+        " (contract_id, paymenttable_id, process_date, ref_month, ref_year, value)"
+        " values (1, 1, '2022-03-01', 2, 2022, ?)",
+        [(10.5,), (12.25,)],
+    )
+    conn.commit()
+    # Duplicated payments of a contract and month are reported, not removed
+    with raises(DuplicatePayments) as error:
+        migrate(conn)
+    assert error.value.duplicates == [("tb_perhourpayment", 1, 2022, 2, [1, 2])]
+    version = MIGRATIONS.index(create_indexes)
+    assert schema_version(conn) == version
+    rows = conn.execute("select id, value from tb_perhourpayment").fetchall()
+    assert rows == [(1, 1050), (2, 1225)]
+
+    conn.execute("delete from tb_perhourpayment where id = 1")
+    conn.commit()
+    assert migrate(conn) == list(range(version + 1, SCHEMA_VERSION + 1))
+    conn.close()
+
+
+def test_migrate_money_resumes_interrupted_conversion():
+    """Assert if rows left in a renamed float table by an interrupted
+    conversion are copied on, once"""
+    conn = connect(":memory:")
+    conn.execute(
+        """
+        create table tb_earning_float (
+            id integer primary key autoincrement,
+            "date" timestamp not null,
+            value float not null
+        )
+        """
+    )
+    conn.executemany(
+        "insert into tb_earning_float (\"date\", value) values ('2022-03-01', ?)",
+        [(10.5,), (12.25,)],
+    )
+    conn.execute(
+        "create table tb_earning (id integer primary key autoincrement,"
+        ' "date" timestamp not null, value integer not null)'
+    )
+    conn.execute("insert into tb_earning values (1, '2022-03-01', 1050)")
+    conn.commit()
+    migrate(conn)
+    rows = conn.execute("select id, value from tb_earning").fetchall()
+    assert rows == [(1, 1050), (2, 1225)]
+    tables = conn.execute("select name from sqlite_master where name like '%_float'")
+    assert tables.fetchall() == []
+    conn.close()
+
+
+def test_migrate_run_log_period():
+    """Assert if runs logged before reference periods keep their rows and
+    get empty periods"""
+    conn = connect(":memory:")
+    migrate(conn, MIGRATIONS.index(create_indexes))
+    conn.execute("drop table tb_run")
+    conn.execute(
+        """
+        create table tb_run (
+            id integer primary key autoincrement,
+            started timestamp not null,
+            finished timestamp,
+            watermark integer not null,
+            rows integer
+        )
+        """
+    )
+    conn.execute("insert into tb_run (started, watermark) values ('2022-03-01', 5)")
+    conn.commit()
+    migrate(conn)
+    rows = conn.execute("select watermark, ref_year, ref_month from tb_run")
+    assert rows.fetchall() == [(5, None, None)]
+    conn.close()
+
+
+def test_one_payment_per_contract_and_month():
+    """Assert if a second payment of a contract and month is refused"""
+    conn = connect(":memory:")
+    migrate(conn)
+    payment = PerHourPayment(1, 1, datetime(2022, 3, 1), 2, 2022, "10.00")
+    payment.save(conn)
+    with raises(sqlite3.IntegrityError):
+        PerHourPayment(1, 1, datetime(2022, 4, 1), 2, 2022, "10.00").save(conn)
+    conn.close()
+
+
+@mark.parametrize("name", list(hot_queries()))
+def test_hot_queries_use_indexes(name):
+    """Assert if pipeline queries never read a whole table"""
+    conn = connect(":memory:")
+    migrate(conn)
+    sql = hot_queries()[name]
+    params = [1] * sql.count("?")
+    assert query_plan(conn, sql, params)
+    assert full_scans(conn, sql, params) == []
+    conn.close()
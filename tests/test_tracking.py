@@ -0,0 +1,214 @@
+"""Module for testing tracking.py, Controller incremental runs and backfills"""
+
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+from pytest import fixture, raises
+from calc_seduc.connection import connect
+from calc_seduc.controller import Controller
+from calc_seduc.models import (
+    Contract,
+    ContractFactory,
+    PaymentTable,
+    PaymentTableFactory,
+    School,
+)
+from calc_seduc.parallel import ChunkFailure
+from calc_seduc.processors import NoPaymentTable, PerHourProcessor
+from calc_seduc.schema import create_schema
+from calc_seduc.tracking import RunLog, months_between
+
+
+@fixture
+def tracked():
+    """Fixture with a tracked database holding three contracts"""
+    conn = connect(":memory:")
+    create_schema(conn)
+    School(name="EEFM TEST", inep=1).save(conn)
+    starts, ends = datetime(2022, 1, 1), datetime(2022, 12, 31)
+    for hours in (4, 10, 20):
+        Contract(1, "1", starts, ends, hours).save(conn)
+    PaymentTable(starts, ends, Decimal(10), Decimal(0), Decimal(0)).save(conn)
+    yield conn
+    conn.close()
+
+
+def run(conn, tmp_path, ref_month=2) -> Controller:
+    controller = Controller(
+        contract_factory=ContractFactory(),
+        ptable_factory=PaymentTableFactory,
+        processor=PerHourProcessor,
+        conn=conn,
+        export_path=str(tmp_path / "payments.csv"),
+        ref_month=ref_month,
+        incremental=True,
+    )
+    controller()
+    return controller
+
+
+def payments(conn):
+    cur = conn.execute(
+        "select contract_id, value from tb_perhourpayment order by contract_id"
+    )
+    return cur.fetchall()
+
+
+def test_incremental_first_run_processes_everything(tracked, tmp_path):
+    """Assert if a run without previous runs processes every contract"""
+    assert len(run(tracked, tmp_path).unprocessed) == 3
+    run_log = RunLog(tracked)
+    assert run_log.last_watermark(2022, 2) == run_log.current_watermark()
+    assert run_log.last_watermark(2022, 3) is None
+
+
+def test_incremental_run_without_changes(tracked, tmp_path):
+    """Assert if a run without changes processes nothing"""
+    run(tracked, tmp_path)
+    assert run(tracked, tmp_path).unprocessed == []
+    assert len(payments(tracked)) == 3
+
+
+def test_incremental_run_replaces_changed_contract(tracked, tmp_path):
+    """Assert if only an edited contract is processed and its payment replaced"""
+    run(tracked, tmp_path)
+    before = payments(tracked)
+    contract = ContractFactory().get(1, tracked)
+    contract.hours = 40
+    contract.save(tracked)
+    controller = run(tracked, tmp_path)
+    after = payments(tracked)
+    assert [c.id for c in controller.unprocessed] == [1]
+    assert len(after) == 3
+    assert after[1:] == before[1:] and after[0][1] > before[0][1]
+
+
+def test_incremental_runs_of_another_period(tracked, tmp_path):
+    """Assert if the first run of a period processes every contract, even
+    after a run of another period"""
+    run(tracked, tmp_path)
+    assert len(run(tracked, tmp_path, ref_month=3).unprocessed) == 3
+    assert run(tracked, tmp_path, ref_month=3).unprocessed == []
+    cur = tracked.execute(
+        "select ref_month, count(*) from tb_perhourpayment group by 1 order by 1"
+    )
+    assert cur.fetchall() == [(2, 3), (3, 3)]
+
+
+def test_incremental_run_with_many_changed_contracts(tracked, tmp_path):
+    """Assert if changed contracts are fetched in chunks, below sqlite oldest
+    variable limit"""
+    run(tracked, tmp_path)
+    tracked.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    starts, ends = datetime(2022, 1, 1), datetime(2022, 12, 31)
+    Contract.save_many(
+        [Contract(1, str(i), starts, ends, 4) for i in range(1200)], conn=tracked
+    )
+    controller = Controller(
+        contract_factory=ContractFactory(),
+        ptable_factory=PaymentTableFactory,
+        processor=PerHourProcessor,
+        conn=tracked,
+        incremental=True,
+    )
+    controller.get_non_processed_contracts()
+    assert [c.id for c in controller.unprocessed] == list(range(4, 1204))
+
+
+def test_incremental_run_with_failures_is_retried(tracked, tmp_path):
+    """Assert if a run with failed chunks doesn't advance the watermark, so
+    the next run processes their contracts again"""
+    run(tracked, tmp_path)
+    run_log = RunLog(tracked)
+    watermark = run_log.last_watermark(2022, 2)
+    contract = ContractFactory().get(1, tracked)
+    contract.hours = 40
+    contract.save(tracked)
+
+    controller = Controller(
+        contract_factory=ContractFactory(),
+        ptable_factory=PaymentTableFactory,
+        processor=PerHourProcessor,
+        conn=tracked,
+        incremental=True,
+    )
+    controller.get_non_processed_contracts()
+    controller.failures.append(ChunkFailure(0, [1], "ValueError()"))
+    controller.save_data()
+    assert run_log.last_watermark(2022, 2) == watermark
+
+    assert [c.id for c in run(tracked, tmp_path).unprocessed] == [1]
+    assert run_log.last_watermark(2022, 2) == run_log.current_watermark()
+    assert len(payments(tracked)) == 3
+
+
+def test_incremental_run_after_payment_table_change(tracked, tmp_path):
+    """Assert if changing a payment table reprocesses its periods"""
+    run(tracked, tmp_path)
+    ptable = PaymentTableFactory().get(1, tracked)
+    ptable.hour_value = Decimal(20)
+    ptable.save(tracked)
+    assert len(run(tracked, tmp_path).unprocessed) == 3
+    assert len(payments(tracked)) == 3
+
+
+def test_months_between_across_years():
+    """Assert if months between two dates cross years"""
+    assert months_between(datetime(2021, 11, 5), datetime(2022, 2, 1)) == {
+        (2021, 11),
+        (2021, 12),
+        (2022, 1),
+        (2022, 2),
+    }
+
+
+def backfill_controller(conn, tmp_path) -> Controller:
+    return Controller(
+        contract_factory=ContractFactory(),
+        ptable_factory=PaymentTableFactory,
+        processor=PerHourProcessor,
+        conn=conn,
+        export_path=str(tmp_path / "payments.csv"),
+        batch_size=2,
+    )
+
+
+def test_backfill_pairs_contracts_with_active_months(tracked, tmp_path):
+    """Assert if backfill only pays the months each contract was active in"""
+    Contract(1, "2", datetime(2022, 3, 15), datetime(2022, 4, 10), 6).save(tracked)
+    saved = backfill_controller(tracked, tmp_path).backfill(
+        datetime(2022, 2, 1), datetime(2022, 5, 31)
+    )
+    cur = tracked.execute(
+        "select ref_month from tb_perhourpayment where contract_id = 4 order by 1"
+    )
+    assert [row[0] for row in cur] == [3, 4]
+    assert saved == 3 * 4 + 2
+
+
+def test_backfill_is_idempotent(tracked, tmp_path):
+    """Assert if backfilling the same range twice saves nothing new"""
+    controller = backfill_controller(tracked, tmp_path)
+    first = controller.backfill(datetime(2022, 1, 1), datetime(2022, 12, 31))
+    assert first == 36
+    assert controller.backfill(datetime(2022, 1, 1), datetime(2022, 12, 31)) == 0
+    assert len(payments(tracked)) == 36
+
+
+def test_backfill_uses_bulk_load_profile(tracked, tmp_path):
+    """Assert if backfills save with the bulk load profile and restore it"""
+    controller = backfill_controller(tracked, tmp_path)
+    controller.backfill(datetime(2022, 1, 1), datetime(2022, 3, 31))
+    (stage,) = controller.instrumentation.stages
+    assert stage.extra["sqlite"]["profile"] == "bulk_load"
+    assert stage.extra["sqlite"]["synchronous"] == "normal"
+    assert tracked.execute("pragma cache_size").fetchone()[0] == -64_000
+
+
+def test_backfill_without_payment_table(tracked, tmp_path):
+    """Assert if a range without payment table fails before saving anything"""
+    with raises(NoPaymentTable):
+        backfill_controller(tracked, tmp_path).backfill(
+            datetime(2022, 12, 1), datetime(2023, 1, 31)
+        )
+    assert payments(tracked) == []